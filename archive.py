@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+import zlib
+from tortoise.transactions import in_transaction
+from models import CommentArchive
+from config import ARCHIVE_AFTER, ARCHIVE_INTERVAL, ARCHIVE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Отправленные и неудачные комментарии старше порога. SKIP LOCKED - чтобы не ждать записи,
+# которые прямо сейчас обновляет другой процесс
+SELECT_ARCHIVABLE_SQL = """
+SELECT * FROM comments
+WHERE status IN ('sent', 'failed') AND created_at < NOW() - make_interval(secs => $1)
+ORDER BY id
+LIMIT $2
+FOR UPDATE SKIP LOCKED
+"""
+
+INSERT_ARCHIVE_SQL = """
+INSERT INTO comments_archive (id, channel_id, message_id, status, created_at, sent_at, archived_at, payload)
+VALUES ($1, $2, $3, $4, $5, $6, NOW(), $7)
+ON CONFLICT (id) DO NOTHING
+"""
+
+DELETE_ARCHIVED_SQL = "DELETE FROM comments WHERE id = ANY($1::int[])"
+
+# Пауза между пачками, чтобы архивация не занимала базу целиком
+BATCH_PAUSE = 1
+
+
+def compress_row(row: dict) -> bytes:
+    """Сжимает запись комментария для архива"""
+    return zlib.compress(json.dumps(row, ensure_ascii=False, default=str).encode("utf-8"), 9)
+
+
+def decompress_row(payload: bytes) -> dict:
+    """Распаковывает запись комментария из архива"""
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+async def get_archived_comment(comment_id: int) -> dict:
+    """
+    Возвращает полную запись комментария из архива
+
+    Args:
+        comment_id: ID записи комментария
+
+    Returns:
+        dict: Поля записи комментария (даты - строками ISO) или None
+    """
+    archived = await CommentArchive.get_or_none(id=comment_id)
+    if archived is None:
+        return None
+    return decompress_row(archived.payload)
+
+
+async def archive_batch() -> int:
+    """
+    Переносит одну пачку старых комментариев из горячей таблицы в архив
+
+    Returns:
+        int: Количество перенесенных записей
+    """
+    async with in_transaction() as conn:
+        rows = await conn.execute_query_dict(SELECT_ARCHIVABLE_SQL, [ARCHIVE_AFTER, ARCHIVE_BATCH_SIZE])
+        if not rows:
+            return 0
+
+        await conn.execute_many(INSERT_ARCHIVE_SQL, [
+            [row["id"], row["channel_id"], row["message_id"], row["status"],
+             row["created_at"], row["sent_at"], compress_row(row)]
+            for row in rows
+        ])
+        await conn.execute_query(DELETE_ARCHIVED_SQL, [[row["id"] for row in rows]])
+    return len(rows)
+
+
+async def archive_old_comments() -> int:
+    """
+    Переносит в архив все комментарии, ставшие достаточно старыми
+
+    Returns:
+        int: Количество перенесенных записей
+    """
+    total = 0
+    while True:
+        archived = await archive_batch()
+        total += archived
+        if archived < ARCHIVE_BATCH_SIZE:
+            break
+        await asyncio.sleep(BATCH_PAUSE)
+
+    if total:
+        logger.info(f"🗄️  В архив перенесено комментариев: {total}")
+    return total
+
+
+async def archive_loop():
+    """Периодически переносит старые комментарии в архив"""
+    while True:
+        try:
+            await archive_old_comments()
+        except Exception as e:
+            logger.error(f"Ошибка при архивации комментариев: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
@@ -0,0 +1,68 @@
+import logging
+from datetime import datetime
+from openai_handler import FALLBACK_COMMENT, self_check_comment
+from config import AUTO_PUBLISH_MAX_LENGTH
+
+logger = logging.getLogger(__name__)
+
+
+def in_quiet_hours(quiet_hours: list, hour: int) -> bool:
+    """
+    Проверяет, попадает ли час в тихие часы
+
+    Args:
+        quiet_hours: [начало, конец) в часах по локальному времени сервера, например [23, 8]
+        hour: Текущий час
+
+    Returns:
+        bool: True если сейчас тихие часы
+    """
+    start, end = quiet_hours
+    if start <= end:
+        return start <= hour < end
+    # Интервал через полночь
+    return hour >= start or hour < end
+
+
+async def check_auto_publish(channel_info: dict, post_text: str, comment: str) -> tuple:
+    """
+    Проверяет, можно ли опубликовать комментарий без подтверждения администратора
+
+    Правила задаются в конфигурации канала в ключе "auto_publish".
+
+    Args:
+        channel_info: Конфигурация канала
+        post_text: Текст поста
+        comment: Сгенерированный комментарий
+
+    Returns:
+        tuple: (можно ли публиковать, причина решения или None, если автопубликация выключена,
+            токены и стоимость самопроверки моделью или {}, если она не выполнялась)
+    """
+    rules = channel_info.get("auto_publish")
+    if not rules or not rules.get("enabled", True):
+        return False, None, {}
+
+    if comment == FALLBACK_COMMENT:
+        return False, "отклонен: комментарий-заглушка после ошибки генерации", {}
+
+    max_length = rules.get("max_length", AUTO_PUBLISH_MAX_LENGTH)
+    if len(comment) > max_length:
+        return False, f"отклонен: длина {len(comment)} больше {max_length}", {}
+
+    lowered_comment = comment.lower()
+    for word in rules.get("banned_words", []):
+        if word.lower() in lowered_comment:
+            return False, f"отклонен: запрещенное слово '{word}'", {}
+
+    quiet_hours = rules.get("quiet_hours")
+    if quiet_hours and in_quiet_hours(quiet_hours, datetime.now().hour):
+        return False, f"отклонен: тихие часы {quiet_hours[0]}-{quiet_hours[1]}", {}
+
+    if rules.get("self_check", True):
+        approved, usage = await self_check_comment(post_text, comment)
+        if not approved:
+            return False, "отклонен: не прошел самопроверку", usage
+        return True, "одобрен: все проверки пройдены", usage
+
+    return True, "одобрен: все проверки пройдены", {}
@@ -0,0 +1,92 @@
+"""
+Замер памяти на один собираемый пост (альбом)
+
+Сравнивает прежнее хранение (сообщения Telethon в message_groups и фото списком base64 строк)
+с компактным PostSnapshot, в котором остаются только ID, текст, дата и содержимое фото в байтах.
+
+Запуск из корня проекта:
+    python -m benchmarks.post_memory [количество альбомов] [фото в альбоме] [размер фото в КБ]
+"""
+import base64
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+from telethon.tl.types import Message, MessageMediaPhoto, Photo, PhotoSize, PeerChannel
+from post_snapshot import PostSnapshot, PostPhoto
+
+CHANNEL_ID = -1001234567890
+CHAT_ID = 1234567891
+
+
+def make_message(message_id: int, grouped_id: int, text: str) -> Message:
+    """Сообщение альбома в чате обсуждения, как его отдает Telethon"""
+    photo = Photo(
+        id=message_id, access_hash=message_id * 7, file_reference=os.urandom(32),
+        date=datetime.now(timezone.utc), dc_id=2,
+        sizes=[PhotoSize(type=size_type, w=side, h=side, size=side * side // 10)
+               for size_type, side in (("s", 90), ("m", 320), ("x", 800), ("y", 1280))],
+    )
+    return Message(
+        id=message_id, peer_id=PeerChannel(CHAT_ID), date=datetime.now(timezone.utc), message=text,
+        from_id=PeerChannel(CHANNEL_ID), grouped_id=grouped_id, media=MessageMediaPhoto(photo=photo),
+    )
+
+
+def build_old(albums: int, photos: int, photo_bytes: list) -> list:
+    """Прежнее хранение: сообщения альбома и фото в base64"""
+    posts = []
+    for album in range(albums):
+        messages = [make_message(album * photos + index, album, f"Текст поста {album}") for index in range(photos)]
+        posts.append((messages, [base64.b64encode(data).decode("utf-8") for data in photo_bytes]))
+    return posts
+
+
+def build_new(albums: int, photos: int, photo_bytes: list) -> list:
+    """Компактный PostSnapshot: ссылка на фото Telegram заменяется содержимым после скачивания"""
+    posts = []
+    for album in range(albums):
+        snapshot = PostSnapshot("bench", CHANNEL_ID)
+        for index in range(photos):
+            message = make_message(album * photos + index, album, f"Текст поста {album}")
+            snapshot.source_ids.append(message.id)
+            if snapshot.message_id is None:
+                snapshot.message_id = message.id
+                snapshot.date = message.date
+            snapshot.add_text(message.text)
+            # Каждый пост хранит свою копию содержимого, как после скачивания
+            snapshot.photos.append(PostPhoto(message_id=message.id, data=bytes(bytearray(photo_bytes[index]))))
+        posts.append(snapshot)
+    return posts
+
+
+def measure(build, *args) -> int:
+    """Сколько байт занимают построенные посты вместе с их фото"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    posts = build(*args)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del posts
+    return size
+
+
+def main():
+    albums = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    photos = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    photo_kb = int(sys.argv[3]) if len(sys.argv) > 3 else 150
+    photo_bytes = [os.urandom(photo_kb * 1024) for _ in range(photos)]
+
+    old_size = measure(build_old, albums, photos, photo_bytes)
+    new_size = measure(build_new, albums, photos, photo_bytes)
+    content = photos * photo_kb * 1024
+    overhead = {"old": old_size // albums - content * 4 // 3, "new": new_size // albums - content}
+    print(f"Альбомов: {albums}, фото в альбоме: {photos} по {photo_kb} КБ")
+    print(f"Сообщения Telethon + base64: {old_size / albums / 1024:.1f} КБ на пост "
+          f"(без фото {overhead['old']} байт)")
+    print(f"PostSnapshot:                {new_size / albums / 1024:.1f} КБ на пост "
+          f"(без фото {overhead['new']} байт)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,69 @@
 import logging
 import asyncio
+import html
+import secrets
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timedelta, timezone
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import (
+    Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, InputMediaPhoto,
+    BufferedInputFile
+)
 from aiogram.filters import Command
 from aiogram.exceptions import TelegramBadRequest
-from models import Comment, CommentStatus
-from config import BOT_TOKEN, ADMIN_USER_ID
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from models import Comment, CommentStatus, CommentArchive
+from config import (
+    BOT_TOKEN, ADMIN_USER_ID, DIGEST_RATE_THRESHOLD, DIGEST_WINDOW, DIGEST_MAX_ITEMS, FILE_ID_CACHE_SIZE,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, SHUTDOWN_TIMEOUT
+)
 from channels_config import CHANNELS
+from media_store import hash_from_path
+from post_snapshot import PostSnapshot
+from publisher import set_send_comment_function, publish_comment, publish_batch, get_chat_link_id, get_comment_url
+from diagnostics import profile_loop, format_slow_callbacks
+from outbound import outbound_queue
+from stats import format_stats
 # Импорт send_comment_to_post убран для избежания циклического импорта
 
 logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
+# Все запросы к Bot API проходят через очередь с ограничением частоты и повторами
+bot.session.middleware(outbound_queue)
 dp = Dispatcher()
 
 # Глобальная переменная для контроля работы бота
 _bot_running = True
 
-# Глобальная переменная для функции отправки комментариев
-_send_comment_func = None
+# Событие остановки встроенного сервера в режиме webhook
+_webhook_stop = asyncio.Event()
+# Запущен ли polling (в режиме webhook его останавливать не нужно)
+_polling = False
+# Установлено, когда бот получает обновления (запущен polling или зарегистрирован webhook)
+bot_ready = asyncio.Event()
 
+# Время запросов превью за последнюю минуту (для определения всплесков)
+_preview_times = deque()
+# Включен ли сейчас режим дайджеста
+_digest_mode = False
+# Превью, ожидающие отправки в дайджесте
+_digest_items = []
+# Задача отложенной отправки дайджеста
+_digest_task = None
 
-def set_send_comment_function(func):
-    """Устанавливает функцию для отправки комментариев"""
-    global _send_comment_func
-    _send_comment_func = func
+# Кэш file_id уже загруженных в бот фото: {sha256 содержимого: file_id}
+_file_id_cache = OrderedDict()
+
+# Фоновые публикации по кнопкам превью: {ID записи комментария: задача}
+_publish_tasks = {}
+# Сколько публикаций идет по каждому сообщению превью: {(chat_id, message_id): количество}
+_publishing_messages = Counter()
+# Последняя отправленная клавиатура превью, пока по нему идут публикации: {(chat_id, message_id): клавиатура}
+_preview_markups = {}
 
 
 @dp.message(Command("start"))
@@ -36,116 +74,544 @@ async def cmd_start(message: Message):
         return
     
     text = "🤖 Бот для мониторинга каналов\n\nБот активен и отслеживает посты в настроенных каналах. Уведомления о новых постах будут приходить автоматически."
+    text += ("\n\nКоманды:\n"
+             "/approve_all - опубликовать все ожидающие комментарии\n"
+             "/approve_channel <канал> - опубликовать ожидающие комментарии канала\n"
+             "/approve_recent <часы> - опубликовать ожидающие комментарии за последние N часов\n"
+             "/profile <секунды> [sample] - профилировать процесс и прислать отчет файлом\n"
+             "/slow - блокировки цикла событий\n"
+             "/stats [дни] - стоимость, токены и процентили длительностей по каналам")
     await message.answer(text)
 
 
+async def approve_pending(message: Message, comment_records: list, title: str):
+    """
+    Публикует пачку ожидающих комментариев и показывает прогресс в одном сообщении
+
+    Args:
+        message: Сообщение с командой
+        comment_records: Записи комментариев со статусом PENDING
+        title: Описание выборки для сообщения о прогрессе
+    """
+    if not comment_records:
+        await message.answer(f"ℹ️ Нет ожидающих комментариев: {title}")
+        return
+
+    progress_message = await message.answer(f"📤 Публикация ({title}): 0/{len(comment_records)}")
+    last_edit = 0.0
+
+    async def report_progress(counters: dict):
+        nonlocal last_edit
+        # Редактируем сообщение не чаще раза в 2 секунды, чтобы не упереться в лимиты Bot API
+        if counters["done"] < counters["total"] and time.monotonic() - last_edit < 2:
+            return
+        last_edit = time.monotonic()
+        text = (f"📤 Публикация ({title}): {counters['done']}/{counters['total']}\n"
+                f"✅ Отправлено: {counters['sent']}\n❌ Ошибок: {counters['failed']}")
+        if counters["done"] == counters["total"]:
+            text = text.replace("📤 Публикация", "🏁 Публикация завершена", 1)
+        try:
+            await progress_message.edit_text(text)
+        except TelegramBadRequest as e:
+            logger.warning(f"Не удалось обновить прогресс публикации: {e}")
+
+    await publish_batch(comment_records, report_progress)
+
+
+@dp.message(Command("approve_all"))
+async def cmd_approve_all(message: Message):
+    """Обработчик команды /approve_all - публикует все ожидающие комментарии"""
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("❌ У вас нет доступа к этому боту.")
+        return
+
+    comment_records = await Comment.filter(status=CommentStatus.PENDING).order_by("id")
+    await approve_pending(message, comment_records, "все каналы")
+
+
+@dp.message(Command("approve_channel"))
+async def cmd_approve_channel(message: Message):
+    """Обработчик команды /approve_channel <название или ID канала>"""
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("❌ У вас нет доступа к этому боту.")
+        return
+
+    query = message.text.partition(" ")[2].strip()
+    if not query:
+        await message.answer("Использование: /approve_channel <название или ID канала>")
+        return
+
+    channel_name, channel_id = None, None
+    for name, channel_info in CHANNELS.items():
+        if query == str(channel_info["channel_id"]) or query.lower() in name.lower():
+            channel_name, channel_id = name, channel_info["channel_id"]
+            break
+
+    if channel_id is None:
+        await message.answer(f"❌ Канал не найден: {query}")
+        return
+
+    comment_records = await Comment.filter(
+        status=CommentStatus.PENDING,
+        channel_id=channel_id
+    ).order_by("id")
+    await approve_pending(message, comment_records, channel_name)
+
+
+@dp.message(Command("approve_recent"))
+async def cmd_approve_recent(message: Message):
+    """Обработчик команды /approve_recent <часы> - публикует комментарии за последние N часов"""
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("❌ У вас нет доступа к этому боту.")
+        return
+
+    try:
+        hours = float(message.text.partition(" ")[2].strip())
+    except ValueError:
+        await message.answer("Использование: /approve_recent <количество часов>")
+        return
+
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    comment_records = await Comment.filter(
+        status=CommentStatus.PENDING,
+        created_at__gte=since
+    ).order_by("id")
+    await approve_pending(message, comment_records, f"за последние {hours:g} ч")
+
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: Message):
+    """Обработчик команды /profile <секунды> [sample] - профилирует процесс и присылает отчет"""
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("❌ У вас нет доступа к этому боту.")
+        return
+
+    args = message.text.split()[1:]
+    try:
+        seconds = float(args[0]) if args else 30
+    except ValueError:
+        await message.answer("Использование: /profile <секунды> [sample]")
+        return
+    mode = "sample" if len(args) > 1 and args[1].lower() == "sample" else "cprofile"
+
+    await message.answer(f"🔬 Профилирование ({mode}) на {seconds:g} с...")
+    try:
+        report = await profile_loop(seconds, mode)
+    except RuntimeError as e:
+        await message.answer(f"❌ {e}")
+        return
+
+    filename = f"profile-{mode}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+    await message.answer_document(
+        BufferedInputFile(report.encode("utf-8"), filename=filename),
+        caption=f"🔬 Профиль за {seconds:g} с ({mode})"
+    )
+
+
+@dp.message(Command("slow"))
+async def cmd_slow(message: Message):
+    """Обработчик команды /slow - показывает блокировки цикла событий"""
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("❌ У вас нет доступа к этому боту.")
+        return
+
+    await message.answer(format_slow_callbacks())
+
+
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message):
+    """Обработчик команды /stats [дни] - стоимость, токены и процентили длительностей по каналам"""
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("❌ У вас нет доступа к этому боту.")
+        return
+
+    argument = message.text.partition(" ")[2].strip()
+    try:
+        days = int(argument) if argument else 7
+        if days < 1:
+            raise ValueError
+    except ValueError:
+        await message.answer("Использование: /stats [количество дней]")
+        return
+
+    await message.answer(await format_stats(days), parse_mode="HTML")
+
+
 @dp.callback_query(F.data.startswith("send:"))
 async def send_comment_handler(callback: CallbackQuery):
-    """Обработчик отправки комментария"""
+    """
+    Обработчик отправки комментария
+
+    Нажатие подтверждается сразу, публикация выполняется в фоновой задаче,
+    а ее ход и результат отображаются на кнопке превью.
+    """
     if callback.from_user.id != ADMIN_USER_ID:
         await callback.answer("❌ У вас нет доступа к этому боту.")
         return
-    
+
     try:
         # Извлекаем comment_record_id из callback_data
         _, comment_record_id_str = callback.data.split(":")
         comment_record_id = int(comment_record_id_str)
-        
-        logger.info(f"Ищем комментарий по ID записи: {comment_record_id}")
-        
+    except ValueError:
+        await callback.answer("❌ Некорректная кнопка")
+        return
+
+    if comment_record_id in _publish_tasks:
+        await callback.answer("⏳ Комментарий уже отправляется")
+        return
+
+    _publishing_messages[(callback.message.chat.id, callback.message.message_id)] += 1
+    task = asyncio.create_task(publish_from_preview(callback, comment_record_id))
+    _publish_tasks[comment_record_id] = task
+    task.add_done_callback(lambda _: _publish_tasks.pop(comment_record_id, None))
+    await callback.answer("⏳ Отправляем комментарий...")
+
+
+async def publish_from_preview(callback: CallbackQuery, comment_record_id: int):
+    """
+    Публикует комментарий по кнопке превью и обновляет кнопку: ход отправки, затем ссылка или ошибка
+
+    Args:
+        callback: Нажатие кнопки превью
+        comment_record_id: ID записи комментария
+    """
+    message = callback.message
+    message_key = (message.chat.id, message.message_id)
+    try:
+        await update_preview_button(message, callback.data, "⏳", "Отправляется...")
+
         # Получаем комментарий из БД по ID записи
         logger.info(f"Ищем запись с ID {comment_record_id} и статусом PENDING")
         comment_record = await Comment.filter(
             id=comment_record_id,
             status=CommentStatus.PENDING
         ).first()
-        
+
         # Если не найден PENDING, проверим запись с этим ID
         if not comment_record:
             logger.info(f"PENDING запись не найдена, ищем любую запись с ID {comment_record_id}")
             comment_record = await Comment.filter(id=comment_record_id).first()
-            
+
             if comment_record:
                 logger.info(f"Запись найдена, но статус: {comment_record.status}")
                 logger.info(f"Детали записи: channel_id={comment_record.channel_id}, message_id={comment_record.message_id}")
+            elif await CommentArchive.exists(id=comment_record_id):
+                logger.info(f"Запись с ID {comment_record_id} перенесена в архив")
             else:
                 logger.error(f"Запись с ID {comment_record_id} не найдена в БД!")
-            
-            await callback.answer("❌ Комментарий не найден или уже отправлен")
+
+            await update_preview_button(message, callback.data, "❌", "Не найден или уже отправлен")
             return
-        
+
         logger.info(f"✅ Найдена PENDING запись: ID={comment_record.id}, channel_id={comment_record.channel_id}, message_id={comment_record.message_id}")
-        
-        # Отправляем комментарий через Telethon
-        if not _send_comment_func:
-            await callback.answer("❌ Функция отправки комментариев не инициализирована")
-            return
-            
-        success = await _send_comment_func(comment_record)
-        
-        if success:
-            # Обновляем статус в БД
-            comment_record.status = CommentStatus.SENT
-            await comment_record.save()
-            
-            # Создаем ссылку на комментарий
-            # Формат: https://t.me/c/{chat_id}/{sent_message_id}
-            chat_id = None
-            for channel_name, channel_info in CHANNELS.items():
-                if channel_info["channel_id"] == comment_record.channel_id:
-                    chat_id = channel_info["chat_id"]
-                    break
-            
-            if chat_id and comment_record.sent_message_id:
-                # Убираем знак минус и добавляем 1000000000000 для каналов
-                if chat_id < 0:
-                    chat_id_str = str(chat_id)[4:]  # Убираем -100
-                else:
-                    chat_id_str = str(chat_id)
-                
-                comment_url = f"https://t.me/c/{chat_id_str}/{comment_record.sent_message_id}"
-                
-                # Создаем кнопку "Посмотреть комментарий"
-                markup = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(
-                        text="👀 Посмотреть комментарий", 
-                        url=comment_url
-                    )]
-                ])
-                
-                # Редактируем сообщение с кнопкой
-                await callback.message.edit_reply_markup(reply_markup=markup)
-                await callback.answer("✅ Комментарий успешно отправлен!")
+
+        # Отправляем комментарий через Telethon и обновляем статус в БД
+        success = await publish_comment(comment_record)
+
+        if not success:
+            if comment_record.status == CommentStatus.PENDING:
+                # Запись уже взята другой публикацией (например, командой /approve_*)
+                await update_preview_button(message, callback.data, "⏳", "Уже отправляется")
             else:
-                await callback.answer("✅ Комментарий отправлен, но ссылка недоступна")
+                await update_preview_button(message, callback.data, "❌", "Не удалось отправить")
+            return
+
+        # Создаем ссылку на комментарий
+        # Формат: https://t.me/c/{chat_id}/{sent_message_id}
+        comment_url = get_comment_url(comment_record)
+        if comment_url:
+            await update_preview_button(message, callback.data, comment_url=comment_url)
         else:
-            # Обновляем статус на failed
-            comment_record.status = CommentStatus.FAILED
-            await comment_record.save()
-            
-            await callback.answer("❌ Не удалось отправить комментарий")
-            
+            await update_preview_button(message, callback.data, "✅", "Отправлен, ссылка недоступна")
+
     except Exception as e:
         logger.error(f"Ошибка при отправке комментария: {e}")
-        await callback.answer("❌ Произошла ошибка при отправке комментария")
+        try:
+            await update_preview_button(message, callback.data, "❌", "Ошибка при отправке")
+        except Exception as edit_error:
+            logger.error(f"Не удалось показать ошибку на кнопке превью: {edit_error}")
+    finally:
+        # Клавиатура больше не нужна, если по этому сообщению ничего не отправляется
+        _publishing_messages[message_key] -= 1
+        if _publishing_messages[message_key] <= 0:
+            del _publishing_messages[message_key]
+            _preview_markups.pop(message_key, None)
+
 
+async def update_preview_button(message: Message, callback_data: str, emoji: str = None,
+                                status: str = None, comment_url: str = None):
+    """
+    Заменяет нажатую кнопку превью: статусом отправки или ссылкой на отправленный комментарий
+
+    Клавиатура строится от последней отправленной версии, чтобы одновременные отправки
+    из одного дайджеста не затирали кнопки друг друга.
 
-async def send_comment_preview(channel_name: str, channel_id: int, message_id: int, 
-                             post_text: str, comment: str, comment_record_id: int, 
-                             photo_path: str = None, photo_paths: list = None):
+    Args:
+        message: Сообщение превью
+        callback_data: callback_data нажатой кнопки
+        emoji: Значок статуса
+        status: Текст статуса
+        comment_url: Ссылка на отправленный комментарий (вместо статуса)
+    """
+    message_key = (message.chat.id, message.message_id)
+    markup = _preview_markups.get(message_key, message.reply_markup)
+    if comment_url:
+        markup = build_sent_markup(markup, callback_data, comment_url)
+    else:
+        markup = build_status_markup(markup, callback_data, emoji, status)
+    _preview_markups[message_key] = markup
+
+    try:
+        await message.edit_reply_markup(reply_markup=markup)
+    except TelegramBadRequest as e:
+        logger.warning(f"Не удалось обновить кнопку превью: {e}")
+
+
+def build_status_markup(markup: InlineKeyboardMarkup, callback_data: str, emoji: str, status: str) -> InlineKeyboardMarkup:
+    """
+    Формирует клавиатуру со статусом отправки на месте нажатой кнопки
+
+    Кнопка сохраняет callback_data: повторное нажатие снова приходит в send_comment_handler.
+    В дайджесте кнопка сохраняет номер и начало комментария, меняется только значок.
+
+    Args:
+        markup: Текущая клавиатура сообщения
+        callback_data: callback_data нажатой кнопки
+        emoji: Значок статуса
+        status: Текст статуса (для обычного превью)
+
+    Returns:
+        InlineKeyboardMarkup: Новая клавиатура
+    """
+    rows = markup.inline_keyboard if markup else []
+    callback_buttons = [button for row in rows for button in row if button.callback_data]
+
+    new_rows = []
+    for row in rows:
+        new_row = []
+        for button in row:
+            if button.callback_data == callback_data:
+                label = button.text.lstrip("🔴⏳❌✅ ") if len(callback_buttons) > 1 else status
+                button = InlineKeyboardButton(text=f"{emoji} {label}", callback_data=callback_data)
+            new_row.append(button)
+        new_rows.append(new_row)
+    return InlineKeyboardMarkup(inline_keyboard=new_rows)
+
+
+def build_sent_markup(markup: InlineKeyboardMarkup, callback_data: str, comment_url: str) -> InlineKeyboardMarkup:
+    """
+    Формирует клавиатуру сообщения после отправки комментария
+
+    Для обычного превью клавиатура заменяется кнопкой со ссылкой на комментарий,
+    в дайджесте заменяется только кнопка отправленного поста.
+
+    Args:
+        markup: Текущая клавиатура сообщения
+        callback_data: callback_data нажатой кнопки
+        comment_url: Ссылка на отправленный комментарий
+
+    Returns:
+        InlineKeyboardMarkup: Новая клавиатура
+    """
+    rows = markup.inline_keyboard if markup else []
+    callback_buttons = [button for row in rows for button in row if button.callback_data]
+
+    if len(callback_buttons) <= 1:
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="👀 Посмотреть комментарий", url=comment_url)]
+        ])
+
+    new_rows = []
+    for row in rows:
+        new_row = []
+        for button in row:
+            if button.callback_data == callback_data:
+                button = InlineKeyboardButton(text=f"👀 {button.text.lstrip('🔴⏳❌✅ ')}", url=comment_url)
+            new_row.append(button)
+        new_rows.append(new_row)
+    return InlineKeyboardMarkup(inline_keyboard=new_rows)
+
+
+def _register_preview() -> bool:
+    """
+    Учитывает новое превью и определяет, нужно ли отправлять его в дайджесте
+
+    Режим дайджеста включается, когда за минуту пришло больше DIGEST_RATE_THRESHOLD превью,
+    и выключается, когда поток падает ниже половины порога.
+
+    Returns:
+        bool: True если превью нужно отправить в дайджесте
+    """
+    global _digest_mode
+    now = time.monotonic()
+    _preview_times.append(now)
+    while _preview_times and now - _preview_times[0] > 60:
+        _preview_times.popleft()
+
+    rate = len(_preview_times)
+    if not _digest_mode and rate > DIGEST_RATE_THRESHOLD:
+        _digest_mode = True
+        logger.info(f"📚 Включен режим дайджеста: {rate} превью за минуту")
+    elif _digest_mode and rate <= DIGEST_RATE_THRESHOLD // 2:
+        _digest_mode = False
+        logger.info(f"📨 Режим дайджеста выключен: {rate} превью за минуту")
+
+    return _digest_mode
+
+
+async def _flush_digest_later():
+    """Отправляет накопленный дайджест по окончании окна"""
+    global _digest_task
+    try:
+        await asyncio.sleep(DIGEST_WINDOW)
+    finally:
+        _digest_task = None
+    await flush_digest()
+
+
+async def flush_digest():
+    """Отправляет все накопленные превью одним или несколькими сообщениями дайджеста"""
+    global _digest_items
+    items, _digest_items = _digest_items, []
+
+    for start in range(0, len(items), DIGEST_MAX_ITEMS):
+        chunk = items[start:start + DIGEST_MAX_ITEMS]
+        text = f"📚 <b>Новые посты: {len(chunk)}</b>\n"
+        buttons = []
+        for number, item in enumerate(chunk, start=start + 1):
+            post_text = html.escape(item["post_text"][:100])
+            if len(item["post_text"]) > 100:
+                post_text += "..."
+            channel_name = html.escape(item["channel_name"])
+            if item["post_url"]:
+                channel_name = f'<a href="{item["post_url"]}">{channel_name}</a>'
+            text += f"\n<b>{number}. {channel_name}</b>: {post_text}\n"
+            text += f"<b>Комментарий:</b> {html.escape(item['comment'])}\n"
+            buttons.append([InlineKeyboardButton(
+                text=f"🔴 {number}. {item['comment'][:40]}",
+                callback_data=f"send:{item['comment_record_id']}"
+            )])
+
+        try:
+            await bot.send_message(
+                chat_id=ADMIN_USER_ID,
+                text=text,
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+                parse_mode="HTML",
+                disable_web_page_preview=True
+            )
+            logger.info(f"✅ Отправлен дайджест из {len(chunk)} превью")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при отправке дайджеста: {e}")
+
+
+def _bot_api_chat_id(chat_id: int) -> int:
+    """Переводит ID чата из формата Telethon в формат Bot API (-100...)"""
+    if chat_id > 0:
+        return int(f"-100{chat_id}")
+    return chat_id
+
+
+def _photo_input(path: str):
+    """
+    Возвращает фото для отправки: file_id из кэша или файл для загрузки
+
+    Args:
+        path: Путь к фото
+
+    Returns:
+        tuple: (file_id или FSInputFile, sha256 содержимого)
+    """
+    # Файлы в хранилище медиа названы по sha256 содержимого
+    photo_hash = hash_from_path(path)
+
+    file_id = _file_id_cache.get(photo_hash)
+    if file_id:
+        _file_id_cache.move_to_end(photo_hash)
+        return file_id, photo_hash
+    return FSInputFile(path), photo_hash
+
+
+def _remember_file_ids(photo_hashes: list, messages: list):
+    """Запоминает file_id загруженных фото, чтобы не загружать их повторно"""
+    for photo_hash, sent_message in zip(photo_hashes, messages):
+        if not sent_message.photo:
+            continue
+        _file_id_cache[photo_hash] = sent_message.photo[-1].file_id
+        _file_id_cache.move_to_end(photo_hash)
+    while len(_file_id_cache) > FILE_ID_CACHE_SIZE:
+        _file_id_cache.popitem(last=False)
+
+
+async def _copy_post_preview(chat_id: int, media_message_ids: list, text: str,
+                             markup: InlineKeyboardMarkup) -> bool:
+    """
+    Копирует пост из чата обсуждения администратору без повторной загрузки фото
+
+    Работает, только если бот состоит в чате обсуждения.
+
+    Args:
+        chat_id: ID чата обсуждения
+        media_message_ids: ID сообщений поста с фото
+        text: Текст превью
+        markup: Клавиатура превью
+
+    Returns:
+        bool: True если пост скопирован
+    """
+    from_chat_id = _bot_api_chat_id(chat_id)
+    try:
+        if len(media_message_ids) == 1:
+            await bot.copy_message(
+                chat_id=ADMIN_USER_ID,
+                from_chat_id=from_chat_id,
+                message_id=media_message_ids[0],
+                caption=text,
+                reply_markup=markup,
+                parse_mode="HTML"
+            )
+            return True
+
+        await bot.copy_messages(
+            chat_id=ADMIN_USER_ID,
+            from_chat_id=from_chat_id,
+            message_ids=sorted(media_message_ids)
+        )
+        await bot.send_message(
+            chat_id=ADMIN_USER_ID,
+            text=text,
+            reply_markup=markup,
+            parse_mode="HTML"
+        )
+        return True
+    except Exception as e:
+        logger.warning(f"Не удалось скопировать пост из чата {chat_id}, загружаем фото: {e}")
+        return False
+
+
+async def send_comment_preview(snapshot: PostSnapshot, comment: str, comment_record_id: int):
     """
     Отправляет превью комментария администратору
     
     Args:
-        channel_name: Название канала
-        channel_id: ID канала
-        message_id: ID сообщения
-        post_text: Текст поста
+        snapshot: Пост (фото для превью - из хранилища медиа, для копирования без загрузки -
+            ID сообщений с фото в чате обсуждения)
         comment: Сгенерированный комментарий
         comment_record_id: ID записи в БД
-        photo_path: Путь к одному фото (для обратной совместимости)
-        photo_paths: Список путей к фото (для медиа-групп)
+
+    Returns:
+        dict: Попадания в кэши при отправке: {"preview_copy": пост скопирован без загрузки фото,
+            "preview_file_id": фото отправлены по file_id без загрузки, "digest": превью добавлено в дайджест}
     """
+    global _digest_task
+    cache_hits = {"preview_copy": False, "preview_file_id": False, "digest": False}
+    channel_name = snapshot.channel_name
+    channel_id = snapshot.channel_id
+    message_id = snapshot.message_id
+    post_text = snapshot.text
+    photo_paths = snapshot.photo_paths
+    media_message_ids = snapshot.media_message_ids
     logger.info(f"Отправляем превью комментария для канала {channel_name} (ID: {channel_id})")
     try:
         # Формируем текст сообщения
@@ -159,21 +625,25 @@ async def send_comment_preview(channel_name: str, channel_id: int, message_id: i
         
         # Создаем ссылку на пост
         # Формат: https://t.me/c/{chat_id}/{message_id}
-        chat_id = None
-        for channel_name_check, channel_info in CHANNELS.items():
-            if channel_info["channel_id"] == channel_id:
-                chat_id = channel_info["chat_id"]
-                break
+        chat_id_str = get_chat_link_id(channel_id)
+        post_url = f"https://t.me/c/{chat_id_str}/{message_id}" if chat_id_str else None
         
-        post_url = None
-        if chat_id:
-            # Убираем знак минус и добавляем 1000000000000 для каналов
-            if chat_id < 0:
-                chat_id_str = str(chat_id)[4:]  # Убираем -100
-            else:
-                chat_id_str = str(chat_id)
-            
-            post_url = f"https://t.me/c/{chat_id_str}/{message_id}"
+        # При всплеске превью копим их в дайджест вместо отдельных сообщений
+        if _register_preview():
+            _digest_items.append({
+                "channel_name": channel_name,
+                "post_text": post_text,
+                "comment": comment,
+                "comment_record_id": comment_record_id,
+                "post_url": post_url,
+            })
+            if len(_digest_items) >= DIGEST_MAX_ITEMS:
+                await flush_digest()
+            elif _digest_task is None:
+                _digest_task = asyncio.create_task(_flush_digest_later())
+            logger.info(f"📚 Превью для записи {comment_record_id} добавлено в дайджест")
+            cache_hits["digest"] = True
+            return cache_hits
         
         # Создаем кнопки в ряд
         buttons = []
@@ -198,13 +668,24 @@ async def send_comment_preview(channel_name: str, channel_id: int, message_id: i
         
         markup = InlineKeyboardMarkup(inline_keyboard=buttons)
         
+        # Если бот состоит в чате обсуждения, копируем пост без повторной загрузки фото
+        channel_info = next((info for info in CHANNELS.values() if info["channel_id"] == channel_id), {})
+        copied = False
+        if photo_paths and media_message_ids and channel_info.get("preview_copy"):
+            copied = await _copy_post_preview(channel_info["chat_id"], media_message_ids, text, markup)
+        
         # Отправляем сообщение с фото или без
-        if photo_paths and len(photo_paths) > 1:
-            # Отправляем всю медиа-группу
-            from aiogram.types import FSInputFile, InputMediaPhoto
+        cache_hits["preview_copy"] = copied
+        if copied:
+            logger.info(f"   📋 Пост скопирован из чата обсуждения без загрузки фото")
+        elif photo_paths and len(photo_paths) > 1:
+            # Отправляем всю медиа-группу (уже загруженные фото - по file_id)
             media_group = []
+            photo_hashes = []
             for i, path in enumerate(photo_paths):
-                photo_file = FSInputFile(path)
+                photo_file, photo_hash = _photo_input(path)
+                photo_hashes.append(photo_hash)
+                cache_hits["preview_file_id"] |= isinstance(photo_file, str)
                 if i == 0:
                     # Первое фото с подписью
                     media_group.append(InputMediaPhoto(media=photo_file, caption=text, parse_mode="HTML"))
@@ -212,10 +693,11 @@ async def send_comment_preview(channel_name: str, channel_id: int, message_id: i
                     # Остальные фото без подписи
                     media_group.append(InputMediaPhoto(media=photo_file))
             
-            await bot.send_media_group(
+            sent_messages = await bot.send_media_group(
                 chat_id=ADMIN_USER_ID,
                 media=media_group
             )
+            _remember_file_ids(photo_hashes, sent_messages)
             
             # Отправляем кнопки сразу после медиа-группы
             await bot.send_message(
@@ -224,18 +706,18 @@ async def send_comment_preview(channel_name: str, channel_id: int, message_id: i
                 reply_markup=markup,
                 parse_mode="HTML"
             )
-        elif photo_path or (photo_paths and len(photo_paths) == 1):
-            # Отправляем одно фото
-            from aiogram.types import FSInputFile
-            single_photo_path = photo_path or photo_paths[0]
-            photo_file = FSInputFile(single_photo_path)
-            await bot.send_photo(
+        elif photo_paths:
+            # Отправляем одно фото (уже загруженное - по file_id)
+            photo_file, photo_hash = _photo_input(photo_paths[0])
+            cache_hits["preview_file_id"] = isinstance(photo_file, str)
+            sent_message = await bot.send_photo(
                 chat_id=ADMIN_USER_ID,
                 photo=photo_file,
                 caption=text,
                 reply_markup=markup,
                 parse_mode="HTML"
             )
+            _remember_file_ids([photo_hash], [sent_message])
         else:
             # Отправляем только текст
             await bot.send_message(
@@ -251,15 +733,115 @@ async def send_comment_preview(channel_name: str, channel_id: int, message_id: i
         logger.error(f"❌ Ошибка при отправке превью комментария: {e}")
         import traceback
         logger.error(f"Детали ошибки: {traceback.format_exc()}")
+    return cache_hits
+
+
+async def run_webhook():
+    """
+    Запускает встроенный HTTP сервер и регистрирует webhook в Telegram
+
+    Обновления обрабатываются в фоне, поэтому Telegram сразу получает ответ,
+    а несколько обновлений обрабатываются параллельно.
+    """
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL не задан")
+
+    # Без секрета любой, кто знает адрес, мог бы присылать поддельные обновления
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=secret_token
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+        await site.start()
+        logger.info(f"HTTP сервер webhook запущен на {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+        await bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logger.info(f"Webhook зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        bot_ready.set()
+
+        _webhook_stop.clear()
+        await _webhook_stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def send_auto_publish_report(channel_name: str, post_text: str, comment: str,
+                                   comment_url: str = None, latency: float = None):
+    """
+    Сообщает администратору об автоматически опубликованном комментарии
+
+    Args:
+        channel_name: Название канала
+        post_text: Текст поста
+        comment: Опубликованный комментарий
+        comment_url: Ссылка на комментарий
+        latency: Время от публикации поста до комментария в секундах
+    """
+    text = f"⚡ <b>Автопубликация в канале: {html.escape(channel_name)}</b>\n\n"
+    text += f"<b>Текст:</b> {html.escape(post_text[:200])}{'...' if len(post_text) > 200 else ''}\n\n"
+    text += f"<b>Комментарий:</b> {html.escape(comment)}"
+    if latency is not None:
+        text += f"\n\n⏱️ Опубликован через {latency:.1f} с после поста"
+
+    markup = None
+    if comment_url:
+        markup = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="👀 Посмотреть комментарий", url=comment_url)]
+        ])
+
+    try:
+        await bot.send_message(
+            chat_id=ADMIN_USER_ID,
+            text=text,
+            reply_markup=markup,
+            parse_mode="HTML",
+            disable_web_page_preview=True
+        )
+    except Exception as e:
+        logger.error(f"❌ Ошибка при отправке отчета об автопубликации: {e}")
+
+
+@dp.startup()
+async def on_polling_startup():
+    """Polling запущен: бот готов получать обновления (в режиме webhook готовность ставит run_webhook)"""
+    if _polling:
+        bot_ready.set()
 
 
 async def start_bot():
     """Запуск бота"""
-    global _bot_running
+    global _bot_running, _polling
     logger.info("Запуск Telegram бота...")
     
     try:
+        if BOT_MODE == "webhook":
+            try:
+                await run_webhook()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка в режиме webhook, переключаемся на polling: {e}")
+        
+        # Polling не работает при зарегистрированном webhook
+        await bot.delete_webhook()
+        
         # Запускаем polling
+        _polling = True
         await dp.start_polling(bot, stop_signals=None)
     except asyncio.CancelledError:
         logger.info("Бот получил сигнал остановки")
@@ -267,19 +849,50 @@ async def start_bot():
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
         _bot_running = False
+        _polling = False
+        bot_ready.clear()
         await bot.session.close()
         logger.info("Бот остановлен")
 
 
-async def stop_bot():
-    """Остановка бота"""
+async def stop_bot(timeout: float = SHUTDOWN_TIMEOUT):
+    """
+    Остановка бота
+
+    Args:
+        timeout: Сколько секунд всего ждать публикаций по кнопкам и отправки очереди запросов
+    """
     global _bot_running
     _bot_running = False
     logger.info("Остановка бота...")
     
+    try:
+        # Отправляем накопленный дайджест, чтобы не потерять превью
+        if _digest_task:
+            _digest_task.cancel()
+        await flush_digest()
+    except Exception as e:
+        logger.error(f"Ошибка при отправке дайджеста: {e}")
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    if _publish_tasks:
+        # Публикации по кнопкам превью должны успеть показать результат на кнопке
+        logger.info(f"⏳ Ожидание публикаций по кнопкам превью: {len(_publish_tasks)}")
+        await asyncio.wait(list(_publish_tasks.values()), timeout=max(deadline - loop.time(), 0))
+
+    # Дожидаемся отправки превью и правок кнопок, стоящих в очереди
+    remaining = await outbound_queue.drain(max(deadline - loop.time(), 0))
+    if remaining:
+        logger.warning(f"⚠️ Не отправлено запросов к Bot API: {remaining}")
+
+    # Останавливаем встроенный сервер webhook
+    _webhook_stop.set()
+    
     try:
         # Останавливаем polling
-        await dp.stop_polling()
+        if _polling:
+            await dp.stop_polling()
     except Exception as e:
         logger.error(f"Ошибка при остановке polling: {e}")
     
@@ -1,5 +1,23 @@
 # Конфигурация отслеживаемых каналов
 # Формат: "Название канала": {"channel_id": ID_канала, "chat_id": ID_чата}
+#
+# Необязательные параметры канала:
+#   "description"  - описание канала для контекста генерации
+#   "preview_copy" - True, если бот добавлен в чат обсуждения: превью с фото копируется
+#                    из чата без повторной загрузки файлов
+#   "auto_publish" - правила публикации без подтверждения администратора, например:
+#                    {"max_length": 60, "banned_words": ["скидка"], "quiet_hours": [23, 8], "self_check": True}
+#                    Комментарий публикуется сразу, если он не длиннее max_length, не содержит banned_words,
+#                    сейчас не тихие часы (локальное время сервера) и модель подтвердила его уместность
+#   "early_start"  - True: слушать и сам канал, чтобы скачивание фото и генерация начинались по посту в канале,
+#                    а не по его копии в чате обсуждения (аккаунт должен быть подписан на канал; режим local)
+#   "near_duplicate" - что делать с почти таким же постом, как уже обработанный:
+#                    "reuse" - взять комментарий такого поста этого же канала без запроса к OpenAI,
+#                    "suppress" - пропустить пост, если такой уже был в любом канале,
+#                    "off" - не искать (по умолчанию NEAR_DUPLICATE_MODE, он же по умолчанию "off")
+#   "priority"     - вес канала в очереди генерации (по умолчанию 1): чем больше, тем раньше обслуживаются
+#                    его посты; посты каналов с приоритетом ниже 1 при сильной перегрузке пропускаются
+#   "deadline"     - сколько секунд после публикации поста комментарий еще нужен (по умолчанию COMMENT_DEADLINE)
 
 CHANNELS = {
     "Михаил Гребенюк Тестовый": {
@@ -25,3 +25,133 @@ DB_PASSWORD = os.getenv('DB_PASSWORD', '')
 
 # Строка подключения к PostgreSQL
 DATABASE_URL = f"postgres://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Режим конвейера обработки постов:
+#   local - все этапы в одном процессе (по умолчанию)
+#   queue - main.py только фильтрует и ставит посты в очередь,
+#           генерацию и превью выполняют процессы worker.py
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'local')
+# Количество одновременно обрабатываемых задач в одном воркере
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 2))
+# Через сколько секунд зависшая задача возвращается в очередь
+JOB_LOCK_TIMEOUT = int(os.getenv('JOB_LOCK_TIMEOUT', 300))
+# Максимальное количество попыток обработки задачи
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+# Дайджест превью при всплесках нагрузки:
+# если за последнюю минуту пришло больше DIGEST_RATE_THRESHOLD превью,
+# они группируются в одно сообщение раз в DIGEST_WINDOW секунд
+DIGEST_RATE_THRESHOLD = int(os.getenv('DIGEST_RATE_THRESHOLD', 6))
+DIGEST_WINDOW = int(os.getenv('DIGEST_WINDOW', 30))
+# Максимум постов в одном сообщении дайджеста
+DIGEST_MAX_ITEMS = int(os.getenv('DIGEST_MAX_ITEMS', 20))
+
+# Сколько file_id загруженных в бот фото держать в кэше для повторного использования
+FILE_ID_CACHE_SIZE = int(os.getenv('FILE_ID_CACHE_SIZE', 1000))
+
+# Режим получения обновлений бота: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный HTTPS адрес, по которому Telegram доставляет обновления (без пути)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Адрес встроенного HTTP сервера
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (если не задан, генерируется при запуске)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+
+# Хранилище медиа (фото постов), адресуемое по хэшу содержимого
+MEDIA_DIR = os.getenv('MEDIA_DIR', 'media')
+# Бюджет хранилища в байтах: сверх него удаляются давно не использованные файлы
+MEDIA_STORE_MAX_BYTES = int(os.getenv('MEDIA_STORE_MAX_BYTES', 500 * 1024 * 1024))
+# Файлы старше MEDIA_TTL секунд удаляются, даже если бюджет не превышен
+MEDIA_TTL = int(os.getenv('MEDIA_TTL', 7 * 24 * 3600))
+# Как часто запускать очистку хранилища (секунды)
+MEDIA_EVICTION_INTERVAL = int(os.getenv('MEDIA_EVICTION_INTERVAL', 300))
+
+# Сколько комментариев публиковать одновременно при пакетном подтверждении
+BULK_PUBLISH_CONCURRENCY = int(os.getenv('BULK_PUBLISH_CONCURRENCY', 3))
+
+# Максимальная длина комментария для автопубликации (если не задана в канале)
+AUTO_PUBLISH_MAX_LENGTH = int(os.getenv('AUTO_PUBLISH_MAX_LENGTH', 60))
+
+# Сколько секунд ждать копию поста в чате обсуждения при раннем старте генерации
+EARLY_MATCH_TIMEOUT = int(os.getenv('EARLY_MATCH_TIMEOUT', 120))
+
+# Догрузка постов, пропущенных пока процесс был остановлен или без связи
+# Сколько пропущенных копий постов брать за одну догрузку в каждом чате обсуждения (остальные - в следующий раз)
+CATCH_UP_LIMIT = int(os.getenv('CATCH_UP_LIMIT', 100))
+# Сколько пропущенных постов обрабатывать одновременно
+CATCH_UP_CONCURRENCY = int(os.getenv('CATCH_UP_CONCURRENCY', 3))
+# Посты старше CATCH_UP_MAX_AGE секунд (и старше дедлайна канала) не комментируются, отметка просто сдвигается.
+# По умолчанию равно COMMENT_DEADLINE: более старые посты планировщик генерации все равно отбросит
+CATCH_UP_MAX_AGE = int(os.getenv('CATCH_UP_MAX_AGE', os.getenv('COMMENT_DEADLINE', 900)))
+# Как часто повторять проверку пропусков (секунды, 0 - только при запуске)
+CATCH_UP_INTERVAL = int(os.getenv('CATCH_UP_INTERVAL', 300))
+
+# Поиск почти одинаковых постов (перепосты с правками, пережатые фото)
+# Режим по умолчанию для каналов без параметра near_duplicate:
+# reuse - взять комментарий почти такого же поста того же канала без запроса к OpenAI,
+# suppress - пропустить пост, если почти такой же уже был в любом канале, off - не искать
+NEAR_DUPLICATE_MODE = os.getenv('NEAR_DUPLICATE_MODE', 'off')
+# Посты без фото короче стольких слов не сравниваются (короткие приветствия совпадают у разных постов)
+NEAR_DUPLICATE_MIN_WORDS = int(os.getenv('NEAR_DUPLICATE_MIN_WORDS', 8))
+# Сколько последних постов держать в индексе
+NEAR_DUPLICATE_INDEX_SIZE = int(os.getenv('NEAR_DUPLICATE_INDEX_SIZE', 5000))
+
+# Архивация старых комментариев: отправленные и неудачные комментарии старше ARCHIVE_AFTER секунд
+# переносятся из таблицы comments в сжатый архив comments_archive
+ARCHIVE_AFTER = int(os.getenv('ARCHIVE_AFTER', 30 * 24 * 3600))
+# Как часто запускать архивацию (секунды)
+ARCHIVE_INTERVAL = int(os.getenv('ARCHIVE_INTERVAL', 3600))
+# Сколько записей переносить за одну транзакцию
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+
+# Бюджет токенов на входе одного запроса генерации: длинный текст сокращается, лишние фото отбрасываются
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 2000))
+# Максимум фото из альбома в одном запросе
+PROMPT_MAX_IMAGES = int(os.getenv('PROMPT_MAX_IMAGES', 4))
+# Детализация фото для модели: low (85 токенов на фото), high или auto
+PROMPT_IMAGE_DETAIL = os.getenv('PROMPT_IMAGE_DETAIL', 'low')
+
+# Минимальная короткая сторона фото для модели (пиксели): скачивается наименьший размер не меньше этого.
+# Оригинал скачивается, только если он нужен для превью (канал без preview_copy)
+PHOTO_MIN_SIDE = int(os.getenv('PHOTO_MIN_SIDE', 512))
+
+# Блокировки цикла событий дольше SLOW_CALLBACK_THRESHOLD секунд логируются со стеком и считаются (/slow)
+SLOW_CALLBACK_THRESHOLD = float(os.getenv('SLOW_CALLBACK_THRESHOLD', 0.25))
+# Режим отладки asyncio: дополнительно замеряет каждый обратный вызов (заметно замедляет процесс)
+LOOP_DEBUG = os.getenv('LOOP_DEBUG', 'false').lower() == 'true'
+
+# Сколько секунд при остановке ждать завершения обработки принятых постов и публикаций
+SHUTDOWN_TIMEOUT = int(os.getenv('SHUTDOWN_TIMEOUT', 30))
+# HTTP сервер проверок состояния (/healthz, /readyz); HEALTH_PORT=0 - выключен
+HEALTH_HOST = os.getenv('HEALTH_HOST', '0.0.0.0')
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', 8081))
+
+# Планировщик генерации: посты получают слот генерации по ближайшему дедлайну
+# Сколько комментариев генерировать одновременно
+GENERATION_CONCURRENCY = int(os.getenv('GENERATION_CONCURRENCY', 4))
+# Дедлайн комментария: столько секунд после публикации поста (если не задан в канале), позже пост отбрасывается
+COMMENT_DEADLINE = int(os.getenv('COMMENT_DEADLINE', 900))
+# Более дешевая и быстрая модель, на которую планировщик переключается при перегрузке
+DEGRADED_MODEL = os.getenv('DEGRADED_MODEL', 'gpt-4o-mini')
+
+# Хранилище сессии Telethon:
+# memory - сессия в памяти, изменения записываются пачками в файл TELETHON_SESSION.session (формат Telethon),
+# postgres - сессия в PostgreSQL (общая для контейнеров и хостов; существующий файл переносится при первом запуске),
+# sqlite - стандартная сессия Telethon с синхронной записью в файл
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+# Название сессии (имя файла без .session или ключ записи в базе)
+TELETHON_SESSION = os.getenv('TELETHON_SESSION', 'tgsession')
+
+# Очередь исходящих запросов бота (лимиты Bot API)
+# Запросов в секунду на всех
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 25))
+# Запросов в секунду в один личный чат и сколько их может уйти подряд без ожидания
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', 3))
+# Запросов в секунду в одну группу или канал (20 в минуту)
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', 20 / 60))
+# Сколько секунд повторять запрос (лимиты, сетевые ошибки), прежде чем считать его неудачным
+OUTBOUND_MAX_DELAY = int(os.getenv('OUTBOUND_MAX_DELAY', 120))
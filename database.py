@@ -0,0 +1,64 @@
+import logging
+from tortoise import Tortoise
+from config import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# generate_schemas создает только отсутствующие таблицы, поэтому новые колонки
+# в таблицах, созданных предыдущими версиями, добавляются здесь
+SCHEMA_UPGRADES = [
+    "ALTER TABLE post_jobs ADD COLUMN IF NOT EXISTS media_message_ids JSONB",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS photo_hashes JSONB",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS post_date TIMESTAMPTZ",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS publish_latency DOUBLE PRECISION",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS auto_published BOOL NOT NULL DEFAULT FALSE",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS auto_publish_decision TEXT",
+    "ALTER TABLE post_jobs ADD COLUMN IF NOT EXISTS post_date TIMESTAMPTZ",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS duplicate_of INT",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS model VARCHAR(64)",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS input_tokens INT",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS output_tokens INT",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS cached_tokens INT",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS image_tokens INT",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS cost DOUBLE PRECISION",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS generation_latency DOUBLE PRECISION",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS download_duration DOUBLE PRECISION",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS preview_duration DOUBLE PRECISION",
+    "ALTER TABLE comments ADD COLUMN IF NOT EXISTS cache_hits JSONB",
+    "ALTER TABLE post_jobs ADD COLUMN IF NOT EXISTS download_duration DOUBLE PRECISION",
+    # Колонка статуса была создана по длине самого длинного статуса, "publishing" в нее не помещается
+    "ALTER TABLE comments ALTER COLUMN status TYPE VARCHAR(16)",
+    # Выборки по статусу (ожидающие подтверждения, кандидаты на архивацию) не сканируют всю таблицу
+    "CREATE INDEX IF NOT EXISTS idx_comments_status_created_at ON comments (status, created_at)",
+]
+
+
+async def upgrade_schema():
+    """Добавляет в существующие таблицы колонки из новых версий моделей"""
+    connection = Tortoise.get_connection("default")
+    for statement in SCHEMA_UPGRADES:
+        await connection.execute_script(statement)
+
+
+async def init_database():
+    """Инициализация базы данных"""
+    try:
+        await Tortoise.init(
+            db_url=DATABASE_URL,
+            modules={'models': ['models']}
+        )
+        await Tortoise.generate_schemas()
+        await upgrade_schema()
+        logger.info("База данных инициализирована")
+    except Exception as e:
+        logger.error(f"Ошибка при инициализации базы данных: {e}")
+        raise
+
+
+async def close_database():
+    """Закрытие соединения с базой данных"""
+    try:
+        await Tortoise.close_connections()
+        logger.info("Соединение с базой данных закрыто")
+    except Exception as e:
+        logger.error(f"Ошибка при закрытии базы данных: {e}")
@@ -0,0 +1,274 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from config import SLOW_CALLBACK_THRESHOLD, LOOP_DEBUG
+
+logger = logging.getLogger(__name__)
+
+# Ограничение длительности профилирования по команде (секунды)
+MAX_PROFILE_SECONDS = 300
+# Интервал процессорного времени между снимками стека в режиме выборочного профилирования (секунды)
+SAMPLE_INTERVAL = 0.005
+# Сколько функций показывать в отчете
+REPORT_LIMIT = 40
+# Как часто цикл событий отмечается для сторожевого потока (секунды)
+HEARTBEAT_INTERVAL = 0.05
+
+# Каталог проекта: в отчетах о блокировках ищется ближайшая к месту блокировки функция проекта
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Идет ли сейчас профилирование (одновременно возможно только одно)
+_profiling = False
+
+# Блокировки цикла событий: {место блокировки: количество}
+slow_callbacks = Counter()
+# Суммарное время блокировок по месту, секунды
+slow_callback_time = Counter()
+
+# Время последней отметки цикла событий (time.monotonic) и поток цикла
+_last_beat = 0.0
+_loop_thread_id = None
+_heartbeat_task = None
+_watchdog_thread = None
+_watchdog_stop = threading.Event()
+
+# Сообщение asyncio в режиме отладки: "Executing <Handle ...> took 0.512 seconds"
+SLOW_HANDLE_RE = re.compile(r"Executing (?P<handle>.+) took (?P<duration>[\d.]+) seconds")
+
+
+def _format_stats(profile: cProfile.Profile, seconds: float) -> str:
+    """Форматирует результаты cProfile: сортировка по собственному и общему времени"""
+    buffer = io.StringIO()
+    buffer.write(f"Профиль цикла событий за {seconds:g} с (cProfile)\n\n")
+    stats = pstats.Stats(profile, stream=buffer)
+    stats.strip_dirs()
+    buffer.write("=== По собственному времени (tottime) ===\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(REPORT_LIMIT)
+    buffer.write("\n=== По общему времени (cumtime) ===\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_LIMIT)
+    return buffer.getvalue()
+
+
+def _is_project_file(filename: str) -> bool:
+    return filename.startswith(PROJECT_DIR) and "site-packages" not in filename
+
+
+def _short_path(filename: str) -> str:
+    return os.path.relpath(filename, PROJECT_DIR) if _is_project_file(filename) else filename
+
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{_short_path(code.co_filename)}:{code.co_firstlineno} {code.co_name}"
+
+
+async def _sample(seconds: float) -> tuple:
+    """
+    Снимает стек цикла событий по таймеру процессорного времени (SIGPROF)
+
+    Обработчик сигнала выполняется в потоке цикла на границе байткода, поэтому снимок
+    показывает именно прерванный код; время ожидания в select снимков не дает.
+    """
+    own_counts = Counter()
+    total_counts = Counter()
+    samples = 0
+
+    def on_signal(signum, frame):
+        nonlocal samples
+        samples += 1
+        own_counts[_frame_key(frame)] += 1
+        seen = set()
+        while frame is not None:
+            key = _frame_key(frame)
+            if key not in seen:
+                total_counts[key] += 1
+                seen.add(key)
+            frame = frame.f_back
+
+    previous_handler = signal.signal(signal.SIGPROF, on_signal)
+    signal.setitimer(signal.ITIMER_PROF, SAMPLE_INTERVAL, SAMPLE_INTERVAL)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous_handler)
+    return samples, own_counts, total_counts
+
+
+def _format_samples(samples: int, own_counts: Counter, total_counts: Counter, seconds: float) -> str:
+    """Форматирует результаты выборочного профилирования"""
+    lines = [f"Выборочный профиль цикла событий за {seconds:g} с: {samples} снимков стека "
+             f"каждые {SAMPLE_INTERVAL * 1000:g} мс процессорного времени", ""]
+    for title, counts in (("=== Выполнялась сама функция ===", own_counts),
+                          ("=== Функция была в стеке ===", total_counts)):
+        lines.append(title)
+        for key, count in counts.most_common(REPORT_LIMIT):
+            lines.append(f"{count / max(samples, 1):7.1%}  {count:6d}  {key}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+async def profile_loop(seconds: float, mode: str = "cprofile") -> str:
+    """
+    Профилирует цикл событий в течение заданного времени
+
+    Args:
+        seconds: Длительность профилирования
+        mode: cprofile - детерминированное (точные счетчики, замедляет процесс),
+              sample - выборочное по снимкам стека (почти без накладных расходов;
+                     только в главном потоке на Unix)
+
+    Returns:
+        str: Текстовый отчет с самыми затратными функциями
+
+    Raises:
+        RuntimeError: Профилирование уже запущено
+    """
+    global _profiling
+    if _profiling:
+        raise RuntimeError("Профилирование уже запущено")
+
+    seconds = min(seconds, MAX_PROFILE_SECONDS)
+    _profiling = True
+    logger.info(f"🔬 Профилирование цикла событий ({mode}) на {seconds:g} с")
+    try:
+        if mode == "sample":
+            samples, own_counts, total_counts = await _sample(seconds)
+            return _format_samples(samples, own_counts, total_counts, seconds)
+
+        # cProfile видит только свой поток - поток цикла событий, где выполняются все обработчики
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+        return _format_stats(profile, seconds)
+    finally:
+        _profiling = False
+
+
+def _record_slow(place: str, duration: float, details: str):
+    slow_callbacks[place] += 1
+    slow_callback_time[place] += duration
+    logger.warning(f"🐢 Цикл событий заблокирован на {duration:.3f} с: {place}\n{details}")
+
+
+def _project_place(stack: list) -> str:
+    """Ближайшая к месту блокировки функция проекта (или самый глубокий кадр, если такой нет)"""
+    for frame_summary in reversed(stack):
+        if _is_project_file(frame_summary.filename) and frame_summary.filename != __file__:
+            return f"{_short_path(frame_summary.filename)}:{frame_summary.lineno} {frame_summary.name}"
+    last = stack[-1]
+    return f"{last.filename}:{last.lineno} {last.name}"
+
+
+class SlowCallbackHandler(logging.Handler):
+    """Считает медленные обратные вызовы, о которых сообщает asyncio в режиме отладки"""
+
+    def emit(self, record):
+        match = SLOW_HANDLE_RE.search(record.getMessage())
+        if not match:
+            return
+        handle = match.group("handle")
+        # Из описания задачи оставляем имя корутины: оно и указывает на виновника
+        coro = re.search(r"coro=<([^>]+?)(?: running at| done,|\(\))", handle)
+        place = f"asyncio: {coro.group(1)}" if coro else f"asyncio: {handle[:120]}"
+        slow_callbacks[place] += 1
+        slow_callback_time[place] += float(match.group("duration"))
+
+
+async def _heartbeat():
+    """Отмечает, что цикл событий не заблокирован"""
+    global _last_beat
+    while True:
+        _last_beat = time.monotonic()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def _watchdog():
+    """
+    Сторожевой поток: если цикл событий не отмечался дольше порога, снимает стек его потока
+
+    В отличие от режима отладки asyncio, показывает, какая строка блокирует цикл прямо сейчас.
+    """
+    # Текущая блокировка: (время последней отметки перед ней, место, стек)
+    stall = None
+    while not _watchdog_stop.wait(HEARTBEAT_INTERVAL):
+        beat = _last_beat
+        if stall is not None:
+            if beat != stall[0]:
+                # Цикл снова отмечается: фиксируем полную длительность блокировки
+                _record_slow(stall[1], beat - stall[0] - HEARTBEAT_INTERVAL, stall[2])
+                stall = None
+            continue
+
+        if time.monotonic() - beat - HEARTBEAT_INTERVAL < SLOW_CALLBACK_THRESHOLD:
+            continue
+        frame = sys._current_frames().get(_loop_thread_id)
+        if frame is None:
+            continue
+        stack = traceback.extract_stack(frame)
+        stall = (beat, _project_place(stack), "".join(traceback.format_list(stack[-15:])))
+
+
+def start_loop_monitor():
+    """Запускает обнаружение блокировок цикла событий (вызывается из работающего цикла)"""
+    global _heartbeat_task, _watchdog_thread, _loop_thread_id, _last_beat
+    loop = asyncio.get_running_loop()
+
+    if LOOP_DEBUG:
+        # Режим отладки asyncio сам замеряет каждый обратный вызов дольше порога
+        loop.set_debug(True)
+        loop.slow_callback_duration = SLOW_CALLBACK_THRESHOLD
+        logging.getLogger("asyncio").addHandler(SlowCallbackHandler())
+        logger.info(f"Режим отладки asyncio включен (порог {SLOW_CALLBACK_THRESHOLD} с)")
+
+    if _watchdog_thread is None:
+        _loop_thread_id = threading.get_ident()
+        _last_beat = time.monotonic()
+        _heartbeat_task = asyncio.create_task(_heartbeat())
+        _watchdog_stop.clear()
+        _watchdog_thread = threading.Thread(target=_watchdog, name="loop-watchdog", daemon=True)
+        _watchdog_thread.start()
+
+
+def stop_loop_monitor():
+    """Останавливает сторожевой поток"""
+    global _heartbeat_task, _watchdog_thread
+    if _heartbeat_task is not None:
+        _heartbeat_task.cancel()
+        _heartbeat_task = None
+    if _watchdog_thread is not None:
+        _watchdog_stop.set()
+        _watchdog_thread.join(timeout=1)
+        _watchdog_thread = None
+
+
+def format_slow_callbacks(limit: int = 15) -> str:
+    """
+    Возвращает сводку блокировок цикла событий
+
+    Args:
+        limit: Сколько мест показать
+
+    Returns:
+        str: Текст сводки
+    """
+    if not slow_callbacks:
+        return f"✅ Блокировок цикла событий дольше {SLOW_CALLBACK_THRESHOLD} с не было"
+
+    lines = [f"🐢 Блокировки цикла событий дольше {SLOW_CALLBACK_THRESHOLD} с:"]
+    for place, count in slow_callbacks.most_common(limit):
+        lines.append(f"{count} раз, всего {slow_callback_time[place]:.1f} с - {place}")
+    return "\n".join(lines)
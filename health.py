@@ -0,0 +1,105 @@
+import logging
+import time
+from aiohttp import web
+from config import HEALTH_HOST, HEALTH_PORT
+import diagnostics
+from scheduler import scheduler
+from outbound import outbound_queue
+
+logger = logging.getLogger(__name__)
+
+# Проверки готовности: {название компонента: функция без аргументов, возвращающая bool}
+_checks = {}
+# Дополнительные счетчики для /healthz: {название поля: функция без аргументов, возвращающая dict}
+_stats = {}
+# Время запуска процесса (time.monotonic)
+_started_at = time.monotonic()
+# Запущенный HTTP сервер
+_runner = None
+
+
+def register_check(name: str, check):
+    """
+    Регистрирует проверку готовности компонента для /readyz
+
+    Args:
+        name: Название компонента
+        check: Функция без аргументов, возвращающая True, если компонент готов
+    """
+    _checks[name] = check
+
+
+def register_stats(name: str, get_stats):
+    """
+    Регистрирует счетчики компонента, которые отдаются в /healthz
+
+    Args:
+        name: Название поля в ответе
+        get_stats: Функция без аргументов, возвращающая dict со счетчиками
+    """
+    _stats[name] = get_stats
+
+
+def get_readiness() -> dict:
+    """
+    Возвращает состояние готовности всех компонентов
+
+    Returns:
+        dict: {название компонента: готов ли он}
+    """
+    readiness = {}
+    for name, check in _checks.items():
+        try:
+            readiness[name] = bool(check())
+        except Exception as e:
+            logger.error(f"Ошибка проверки готовности '{name}': {e}")
+            readiness[name] = False
+    return readiness
+
+
+async def handle_liveness(request):
+    """Процесс жив: раз обработчик ответил, цикл событий не заблокирован"""
+    payload = {
+        "status": "ok",
+        "uptime": round(time.monotonic() - _started_at),
+        "slow_callbacks": sum(diagnostics.slow_callbacks.values()),
+        "generation": scheduler.get_stats(),
+        "outbound": outbound_queue.get_stats(),
+    }
+    for name, get_stats in _stats.items():
+        try:
+            payload[name] = get_stats()
+        except Exception as e:
+            logger.error(f"Ошибка получения счетчиков '{name}': {e}")
+    return web.json_response(payload)
+
+
+async def handle_readiness(request):
+    """Все компоненты запущены и принимают работу"""
+    readiness = get_readiness()
+    ready = bool(readiness) and all(readiness.values())
+    return web.json_response({"ready": ready, "checks": readiness}, status=200 if ready else 503)
+
+
+async def start_health_server():
+    """Запускает HTTP сервер с /healthz и /readyz (если HEALTH_PORT не 0)"""
+    global _runner
+    if not HEALTH_PORT or _runner is not None:
+        return
+
+    app = web.Application()
+    app.router.add_get("/healthz", handle_liveness)
+    app.router.add_get("/readyz", handle_readiness)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, HEALTH_HOST, HEALTH_PORT).start()
+    logger.info(f"Проверки состояния доступны на {HEALTH_HOST}:{HEALTH_PORT} (/healthz, /readyz)")
+
+
+async def stop_health_server():
+    """Останавливает HTTP сервер проверок состояния"""
+    global _runner
+    if _runner is None:
+        return
+    await _runner.cleanup()
+    _runner = None
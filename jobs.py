@@ -0,0 +1,212 @@
+import asyncio
+import base64
+import logging
+from datetime import datetime, timezone
+import asyncpg
+from tortoise import Tortoise
+from models import PostJob, JobStatus
+from post_snapshot import PostSnapshot, PostPhoto
+from config import DATABASE_URL, JOB_LOCK_TIMEOUT, JOB_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# Канал LISTEN/NOTIFY, через который воркеры узнают о новых задачах
+NOTIFY_CHANNEL = "post_jobs"
+
+# Атомарно забирает самую старую задачу из очереди.
+# SKIP LOCKED позволяет нескольким воркерам разбирать очередь без блокировок друг друга
+CLAIM_JOB_SQL = """
+UPDATE post_jobs
+SET status = 'processing', locked_at = NOW(), attempts = attempts + 1, worker = $1
+WHERE id = (
+    SELECT id FROM post_jobs
+    WHERE status = 'queued'
+    ORDER BY id
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING id
+"""
+
+# Возвращает в очередь задачи, воркер которых завис или упал
+REQUEUE_STALE_SQL = """
+UPDATE post_jobs
+SET status = 'queued', worker = NULL
+WHERE status = 'processing' AND locked_at < NOW() - make_interval(secs => $1)
+RETURNING id
+"""
+
+
+async def notify_workers(payload: str = ""):
+    """Будит воркеры, ожидающие новые задачи"""
+    conn = Tortoise.get_connection("default")
+    await conn.execute_query("SELECT pg_notify($1, $2)", [NOTIFY_CHANNEL, payload])
+
+
+async def enqueue_post(snapshot: PostSnapshot) -> PostJob:
+    """
+    Ставит пост в очередь на генерацию комментария
+
+    Args:
+        snapshot: Пост (фото сохраняются в задаче в формате base64)
+
+    Returns:
+        PostJob: Созданная задача
+    """
+    job = await PostJob.create(
+        channel_id=snapshot.channel_id,
+        channel_name=snapshot.channel_name,
+        message_id=snapshot.message_id,
+        post_text=snapshot.text,
+        photos_base64=snapshot.photos_base64 or None,
+        media_message_ids=snapshot.media_message_ids or None,
+        post_date=snapshot.date,
+        download_duration=snapshot.download_duration,
+        status=JobStatus.QUEUED
+    )
+    await notify_workers(str(job.id))
+    logger.info(f"   📬 Пост поставлен в очередь: задача {job.id}, message_id={snapshot.message_id}")
+    return job
+
+
+def snapshot_from_job(job: PostJob) -> PostSnapshot:
+    """
+    Восстанавливает пост из задачи очереди
+
+    Args:
+        job: Задача
+
+    Returns:
+        PostSnapshot: Пост с содержимым фото (без путей в хранилище медиа)
+    """
+    photos_base64 = job.photos_base64 or []
+    media_message_ids = job.media_message_ids or []
+    return PostSnapshot(
+        channel_name=job.channel_name,
+        channel_id=job.channel_id,
+        message_id=job.message_id,
+        text=job.post_text or "",
+        date=job.post_date,
+        download_duration=job.download_duration,
+        photos=[
+            PostPhoto(
+                message_id=media_message_ids[index] if index < len(media_message_ids) else None,
+                data=base64.b64decode(photo_base64)
+            )
+            for index, photo_base64 in enumerate(photos_base64)
+        ]
+    )
+
+
+async def claim_job(worker_name: str) -> PostJob:
+    """
+    Забирает следующую задачу из очереди
+
+    Args:
+        worker_name: Имя воркера для диагностики
+
+    Returns:
+        PostJob: Задача или None, если очередь пуста
+    """
+    conn = Tortoise.get_connection("default")
+    rows = await conn.execute_query_dict(CLAIM_JOB_SQL, [worker_name])
+    if not rows:
+        return None
+    return await PostJob.get(id=rows[0]["id"])
+
+
+async def complete_job(job: PostJob):
+    """Помечает задачу как выполненную"""
+    job.status = JobStatus.DONE
+    job.finished_at = datetime.now(timezone.utc)
+    job.error = None
+    # Фото больше не нужны, не держим их в таблице
+    job.photos_base64 = None
+    await job.save()
+
+
+async def fail_job(job: PostJob, error: str):
+    """
+    Обрабатывает ошибку задачи: возвращает ее в очередь или помечает как проваленную
+
+    Args:
+        job: Задача
+        error: Текст ошибки
+    """
+    job.error = error
+    if job.attempts >= JOB_MAX_ATTEMPTS:
+        job.status = JobStatus.FAILED
+        job.finished_at = datetime.now(timezone.utc)
+        await job.save()
+        logger.error(f"Задача {job.id} провалена после {job.attempts} попыток: {error}")
+        return
+
+    job.status = JobStatus.QUEUED
+    job.worker = None
+    await job.save()
+    await notify_workers(str(job.id))
+    logger.warning(f"Задача {job.id} возвращена в очередь (попытка {job.attempts}/{JOB_MAX_ATTEMPTS}): {error}")
+
+
+async def requeue_stale_jobs() -> int:
+    """
+    Возвращает в очередь задачи, которые слишком долго находятся в обработке
+
+    Returns:
+        int: Количество возвращенных задач
+    """
+    conn = Tortoise.get_connection("default")
+    rows = await conn.execute_query_dict(REQUEUE_STALE_SQL, [JOB_LOCK_TIMEOUT])
+    if rows:
+        logger.warning(f"Возвращено в очередь зависших задач: {len(rows)}")
+        await notify_workers()
+    return len(rows)
+
+
+class JobListener:
+    """Подписка на уведомления о новых задачах через LISTEN/NOTIFY"""
+
+    def __init__(self):
+        self._connection = None
+        self._event = asyncio.Event()
+
+    async def start(self):
+        """Открывает выделенное соединение и подписывается на канал уведомлений"""
+        self._connection = await asyncpg.connect(DATABASE_URL)
+        await self._connection.add_listener(NOTIFY_CHANNEL, self._on_notify)
+        logger.info(f"Подписка на канал уведомлений '{NOTIFY_CHANNEL}' активна")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._event.set()
+
+    def wake(self):
+        """Прерывает ожидание (при остановке воркера)"""
+        self._event.set()
+
+    def clear(self):
+        """Сбрасывает флаг уведомления перед очередной проверкой очереди"""
+        self._event.clear()
+
+    async def wait(self, timeout: float):
+        """
+        Ждет уведомления о новой задаче не дольше timeout секунд
+
+        Args:
+            timeout: Максимальное время ожидания (страховка на случай потерянного уведомления)
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def stop(self):
+        """Закрывает соединение подписки"""
+        if self._connection is None:
+            return
+        try:
+            await self._connection.remove_listener(NOTIFY_CHANNEL, self._on_notify)
+            await self._connection.close()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии подписки на уведомления: {e}")
+        finally:
+            self._connection = None
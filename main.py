@@ -4,11 +4,17 @@ import signal
 import sys
 from telethon import TelegramClient
 from telethon.errors import FloodWaitError
-from tortoise import Tortoise
-from config import API_ID, API_HASH, PHONE_NUMBER, DATABASE_URL
-from models import Comment
-from telethon_handler import setup_channel_handlers, cleanup_temp_files, send_comment_to_post, ensure_temp_dir
-from bot import start_bot, stop_bot, set_send_comment_function
+from config import API_ID, API_HASH, PHONE_NUMBER, PIPELINE_MODE, SHUTDOWN_TIMEOUT, SESSION_BACKEND
+from database import init_database, close_database
+import media_store
+import diagnostics
+import health
+import session_store
+import telethon_handler
+from telethon_handler import setup_channel_handlers, send_comment_to_post, catch_up_loop
+from archive import archive_loop
+from publisher import wait_publishing, release_interrupted_publishing
+from bot import start_bot, stop_bot, set_send_comment_function, bot_ready
 
 # Настройка логирования
 logging.basicConfig(
@@ -17,11 +23,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Глобальная переменная для контроля работы
-_running = True
+# Событие остановки: устанавливается по сигналу
+_stop = asyncio.Event()
 
-# Инициализация Telethon клиента
-client = TelegramClient('tgsession', API_ID, API_HASH)
+# Готовность компонентов (для /readyz)
+database_ready = asyncio.Event()
+telethon_ready = asyncio.Event()
+monitoring_ready = asyncio.Event()
+
+# Telethon клиент: создается в start_telethon, когда сессия загружена из хранилища
+client = None
 
 
 def handle_exception(loop, context):
@@ -34,127 +45,173 @@ def handle_exception(loop, context):
         logger.error(f"Необработанное исключение: {exception}")
 
 
-def signal_handler(signum, frame):
+def signal_handler(signum):
     """Обработчик сигналов остановки"""
-    global _running
-    logger.info(f"Получен сигнал {signum}, завершение работы...")
-    _running = False
+    logger.info(f"Получен сигнал {signal.Signals(signum).name}, завершение работы...")
+    _stop.set()
+
+
+async def start_database():
+    """Инициализирует базу данных"""
+    await init_database()
+    await release_interrupted_publishing()
+    database_ready.set()
+
+
+async def start_telethon():
+    """Загружает сессию, запускает и авторизует Telethon клиент"""
+    global client
+    if SESSION_BACKEND == "postgres":
+        # Сессия хранится в базе данных
+        await database_ready.wait()
+    session = await session_store.open_session()
+    client = TelegramClient(session, API_ID, API_HASH)
+
+    await client.start(phone=PHONE_NUMBER)
+    logger.info(f"Telethon клиент запущен с номером {PHONE_NUMBER}")
+
+    me = await client.get_me()
+    logger.info(f"Авторизован как: {me.first_name} (@{me.username})")
+    telethon_ready.set()
+
+
+def register_readiness_checks():
+    """Регистрирует проверки готовности компонентов для /readyz и счетчики маршрутов для /healthz"""
+    health.register_check("database", database_ready.is_set)
+    health.register_check("telethon", lambda: telethon_ready.is_set() and client is not None and client.is_connected())
+    health.register_check("bot", bot_ready.is_set)
+    health.register_check("monitoring", lambda: monitoring_ready.is_set() and telethon_handler.is_accepting())
+    health.register_stats("monitoring", telethon_handler.get_route_stats)
+
+
+async def shutdown(background_tasks: list):
+    """
+    Останавливает сервисы: сначала прекращает прием постов и дожидается принятой работы
+    (все этапы вместе не дольше SHUTDOWN_TIMEOUT секунд), затем закрывает соединения
 
+    Args:
+        background_tasks: Фоновые задачи, которые нужно отменить после ожидания
+    """
+    logger.info("Остановка всех сервисов...")
+    monitoring_ready.clear()
+    loop = asyncio.get_running_loop()
+    # Общий срок на все этапы ожидания: каждый получает только оставшееся время
+    deadline = loop.time() + SHUTDOWN_TIMEOUT
 
-async def init_database():
-    """Инициализация базы данных"""
     try:
-        await Tortoise.init(
-            db_url=DATABASE_URL,
-            modules={'models': ['models']}
-        )
-        await Tortoise.generate_schemas()
-        logger.info("База данных инициализирована")
+        # Новые посты не принимаются (их подберет догрузка после запуска), принятые дорабатываются
+        await telethon_handler.drain(max(deadline - loop.time(), 0))
+        # Комментарии, публикация которых уже началась, должны дойти до Telegram
+        await wait_publishing(max(deadline - loop.time(), 0))
     except Exception as e:
-        logger.error(f"Ошибка при инициализации базы данных: {e}")
-        raise
+        logger.error(f"Ошибка при ожидании обработки: {e}")
 
+    try:
+        # Останавливаем бота (накопленный дайджест отправляется)
+        await stop_bot(max(deadline - loop.time(), 0))
+    except Exception as e:
+        logger.error(f"Ошибка при остановке бота: {e}")
+
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+    try:
+        # Останавливаем Telethon клиент (несохраненные изменения сессии записываются в хранилище)
+        if client is not None:
+            await client.disconnect()
+            logger.info("Telethon клиент отключен")
+    except Exception as e:
+        logger.error(f"Ошибка при отключении Telethon: {e}")
+
+    try:
+        # Останавливаем очистку хранилища медиа (файлы остаются для следующего запуска)
+        await media_store.stop_store()
+    except Exception as e:
+        logger.error(f"Ошибка при остановке хранилища медиа: {e}")
 
-async def close_database():
-    """Закрытие соединения с базой данных"""
     try:
-        await Tortoise.close_connections()
-        logger.info("Соединение с базой данных закрыто")
+        await health.stop_health_server()
+    except Exception as e:
+        logger.error(f"Ошибка при остановке сервера проверок состояния: {e}")
+
+    diagnostics.stop_loop_monitor()
+
+    try:
+        # Закрываем базу данных
+        await close_database()
     except Exception as e:
         logger.error(f"Ошибка при закрытии базы данных: {e}")
 
 
 async def main():
     """Основная функция"""
-    global _running
     logger.info("Запуск Telegram монитора и бота...")
-    
-    # Устанавливаем обработчики сигналов
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
+
     # Проверяем конфигурацию
     if not API_ID or not API_HASH:
         logger.error("API_ID или API_HASH не заданы. Проверьте переменные окружения")
         return
-    
+
     if not PHONE_NUMBER:
         logger.error("PHONE_NUMBER не задан. Проверьте переменную окружения PHONE_NUMBER")
         return
-    
-    # Устанавливаем глобальный обработчик исключений
-    loop = asyncio.get_event_loop()
+
+    # Устанавливаем глобальный обработчик исключений и обработчики сигналов
+    loop = asyncio.get_running_loop()
     loop.set_exception_handler(handle_exception)
-    
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, signal_handler, signum)
+
+    # Сторожевой поток: логирует код, который блокирует цикл событий
+    diagnostics.start_loop_monitor()
+
+    background_tasks = []
     try:
-        # Инициализация базы данных
-        await init_database()
-        
-        # Создаем папку temp для медиа файлов
-        ensure_temp_dir()
-        
+        # Проверки состояния доступны уже во время запуска
+        register_readiness_checks()
+        await health.start_health_server()
+
+        # Загружаем индекс хранилища медиа и запускаем его фоновую очистку
+        media_store.start_store()
+
         # Устанавливаем функцию отправки комментариев в боте
         set_send_comment_function(send_comment_to_post)
-        
-        # Запуск Telethon клиента
-        await client.start(phone=PHONE_NUMBER)
-        logger.info(f"Telethon клиент запущен с номером {PHONE_NUMBER}")
-        
-        me = await client.get_me()
-        logger.info(f"Авторизован как: {me.first_name} (@{me.username})")
-        
-        # Запуск aiogram бота
+
+        # База данных и Telethon не зависят друг от друга: запускаем параллельно
+        await asyncio.gather(start_database(), start_telethon())
+
+        # Старые комментарии переносятся в архив, чтобы таблица comments не росла бесконечно
+        background_tasks.append(asyncio.create_task(archive_loop()))
+
+        # Запуск aiogram бота. Отправлять превью можно и до запуска polling,
+        # поэтому мониторинг не ждет готовности бота
         bot_task = asyncio.create_task(start_bot())
-        logger.info("Бот запущен")
-        
-        # Небольшая задержка для инициализации бота
-        await asyncio.sleep(2)
-        
+        background_tasks.append(bot_task)
+
         # Настройка обработчиков каналов
         await setup_channel_handlers(client)
+        monitoring_ready.set()
         logger.info("Мониторинг сообщений запущен")
-        
+        if PIPELINE_MODE == "queue":
+            logger.info("Режим очереди: генерацию выполняют процессы worker.py")
+
+        # Догружаем посты, пропущенные пока процесс был остановлен
+        background_tasks.append(asyncio.create_task(catch_up_loop()))
+
         logger.info("Все сервисы запущены. Нажмите Ctrl+C для остановки.")
-        
-        # Ожидаем завершения бота или сигнала остановки
-        try:
-            while _running and not bot_task.done():
-                await asyncio.sleep(0.1)
-        except KeyboardInterrupt:
-            logger.info("Получен сигнал остановки...")
-        except Exception as e:
-            logger.error(f"Ошибка в работе: {e}")
-            
+
+        # Ожидаем сигнала остановки или завершения бота
+        stop_task = asyncio.create_task(_stop.wait())
+        await asyncio.wait([stop_task, bot_task], return_when=asyncio.FIRST_COMPLETED)
+        stop_task.cancel()
+        if bot_task.done():
+            logger.error("Бот завершил работу, останавливаем сервисы")
+
     except Exception as e:
         logger.error(f"Критическая ошибка в main: {e}")
     finally:
-        # Останавливаем все сервисы
-        logger.info("Остановка всех сервисов...")
-        
-        try:
-            # Останавливаем бота
-            await stop_bot()
-        except Exception as e:
-            logger.error(f"Ошибка при остановке бота: {e}")
-        
-        try:
-            # Останавливаем Telethon клиент
-            await client.disconnect()
-            logger.info("Telethon клиент отключен")
-        except Exception as e:
-            logger.error(f"Ошибка при отключении Telethon: {e}")
-        
-        try:
-            # Очищаем временные файлы
-            await cleanup_temp_files()
-        except Exception as e:
-            logger.error(f"Ошибка при очистке временных файлов: {e}")
-        
-        try:
-            # Закрываем базу данных
-            await close_database()
-        except Exception as e:
-            logger.error(f"Ошибка при закрытии базы данных: {e}")
+        await shutdown(background_tasks)
 
 
 if __name__ == "__main__":
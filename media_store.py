@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from models import Comment, CommentStatus
+from config import MEDIA_DIR, MEDIA_STORE_MAX_BYTES, MEDIA_TTL, MEDIA_EVICTION_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Папка хранилища медиа: файлы лежат по пути {MEDIA_DIR}/{hash[:2]}/{hash}{suffix}
+STORE_DIR = Path(MEDIA_DIR)
+
+# Файлы, к которым обращались за последние MIN_AGE секунд, не удаляются:
+# их может прямо сейчас отправлять превью
+MIN_AGE = 60
+
+# Индекс хранилища в порядке последнего обращения: {hash: {"path", "size", "atime"}}.
+# Папку используют несколько процессов (бот, воркеры), поэтому перед каждой очисткой индекс строится заново
+# по файлам на диске; время последнего обращения - время изменения файла (store_bytes обновляет его)
+_index = OrderedDict()
+# Суммарный размер файлов в хранилище
+_total_bytes = 0
+# Задача фоновой очистки
+_eviction_task = None
+
+
+def hash_from_path(path: str) -> str:
+    """Возвращает хэш содержимого по пути файла в хранилище"""
+    return Path(path).stem
+
+
+def _path_for(content_hash: str, suffix: str) -> Path:
+    return STORE_DIR / content_hash[:2] / f"{content_hash}{suffix}"
+
+
+def _write_file(path: Path, data: bytes):
+    """Атомарно записывает файл: другие процессы не увидят его недописанным"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as media_file:
+        media_file.write(data)
+    os.replace(tmp_path, path)
+
+
+def _add_to_index(content_hash: str, path: Path, size: int, atime: float):
+    global _total_bytes
+    if content_hash in _index:
+        _total_bytes -= _index[content_hash]["size"]
+    _index[content_hash] = {"path": path, "size": size, "atime": atime}
+    _index.move_to_end(content_hash)
+    _total_bytes += size
+
+
+def _remove_from_index(content_hash: str):
+    global _total_bytes
+    entry = _index.pop(content_hash, None)
+    if entry:
+        _total_bytes -= entry["size"]
+
+
+def _scan_store() -> list:
+    """
+    Читает файлы хранилища вместе с файлами, записанными другими процессами
+
+    Returns:
+        list: [(время изменения, путь, размер)] от самых давно использованных к самым свежим
+    """
+    STORE_DIR.mkdir(parents=True, exist_ok=True)
+    entries = []
+    for path in STORE_DIR.glob("*/*"):
+        if path.suffix == ".tmp" or not path.is_file():
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # Файл удалил другой процесс
+            continue
+        entries.append((stat.st_mtime, path, stat.st_size))
+    return sorted(entries, key=lambda entry: entry[0])
+
+
+def _rebuild_index(entries: list):
+    """Заменяет индекс файлами, найденными _scan_store"""
+    global _total_bytes
+    _index.clear()
+    _total_bytes = 0
+    for atime, path, size in entries:
+        _add_to_index(hash_from_path(path), path, size, atime)
+
+
+def load_index():
+    """Строит индекс по файлам, оставшимся в хранилище после прошлых запусков"""
+    _rebuild_index(_scan_store())
+    logger.info(f"Хранилище медиа: {len(_index)} файлов, {_total_bytes / 1024 / 1024:.1f} МБ ({STORE_DIR.absolute()})")
+
+
+async def store_bytes(data: bytes, suffix: str = ".jpg") -> tuple:
+    """
+    Сохраняет медиа в хранилище; одинаковые файлы хранятся один раз
+
+    Args:
+        data: Содержимое файла
+        suffix: Расширение файла
+
+    Returns:
+        tuple: (хэш содержимого, путь к файлу)
+    """
+    content_hash = hashlib.sha256(data).hexdigest()
+    path = _path_for(content_hash, suffix)
+    now = time.time()
+
+    entry = _index.get(content_hash)
+    if entry and entry["path"].exists():
+        entry["atime"] = now
+        _index.move_to_end(content_hash)
+        # Обновляем время изменения, чтобы порядок LRU пережил перезапуск
+        os.utime(entry["path"], (now, now))
+        return content_hash, str(entry["path"])
+
+    await asyncio.to_thread(_write_file, path, data)
+    _add_to_index(content_hash, path, len(data), now)
+    return content_hash, str(path)
+
+
+async def get_referenced_hashes() -> set:
+    """
+    Возвращает хэши медиа, на которые ссылаются ожидающие подтверждения и публикуемые комментарии
+
+    Returns:
+        set: Хэши, которые нельзя удалять
+    """
+    rows = await Comment.filter(
+        status__in=[CommentStatus.PENDING, CommentStatus.PUBLISHING],
+        photo_hashes__isnull=False
+    ).values_list("photo_hashes", flat=True)
+    return {content_hash for hashes in rows for content_hash in hashes or []}
+
+
+def evict(referenced: set) -> int:
+    """
+    Удаляет устаревшие файлы и самые давно использованные файлы сверх бюджета
+
+    Args:
+        referenced: Хэши файлов, на которые ссылаются комментарии (не удаляются)
+
+    Returns:
+        int: Количество удаленных файлов
+    """
+    now = time.time()
+    removed = 0
+    # Проходим от самых давно использованных файлов к самым свежим
+    for content_hash, entry in list(_index.items()):
+        age = now - entry["atime"]
+        if age < MIN_AGE:
+            break
+        if content_hash in referenced:
+            continue
+        if _total_bytes <= MEDIA_STORE_MAX_BYTES and age < MEDIA_TTL:
+            break
+
+        try:
+            entry["path"].unlink(missing_ok=True)
+        except Exception as e:
+            logger.error(f"Ошибка при удалении файла {entry['path']}: {e}")
+            continue
+        _remove_from_index(content_hash)
+        removed += 1
+
+    if removed:
+        logger.info(f"🧹 Из хранилища медиа удалено файлов: {removed}, осталось {_total_bytes / 1024 / 1024:.1f} МБ")
+    return removed
+
+
+async def eviction_loop():
+    """Периодически очищает хранилище медиа"""
+    while True:
+        await asyncio.sleep(MEDIA_EVICTION_INTERVAL)
+        try:
+            referenced = await get_referenced_hashes()
+            # Учитываем файлы и обращения других процессов, а не только свои
+            _rebuild_index(await asyncio.to_thread(_scan_store))
+            evict(referenced)
+        except Exception as e:
+            logger.error(f"Ошибка при очистке хранилища медиа: {e}")
+
+
+def start_store():
+    """Загружает индекс хранилища и запускает фоновую очистку"""
+    global _eviction_task
+    load_index()
+    if _eviction_task is None:
+        _eviction_task = asyncio.create_task(eviction_loop())
+
+
+async def stop_store():
+    """Останавливает фоновую очистку; файлы остаются для следующего запуска"""
+    global _eviction_task
+    if _eviction_task is None:
+        return
+    _eviction_task.cancel()
+    try:
+        await _eviction_task
+    except asyncio.CancelledError:
+        pass
+    _eviction_task = None
@@ -5,6 +5,8 @@ from enum import Enum
 
 class CommentStatus(str, Enum):
     PENDING = "pending"
+    # Комментарий взят в публикацию одним из процессов (защита от двойной отправки)
+    PUBLISHING = "publishing"
     SENT = "sent"
     FAILED = "failed"
 
@@ -18,10 +20,27 @@ class Comment(Model):
     generated_comment = fields.TextField(description="Сгенерированный комментарий")
     post_text = fields.TextField(null=True, description="Текст поста")
     photo_path = fields.TextField(null=True, description="Путь к фото поста")
-    status = fields.CharEnumField(CommentStatus, default=CommentStatus.PENDING, description="Статус комментария")
+    photo_hashes = fields.JSONField(null=True, description="Хэши фото поста в хранилище медиа")
+    status = fields.CharEnumField(CommentStatus, max_length=16, default=CommentStatus.PENDING,
+                                  description="Статус комментария")
     sent_message_id = fields.BigIntField(null=True, description="ID отправленного комментария в чате")
     created_at = fields.DatetimeField(auto_now_add=True, description="Дата создания")
     sent_at = fields.DatetimeField(null=True, description="Дата отправки комментария")
+    post_date = fields.DatetimeField(null=True, description="Дата публикации поста")
+    publish_latency = fields.FloatField(null=True, description="Время от публикации поста до комментария, сек")
+    auto_published = fields.BooleanField(default=False, description="Опубликован без подтверждения")
+    auto_publish_decision = fields.TextField(null=True, description="Решение правил автопубликации")
+    duplicate_of = fields.IntField(null=True, description="ID комментария почти такого же поста, текст которого взят повторно")
+    model = fields.CharField(max_length=64, null=True, description="Модель OpenAI, сгенерировавшая комментарий")
+    input_tokens = fields.IntField(null=True, description="Токены на входе запроса генерации")
+    output_tokens = fields.IntField(null=True, description="Токены на выходе запроса генерации")
+    cached_tokens = fields.IntField(null=True, description="Токены входа из кэша промптов OpenAI")
+    image_tokens = fields.IntField(null=True, description="Оценка токенов фото в запросе генерации")
+    cost = fields.FloatField(null=True, description="Стоимость генерации, USD")
+    generation_latency = fields.FloatField(null=True, description="Время запроса к OpenAI, сек")
+    download_duration = fields.FloatField(null=True, description="Время скачивания фото поста, сек")
+    preview_duration = fields.FloatField(null=True, description="Время отправки превью администратору, сек")
+    cache_hits = fields.JSONField(null=True, description="Попадания в кэши: почти одинаковый пост, кэш промптов, file_id, копия поста")
     
     class Meta:
         table = "comments"
@@ -29,3 +48,198 @@ class Comment(Model):
     
     def __str__(self):
         return f"Comment {self.id} for channel {self.channel_id}, message {self.message_id}"
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class PostJob(Model):
+    """Задача на генерацию комментария, поставленная процессом-приемником"""
+    
+    id = fields.IntField(pk=True)
+    channel_id = fields.BigIntField(description="ID канала")
+    channel_name = fields.CharField(max_length=255, description="Название канала")
+    message_id = fields.BigIntField(description="ID сообщения в чате")
+    post_text = fields.TextField(null=True, description="Текст поста")
+    photos_base64 = fields.JSONField(null=True, description="Фото поста в формате base64")
+    media_message_ids = fields.JSONField(null=True, description="ID сообщений с фото в чате обсуждения")
+    post_date = fields.DatetimeField(null=True, description="Дата публикации поста")
+    download_duration = fields.FloatField(null=True, description="Время скачивания фото поста, сек")
+    status = fields.CharEnumField(JobStatus, default=JobStatus.QUEUED, description="Статус задачи")
+    attempts = fields.IntField(default=0, description="Количество попыток обработки")
+    worker = fields.CharField(max_length=255, null=True, description="Воркер, взявший задачу")
+    error = fields.TextField(null=True, description="Текст последней ошибки")
+    created_at = fields.DatetimeField(auto_now_add=True, description="Дата создания")
+    locked_at = fields.DatetimeField(null=True, description="Дата взятия задачи в работу")
+    finished_at = fields.DatetimeField(null=True, description="Дата завершения задачи")
+    
+    class Meta:
+        table = "post_jobs"
+        table_description = "Очередь постов для генерации комментариев"
+        indexes = (("status", "id"),)
+    
+    def __str__(self):
+        return f"PostJob {self.id} for channel {self.channel_id}, message {self.message_id}"
+
+
+class ChannelWatermark(Model):
+    """Последнее обработанное сообщение в чате обсуждения канала"""
+    
+    channel_id = fields.BigIntField(pk=True, description="ID канала")
+    chat_id = fields.BigIntField(description="ID чата обсуждения")
+    last_message_id = fields.BigIntField(default=0, description="ID последнего обработанного сообщения в чате")
+    updated_at = fields.DatetimeField(auto_now=True, description="Дата обновления")
+    
+    class Meta:
+        table = "channel_watermarks"
+        table_description = "Последние обработанные сообщения каналов для догрузки пропущенных постов"
+    
+    def __str__(self):
+        return f"ChannelWatermark for channel {self.channel_id}: {self.last_message_id}"
+
+
+class CommentArchive(Model):
+    """Архив старых отправленных и неудачных комментариев (полная запись хранится в сжатом виде)"""
+    
+    id = fields.IntField(pk=True, description="ID записи комментария")
+    channel_id = fields.BigIntField(description="ID канала")
+    message_id = fields.BigIntField(null=True, description="ID сообщения в чате")
+    status = fields.CharField(max_length=16, description="Статус комментария")
+    created_at = fields.DatetimeField(description="Дата создания комментария")
+    sent_at = fields.DatetimeField(null=True, description="Дата отправки комментария")
+    archived_at = fields.DatetimeField(auto_now_add=True, description="Дата переноса в архив")
+    payload = fields.BinaryField(description="Запись комментария в JSON, сжатая zlib")
+    
+    class Meta:
+        table = "comments_archive"
+        table_description = "Архив комментариев, перенесенных из горячей таблицы comments"
+        indexes = (("channel_id", "created_at"),)
+    
+    def __str__(self):
+        return f"CommentArchive {self.id} for channel {self.channel_id}, message {self.message_id}"
+
+
+class CommentStatsRollup(Model):
+    """Суммы по комментариям канала за день, обновляются при создании каждого комментария"""
+    
+    id = fields.IntField(pk=True)
+    channel_id = fields.BigIntField(description="ID канала")
+    day = fields.DateField(description="День создания комментариев (UTC)")
+    comments = fields.IntField(default=0, description="Количество комментариев")
+    duplicates = fields.IntField(default=0, description="Комментарии, взятые повторно для почти одинаковых постов")
+    input_tokens = fields.BigIntField(default=0, description="Токены на входе")
+    output_tokens = fields.BigIntField(default=0, description="Токены на выходе")
+    cached_tokens = fields.BigIntField(default=0, description="Токены входа из кэша промптов OpenAI")
+    image_tokens = fields.BigIntField(default=0, description="Оценка токенов фото")
+    cost = fields.FloatField(default=0, description="Стоимость генерации, USD")
+    
+    class Meta:
+        table = "comment_stats"
+        table_description = "Дневные суммы токенов и стоимости комментариев по каналам"
+        unique_together = (("channel_id", "day"),)
+    
+    def __str__(self):
+        return f"CommentStatsRollup for channel {self.channel_id}, {self.day}"
+
+
+class CommentLatencyHistogram(Model):
+    """Гистограмма длительностей этапа обработки по каналу за день (для процентилей)"""
+    
+    id = fields.IntField(pk=True)
+    channel_id = fields.BigIntField(description="ID канала")
+    day = fields.DateField(description="День создания комментариев (UTC)")
+    stage = fields.CharField(max_length=16, description="Этап: generation, download, preview")
+    bucket = fields.SmallIntField(description="Номер интервала длительности (см. stats.LATENCY_BUCKETS)")
+    count = fields.IntField(default=0, description="Количество замеров в интервале")
+    
+    class Meta:
+        table = "comment_latency_histogram"
+        table_description = "Гистограммы длительностей этапов обработки комментариев по каналам и дням"
+        unique_together = (("channel_id", "day", "stage", "bucket"),)
+    
+    def __str__(self):
+        return f"CommentLatencyHistogram for channel {self.channel_id}, {self.day}, {self.stage}[{self.bucket}]"
+
+
+class TelethonSession(Model):
+    """Данные авторизации сессии Telethon (для SESSION_BACKEND=postgres)"""
+    
+    name = fields.CharField(max_length=64, pk=True, description="Название сессии")
+    dc_id = fields.IntField(description="ID дата-центра")
+    server_address = fields.CharField(max_length=64, null=True, description="Адрес дата-центра")
+    port = fields.IntField(null=True, description="Порт дата-центра")
+    auth_key = fields.BinaryField(null=True, description="Ключ авторизации")
+    takeout_id = fields.BigIntField(null=True, description="ID takeout-сессии")
+    updated_at = fields.DatetimeField(auto_now=True, description="Дата обновления")
+    
+    class Meta:
+        table = "telethon_sessions"
+        table_description = "Сессии Telethon (формат таблицы sessions файла .session)"
+    
+    def __str__(self):
+        return f"TelethonSession {self.name} (DC {self.dc_id})"
+
+
+class TelethonEntity(Model):
+    """Известная сессии Telethon сущность: пользователь, чат или канал с access_hash"""
+    
+    id = fields.BigIntField(pk=True)
+    session_name = fields.CharField(max_length=64, description="Название сессии")
+    entity_id = fields.BigIntField(description="ID сущности (с префиксом типа, как в utils.get_peer_id)")
+    hash = fields.BigIntField(description="access_hash")
+    username = fields.CharField(max_length=64, null=True, description="Username в нижнем регистре")
+    phone = fields.CharField(max_length=32, null=True, description="Телефон")
+    name = fields.TextField(null=True, description="Отображаемое имя")
+    date = fields.BigIntField(null=True, description="Время последнего изменения (unix)")
+    
+    class Meta:
+        table = "telethon_entities"
+        table_description = "Сущности сессий Telethon (формат таблицы entities файла .session)"
+        unique_together = (("session_name", "entity_id"),)
+    
+    def __str__(self):
+        return f"TelethonEntity {self.entity_id} of session {self.session_name}"
+
+
+class TelethonSentFile(Model):
+    """Уже загруженный в Telegram файл: повторно он отправляется без загрузки"""
+    
+    id = fields.BigIntField(pk=True)
+    session_name = fields.CharField(max_length=64, description="Название сессии")
+    md5_digest = fields.BinaryField(description="MD5 содержимого")
+    file_size = fields.BigIntField(description="Размер файла")
+    type = fields.SmallIntField(description="0 - документ, 1 - фото")
+    file_id = fields.BigIntField(description="ID файла в Telegram")
+    hash = fields.BigIntField(description="access_hash файла")
+    
+    class Meta:
+        table = "telethon_sent_files"
+        table_description = "Загруженные файлы сессий Telethon (формат таблицы sent_files файла .session)"
+        unique_together = (("session_name", "md5_digest", "file_size", "type"),)
+    
+    def __str__(self):
+        return f"TelethonSentFile {self.file_id} of session {self.session_name}"
+
+
+class TelethonUpdateState(Model):
+    """Состояние получения обновлений сессии Telethon (общее и по каналам)"""
+    
+    id = fields.BigIntField(pk=True)
+    session_name = fields.CharField(max_length=64, description="Название сессии")
+    entity_id = fields.BigIntField(description="ID канала или 0 для общего состояния")
+    pts = fields.BigIntField(description="pts")
+    qts = fields.BigIntField(description="qts")
+    date = fields.BigIntField(description="date (unix)")
+    seq = fields.BigIntField(description="seq")
+    
+    class Meta:
+        table = "telethon_update_state"
+        table_description = "Состояние обновлений сессий Telethon (формат таблицы update_state файла .session)"
+        unique_together = (("session_name", "entity_id"),)
+    
+    def __str__(self):
+        return f"TelethonUpdateState {self.entity_id} of session {self.session_name}"
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import io
+import logging
+import re
+from collections import OrderedDict
+from PIL import Image
+from config import NEAR_DUPLICATE_INDEX_SIZE, NEAR_DUPLICATE_MIN_WORDS
+
+logger = logging.getLogger(__name__)
+
+# Максимальное расстояние Хэмминга между отпечатками, при котором посты считаются почти одинаковыми
+TEXT_DISTANCE = 6
+IMAGE_DISTANCE = 6
+
+# 64-битный отпечаток делится на BANDS полос по BAND_BITS бит. Если отпечатки отличаются
+# не больше чем в BANDS - 1 битах, хотя бы одна полоса у них совпадает (принцип Дирихле),
+# поэтому поиск по полосам не теряет дубликаты в пределах порогов выше
+BANDS = 8
+BAND_BITS = 8
+BAND_MASK = (1 << BAND_BITS) - 1
+
+WORD_RE = re.compile(r"\w+")
+
+# Проиндексированные посты в порядке добавления:
+# {ID записи комментария: {"text_hash", "image_hashes", "comment", "channel_id"}}
+_entries = OrderedDict()
+# Корзины LSH: {(номер полосы, значение полосы): {ID записей комментариев}}
+_buckets = {}
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def text_simhash(text: str) -> int:
+    """
+    Вычисляет SimHash текста по словам
+
+    У коротких постов правка пары слов меняет большую долю шинглов из нескольких слов,
+    поэтому признаками служат отдельные слова.
+
+    Args:
+        text: Текст поста
+
+    Returns:
+        int: 64-битный отпечаток или None, если в тексте нет слов
+    """
+    words = WORD_RE.findall((text or "").lower())
+    if not words:
+        return None
+
+    weights = [0] * 64
+    for word in words:
+        word_hash = _hash64(word)
+        for bit in range(64):
+            weights[bit] += 1 if word_hash >> bit & 1 else -1
+
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def image_dhash(data: bytes) -> int:
+    """
+    Вычисляет разностный перцептивный хэш (dHash) изображения
+
+    Хэш не меняется при пережатии и небольшом изменении размера картинки.
+
+    Args:
+        data: Содержимое файла изображения
+
+    Returns:
+        int: 64-битный отпечаток
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        pixels = list(image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def _image_hashes(photos: list) -> list:
+    hashes = []
+    for data in photos:
+        try:
+            hashes.append(image_dhash(data))
+        except Exception as e:
+            logger.warning(f"Не удалось вычислить перцептивный хэш фото: {e}")
+    return hashes
+
+
+async def fingerprint_post(post_text: str, photos: list = None) -> dict:
+    """
+    Вычисляет отпечатки текста и фото поста
+
+    Args:
+        post_text: Текст поста
+        photos: Список фото (содержимое файлов, опционально)
+
+    Returns:
+        dict: {"text_hash": int или None, "image_hashes": [int], "words": количество слов текста}
+    """
+    image_hashes = await asyncio.to_thread(_image_hashes, photos) if photos else []
+    return {
+        "text_hash": text_simhash(post_text),
+        "image_hashes": image_hashes,
+        "words": len(WORD_RE.findall(post_text or "")),
+    }
+
+
+def _bands(value: int) -> list:
+    return [(band, value >> band * BAND_BITS & BAND_MASK) for band in range(BANDS)]
+
+
+def _all_hashes(fingerprint: dict) -> list:
+    """Все отпечатки поста, по которым он раскладывается в корзины"""
+    text_hash = fingerprint["text_hash"]
+    return fingerprint["image_hashes"] + ([text_hash] if text_hash is not None else [])
+
+
+def _distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _is_match(fingerprint: dict, entry: dict) -> bool:
+    """Совпадают ли посты и по тексту, и по фото (наличие текста и фото тоже должно совпадать)"""
+    text_a, text_b = fingerprint["text_hash"], entry["text_hash"]
+    if (text_a is None) != (text_b is None):
+        return False
+    if text_a is not None and _distance(text_a, text_b) > TEXT_DISTANCE:
+        return False
+
+    images_a, images_b = fingerprint["image_hashes"], entry["image_hashes"]
+    if bool(images_a) != bool(images_b):
+        return False
+    if images_a and not any(_distance(a, b) <= IMAGE_DISTANCE for a in images_a for b in images_b):
+        return False
+
+    return text_a is not None or bool(images_a)
+
+
+def find_duplicate(fingerprint: dict, channel_id: int = None) -> dict:
+    """
+    Ищет в индексе почти такой же пост
+
+    Короткие тексты без фото ("Доброе утро") не ищутся: у разных постов они совпадают слишком часто.
+
+    Args:
+        fingerprint: Отпечатки поста из fingerprint_post
+        channel_id: Искать только среди постов этого канала (по умолчанию - среди всех)
+
+    Returns:
+        dict: {"comment_id", "comment", "channel_id"} найденного поста или None
+    """
+    if not fingerprint["image_hashes"] and fingerprint["words"] < NEAR_DUPLICATE_MIN_WORDS:
+        return None
+
+    candidates = set()
+    for value in _all_hashes(fingerprint):
+        for band in _bands(value):
+            candidates.update(_buckets.get(band, ()))
+
+    # Проверяем сначала самые свежие посты
+    for comment_id in sorted(candidates, reverse=True):
+        entry = _entries[comment_id]
+        if channel_id is not None and entry["channel_id"] != channel_id:
+            continue
+        if _is_match(fingerprint, entry):
+            return {"comment_id": comment_id, "comment": entry["comment"], "channel_id": entry["channel_id"]}
+    return None
+
+
+def _forget(comment_id: int):
+    entry = _entries.pop(comment_id)
+    for value in _all_hashes(entry):
+        for band in _bands(value):
+            bucket = _buckets.get(band)
+            if bucket is None:
+                continue
+            bucket.discard(comment_id)
+            if not bucket:
+                del _buckets[band]
+
+
+def remember(fingerprint: dict, comment_id: int, comment: str, channel_id: int):
+    """
+    Добавляет пост в индекс; самые старые посты вытесняются сверх NEAR_DUPLICATE_INDEX_SIZE
+
+    Args:
+        fingerprint: Отпечатки поста из fingerprint_post
+        comment_id: ID записи комментария
+        comment: Сгенерированный комментарий
+        channel_id: ID канала
+    """
+    if not _all_hashes(fingerprint):
+        return
+
+    if comment_id in _entries:
+        _forget(comment_id)
+    _entries[comment_id] = {**fingerprint, "comment": comment, "channel_id": channel_id}
+    for value in _all_hashes(fingerprint):
+        for band in _bands(value):
+            _buckets.setdefault(band, set()).add(comment_id)
+
+    while len(_entries) > NEAR_DUPLICATE_INDEX_SIZE:
+        _forget(next(iter(_entries)))
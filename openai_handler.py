@@ -1,8 +1,10 @@
 import openai
 import base64
 import logging
+import time
 import httpx
 from config import OPENAI_API_KEY, PROXY_URL
+from prompt_compaction import compact_prompt
 
 logger = logging.getLogger(__name__)
 
@@ -12,73 +14,56 @@ client = openai.AsyncOpenAI(
     http_client=httpx.AsyncClient(proxy=PROXY_URL)
 )
 
+# Комментарий, который возвращается, если генерация не удалась
+FALLBACK_COMMENT = "Интересный пост! 👍"
 
-async def generate_comment(text: str, photos_base64: list = None, channel_description: str = None, channel_name: str = None) -> str:
+# Модель по умолчанию
+DEFAULT_MODEL = "gpt-4o"
+# Модель самопроверки комментариев перед автопубликацией
+SELF_CHECK_MODEL = "gpt-4o-mini"
+
+# Цены моделей, USD за 1 млн токенов: (вход, вход из кэша OpenAI, выход)
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+
+def estimate_cost(model: str, input_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+    """
+    Оценивает стоимость запроса по ценам MODEL_PRICES
+
+    Returns:
+        float: Стоимость в USD или None, если цена модели неизвестна
+    """
+    prices = MODEL_PRICES.get(model)
+    if not prices:
+        return None
+    input_price, cached_price, output_price = prices
+    cost = (input_tokens - cached_tokens) * input_price + cached_tokens * cached_price + output_tokens * output_price
+    return cost / 1_000_000
+
+
+async def generate_comment(text: str, photos: list = None, channel_description: str = None, channel_name: str = None,
+                           model: str = None) -> tuple:
     """
     Генерирует комментарий к посту с помощью OpenAI
     
     Args:
         text: Текст поста
-        photos_base64: Список фото в формате base64 (опционально)
+        photos: Список фото (содержимое файлов, опционально); в base64 кодируются только
+            отобранные для запроса
         channel_description: Описание канала для контекста
+        model: Модель OpenAI (по умолчанию DEFAULT_MODEL; при перегрузке планировщик передает DEGRADED_MODEL)
     
     Returns:
-        str: Сгенерированный комментарий
+        tuple: (сгенерированный комментарий, метаданные генерации: {"model", "input_tokens", "output_tokens",
+            "cached_tokens", "image_tokens", "latency", "cost"}; при ошибке заполнены не все поля)
     """
     logger.info(f"Начинаем генерацию комментария для текста: {text[:100]}...")
+    model = model or DEFAULT_MODEL
+    usage = {"model": model}
     try:
-        # Промпт для генерации комментария
-        channel_context = f"\nО канале: {channel_description}" if channel_description else ""
-        
-        system_prompt = f"""Ты умный и живой человек, который комментирует посты в Telegram канале. Твоя задача - писать короткие, яркие и человеческие комментарии.
-
-{channel_context}
-
-Ты пишешь комментарий от имени Алекса Громова. Алекс Громов - it-предприниматель, разрабатывает AI-агентов.
-У него агентство продуктовой IT-разработки и он программист. Ему 22 года. Выражайся как настоящий человек, а не как бот.
-
-ПРАВИЛА КОММЕНТАРИЕВ:
-- Длина: 2-6 слов максимум
-- Стиль: живой, эмоциональный, как настоящий человек
-- Используй emoji, но не всегда: 😁⚡️🔥😂💪🎯🚀💡👍👏
-- Показывай эмоции и реакцию
-- Будь конкретным и по делу
-- Избегай формальности и "ботности"
-
-ПРИМЕРЫ ХОРОШИХ КОММЕНТАРИЕВ:
-- "Точно! 🔥"
-- "Крутая схема ⚡️"
-- "Попробую 😁"
-- "Где детали? 💡"
-- "Мощно! 💪"
-- "А как с...? 🤔"
-- "Бомба! 🚀"
-- "Согласен 👍"
-
-Если в посте есть медиа-группа (несколько фото/схем/диаграмм), анализируй всю группу целиком и реагируй на общий контент эмоционально и по делу."""
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Текст поста: {text}. Напиши короткий живой комментарий к этому посту:\n\n{text}"}
-        ]
-
-        # Если есть фото, добавляем их в сообщение
-        if photos_base64:
-            content = [{"type": "text", "text": f"Напиши короткий живой комментарий к этому посту:\n\n{text}"}]
-            
-            # Добавляем все фото из медиа-группы
-            for i, photo_base64 in enumerate(photos_base64):
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{photo_base64}"
-                    }
-                })
-            
-            messages[1]["content"] = content
-
-        # Выбираем модель в зависимости от наличия фото
-        model = "gpt-4o" if photos_base64 else "gpt-4o"
         
         # Отправляем запрос к OpenAI через прокси
         logger.info(f"Отправляем запрос к OpenAI через прокси: {PROXY_URL}")
@@ -103,6 +88,13 @@ async def generate_comment(text: str, photos_base64: list = None, channel_descri
 
 Напиши короткий живой комментарий к этому посту:"""
 
+        # Укладываем длинный текст и большие альбомы в бюджет токенов
+        compacted = await compact_prompt(system_prompt, text, photos)
+        text = compacted["text"]
+        photos_base64 = compacted["photos_base64"]
+        usage["image_tokens"] = compacted["image_tokens"]
+        started = time.monotonic()
+
         # Формируем input для Responses API
         if photos_base64:
             # Если есть фото, используем формат с изображениями
@@ -114,7 +106,8 @@ async def generate_comment(text: str, photos_base64: list = None, channel_descri
             for photo_base64 in photos_base64:
                 input_content.append({
                     "type": "input_image",
-                    "image_url": f"data:image/jpeg;base64,{photo_base64}"
+                    "image_url": f"data:image/jpeg;base64,{photo_base64}",
+                    "detail": compacted["detail"]
                 })
             
             response = await client.responses.create(
@@ -131,14 +124,68 @@ async def generate_comment(text: str, photos_base64: list = None, channel_descri
                 input=f"{system_prompt}\n\n{text}"
             )
 
+        usage["latency"] = time.monotonic() - started
         comment = response.output_text.strip()
         logger.info(f"Сгенерирован комментарий: {comment[:50]}...")
+        if response.usage:
+            logger.info(f"Токены: оценка {compacted['estimated_tokens']}, фактически {response.usage.input_tokens} "
+                        f"на входе и {response.usage.output_tokens} на выходе")
+            details = response.usage.input_tokens_details
+            usage["input_tokens"] = response.usage.input_tokens
+            usage["output_tokens"] = response.usage.output_tokens
+            usage["cached_tokens"] = details.cached_tokens if details else 0
+            usage["cost"] = estimate_cost(model, usage["input_tokens"], usage["cached_tokens"], usage["output_tokens"])
         
-        return comment
+        return comment, usage
 
     except Exception as e:
         logger.error(f"Ошибка при генерации комментария: {e}")
-        return "Интересный пост! 👍"
+        return FALLBACK_COMMENT, usage
+
+
+async def self_check_comment(post_text: str, comment: str) -> tuple:
+    """
+    Просит модель проверить, можно ли публиковать комментарий без участия человека
+
+    Args:
+        post_text: Текст поста
+        comment: Сгенерированный комментарий
+
+    Returns:
+        tuple: (True если комментарий уместен, при ошибке - False;
+            токены и стоимость проверки: {"input_tokens", "output_tokens", "cached_tokens", "cost"} или {})
+    """
+    prompt = f"""Ты модератор комментариев в Telegram. Проверь комментарий к посту.
+
+Комментарий можно публиковать, если он:
+- по теме поста и не противоречит ему
+- не грубый, не оскорбительный и не провокационный
+- не содержит рекламы, ссылок и упоминаний политики
+- звучит как живой человек, а не как бот
+
+Текст поста: {post_text[:2000]}
+
+Комментарий: {comment}
+
+Ответь одним словом: ДА, если комментарий можно публиковать, или НЕТ."""
+
+    usage = {}
+    try:
+        response = await client.responses.create(model=SELF_CHECK_MODEL, input=prompt)
+        if response.usage:
+            details = response.usage.input_tokens_details
+            usage["input_tokens"] = response.usage.input_tokens
+            usage["output_tokens"] = response.usage.output_tokens
+            usage["cached_tokens"] = details.cached_tokens if details else 0
+            usage["cost"] = estimate_cost(
+                SELF_CHECK_MODEL, usage["input_tokens"], usage["cached_tokens"], usage["output_tokens"]
+            )
+        answer = response.output_text.strip().upper()
+        logger.info(f"Самопроверка комментария '{comment[:50]}': {answer}")
+        return answer.startswith("ДА"), usage
+    except Exception as e:
+        logger.error(f"Ошибка при самопроверке комментария: {e}")
+        return False, usage
 
 
 def image_to_base64(image_path: str) -> str:
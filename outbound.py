@@ -0,0 +1,288 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import Counter, deque
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError, TelegramEntityTooLarge
+from aiogram.methods import AnswerCallbackQuery, EditMessageReplyMarkup, EditMessageText, EditMessageCaption
+from config import OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_DELAY
+
+logger = logging.getLogger(__name__)
+
+# Правки сообщений, которые можно объединять: отправляется только последняя версия
+COALESCED_METHODS = (EditMessageReplyMarkup, EditMessageText, EditMessageCaption)
+# Ответы на нажатия кнопок отправляются вне очереди чатов и раньше остальных запросов
+PRIORITY_METHODS = (AnswerCallbackQuery,)
+# Максимальная пауза перед повтором после сетевой ошибки (секунды)
+MAX_RETRY_BACKOFF = 30
+
+
+class DeliveryTimeout(Exception):
+    """Запрос к Bot API не удалось выполнить за OUTBOUND_MAX_DELAY секунд"""
+
+
+class TokenBucket:
+    """Ведро токенов: не больше rate запросов в секунду с накоплением до capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class OutboundQueue(BaseRequestMiddleware):
+    """
+    Очередь исходящих запросов бота с ограничением частоты по лимитам Bot API
+
+    Подключается к сессии бота, поэтому через нее проходят все вызовы с chat_id (send_*, copy_*,
+    edit_*) и ответы на нажатия кнопок; остальные запросы (getUpdates, setWebhook и т.д.) идут напрямую.
+    Запросы одного чата выполняются по порядку и по одному. При TelegramRetryAfter чат
+    ставится на паузу на retry_after секунд, после чего запрос повторяется; при сетевых ошибках -
+    повтор с растущей паузой. Запрос, не выполненный за max_delay секунд, завершается DeliveryTimeout.
+    Ожидающие правки одного сообщения объединяются: отправляется только последняя.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, group_rate: float, chat_burst: int, max_delay: float):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_delay = max_delay
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        # Ожидающие запросы по чатам: {chat_id: deque записей}; ответы на нажатия - под ключом None
+        self._pending = {}
+        # Ожидающие правки: {(метод, chat_id, message_id): запись}
+        self._edits = {}
+        # Чаты на паузе после TelegramRetryAfter: {chat_id: time.monotonic() окончания паузы}
+        self._paused_until = {}
+        # Чаты, запрос которых сейчас выполняется
+        self._in_flight = set()
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+        self.stats = Counter()
+        # Наибольшее время от постановки запроса в очередь до его выполнения, секунды
+        self.max_wait = 0.0
+
+    async def __call__(self, make_request, bot, method):
+        priority = isinstance(method, PRIORITY_METHODS)
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None and not priority:
+            return await make_request(bot, method)
+
+        future = asyncio.get_running_loop().create_future()
+        edit_key = None
+        if isinstance(method, COALESCED_METHODS) and method.message_id is not None:
+            edit_key = (type(method), chat_id, method.message_id)
+            entry = self._edits.get(edit_key)
+            if entry:
+                # Более ранняя правка еще не отправлена: заменяем ее, ожидающие получат результат последней
+                entry["method"] = method
+                entry["futures"].append(future)
+                self.stats["coalesced"] += 1
+                return await future
+
+        queue_key = None if priority else chat_id
+        now = time.monotonic()
+        entry = {
+            "make_request": make_request,
+            "bot": bot,
+            "method": method,
+            "futures": [future],
+            "queue_key": queue_key,
+            "edit_key": edit_key,
+            "sequence": next(self._sequence),
+            "queued_at": now,
+            "deadline": now + self.max_delay,
+            "not_before": 0.0,
+            "attempts": 0,
+        }
+        self._pending.setdefault(queue_key, deque()).append(entry)
+        if edit_key:
+            self._edits[edit_key] = entry
+        self._ensure_dispatcher()
+        self._wakeup.set()
+        return await future
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Личные чаты - около 1 сообщения в секунду, группы и каналы - 20 в минуту
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _discard_head(self, queue_key, entry: dict):
+        self._pending[queue_key].popleft()
+        if not self._pending[queue_key]:
+            del self._pending[queue_key]
+        if entry["edit_key"] and self._edits.get(entry["edit_key"]) is entry:
+            del self._edits[entry["edit_key"]]
+
+    def _next_entry(self, now: float) -> tuple:
+        """
+        Выбирает запрос, который можно выполнить сейчас
+
+        Returns:
+            tuple: (запись или None, через сколько секунд проверить очередь снова или None)
+        """
+        best = None
+        wait = None
+        for queue_key in list(self._pending):
+            if queue_key is not None and queue_key in self._in_flight:
+                continue
+            entry = self._pending[queue_key][0]
+            if all(future.done() for future in entry["futures"]):
+                # Все ожидающие отменили запрос
+                self._discard_head(queue_key, entry)
+                continue
+            if now > entry["deadline"]:
+                self._discard_head(queue_key, entry)
+                self._fail(entry, DeliveryTimeout(f"запрос {type(entry['method']).__name__} не выполнен "
+                                                  f"за {self.max_delay:g} с"))
+                continue
+
+            delay = max(entry["not_before"] - now, self._paused_until.get(queue_key, 0.0) - now)
+            if queue_key is not None:
+                delay = max(delay, self._chat_bucket(queue_key).delay(now))
+            if delay > 0:
+                # Проверяем снова не позже дедлайна, чтобы вовремя завершить запрос DeliveryTimeout
+                delay = min(delay, entry["deadline"] - now + 0.01)
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            # Ответы на нажатия - первыми, остальные - в порядке поступления
+            if best is None or (entry["queue_key"] is not None, entry["sequence"]) < \
+                    (best["queue_key"] is not None, best["sequence"]):
+                best = entry
+        return best, wait
+
+    async def _dispatch_loop(self):
+        while self._pending:
+            self._wakeup.clear()
+            now = time.monotonic()
+            entry, wait = self._next_entry(now)
+            if entry:
+                global_delay = self._global.delay(now)
+                if global_delay > 0:
+                    wait = global_delay
+                else:
+                    self._global.take(now)
+                    if entry["queue_key"] is not None:
+                        self._chat_bucket(entry["queue_key"]).take(now)
+                        self._in_flight.add(entry["queue_key"])
+                    self._discard_head(entry["queue_key"], entry)
+                    asyncio.create_task(self._send(entry))
+                    continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, entry: dict):
+        queue_key = entry["queue_key"]
+        method_name = type(entry["method"]).__name__
+        try:
+            result = await entry["make_request"](entry["bot"], entry["method"])
+        except TelegramRetryAfter as e:
+            self.stats["retried"] += 1
+            self._paused_until[queue_key] = time.monotonic() + e.retry_after
+            logger.warning(f"⏸️  Лимит Bot API ({method_name}, чат {queue_key}): пауза {e.retry_after} с")
+            self._requeue(entry)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if isinstance(e, TelegramEntityTooLarge):
+                self._fail(entry, e)
+                return
+            self.stats["retried"] += 1
+            backoff = min(2 ** entry["attempts"], MAX_RETRY_BACKOFF)
+            entry["not_before"] = time.monotonic() + backoff
+            logger.warning(f"🔁 Ошибка Bot API ({method_name}), повтор через {backoff} с: {e}")
+            self._requeue(entry)
+        except Exception as e:
+            self._fail(entry, e)
+        else:
+            self.stats["sent"] += 1
+            self.max_wait = max(self.max_wait, time.monotonic() - entry["queued_at"])
+            for future in entry["futures"]:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._in_flight.discard(queue_key)
+            if self._pending:
+                self._ensure_dispatcher()
+            self._wakeup.set()
+
+    def _requeue(self, entry: dict):
+        """Возвращает запрос в начало очереди чата для повтора"""
+        entry["attempts"] += 1
+        newer = self._edits.get(entry["edit_key"]) if entry["edit_key"] else None
+        if newer:
+            # Пока запрос выполнялся, пришла более новая правка того же сообщения
+            newer["futures"].extend(entry["futures"])
+            newer["deadline"] = min(newer["deadline"], entry["deadline"])
+            return
+        self._pending.setdefault(entry["queue_key"], deque()).appendleft(entry)
+        if entry["edit_key"]:
+            self._edits[entry["edit_key"]] = entry
+
+    def _fail(self, entry: dict, error: Exception):
+        self.stats["failed"] += 1
+        for future in entry["futures"]:
+            if not future.done():
+                future.set_exception(error)
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Ждет выполнения всех запросов в очереди
+
+        Args:
+            timeout: Сколько секунд ждать
+
+        Returns:
+            int: Сколько запросов осталось невыполненными
+        """
+        deadline = time.monotonic() + timeout
+        while (self._pending or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        return sum(len(entries) for entries in self._pending.values()) + len(self._in_flight)
+
+    def get_stats(self) -> dict:
+        """
+        Возвращает состояние очереди
+
+        Returns:
+            dict: {"waiting", "paused_chats", "sent", "retried", "coalesced", "failed", "max_wait"}
+        """
+        now = time.monotonic()
+        return {
+            "waiting": sum(len(entries) for entries in self._pending.values()),
+            "paused_chats": sum(1 for until in self._paused_until.values() if until > now),
+            "sent": self.stats["sent"],
+            "retried": self.stats["retried"],
+            "coalesced": self.stats["coalesced"],
+            "failed": self.stats["failed"],
+            "max_wait": round(self.max_wait, 2),
+        }
+
+
+outbound_queue = OutboundQueue(OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE,
+                               OUTBOUND_CHAT_BURST, OUTBOUND_MAX_DELAY)
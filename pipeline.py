@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+from models import Comment, CommentStatus
+from openai_handler import generate_comment, FALLBACK_COMMENT
+from bot import send_comment_preview, send_auto_publish_report
+from publisher import can_publish, publish_comment, get_comment_url
+from auto_publish import check_auto_publish
+from channels_config import CHANNELS
+from media_store import hash_from_path
+from post_snapshot import PostSnapshot
+from config import NEAR_DUPLICATE_MODE, DEGRADED_MODEL
+from scheduler import scheduler, PostExpired, LEVEL_NO_IMAGES, LEVEL_CHEAP_MODEL
+import near_duplicates
+import stats
+
+logger = logging.getLogger(__name__)
+
+
+def get_channel_info(channel_id: int) -> dict:
+    """
+    Возвращает конфигурацию канала по его ID
+
+    Args:
+        channel_id: ID канала
+
+    Returns:
+        dict: Конфигурация канала или None, если канал не найден
+    """
+    for channel_name, channel_info in CHANNELS.items():
+        if channel_info["channel_id"] == channel_id:
+            return channel_info
+    return None
+
+
+async def auto_publish_comment(comment_record: Comment, channel_name: str, channel_info: dict) -> bool:
+    """
+    Публикует комментарий без подтверждения, если он проходит правила автопубликации канала
+
+    Решение правил сохраняется в записи комментария, токены и стоимость самопроверки
+    добавляются к токенам и стоимости генерации.
+
+    Args:
+        comment_record: Запись комментария со статусом PENDING
+        channel_name: Название канала
+        channel_info: Конфигурация канала
+
+    Returns:
+        bool: True если комментарий опубликован
+    """
+    qualifies, decision, check_usage = await check_auto_publish(
+        channel_info, comment_record.post_text or "", comment_record.generated_comment
+    )
+    if decision is None:
+        return False
+
+    # Самопроверка - отдельный запрос к модели: ее стоимость входит в стоимость комментария
+    for field in ("input_tokens", "output_tokens", "cached_tokens", "cost"):
+        if check_usage.get(field) is not None:
+            setattr(comment_record, field, (getattr(comment_record, field) or 0) + check_usage[field])
+
+    if qualifies and not can_publish():
+        qualifies, decision = False, "отклонен: в процессе нет Telethon клиента (режим очереди)"
+
+    logger.info(f"   ⚡ Автопубликация комментария {comment_record.id}: {decision}")
+    comment_record.auto_publish_decision = decision
+    await comment_record.save()
+    if not qualifies:
+        return False
+
+    try:
+        success = await publish_comment(comment_record)
+    except Exception as e:
+        logger.error(f"   ❌ Ошибка при автопубликации комментария {comment_record.id}: {e}")
+        success = False
+
+    if not success:
+        # Возвращаем комментарий на ручное подтверждение
+        comment_record.status = CommentStatus.PENDING
+        comment_record.auto_publish_decision = f"{decision}; ошибка публикации"
+        await comment_record.save()
+        return False
+
+    comment_record.auto_published = True
+    await comment_record.save()
+    await send_auto_publish_report(
+        channel_name=channel_name,
+        post_text=comment_record.post_text or "",
+        comment=comment_record.generated_comment,
+        comment_url=get_comment_url(comment_record),
+        latency=comment_record.publish_latency
+    )
+    return True
+
+
+async def process_post(snapshot: PostSnapshot, message_id_waiter=None):
+    """
+    Генерирует комментарий к посту, сохраняет его и отправляет превью администратору
+
+    Args:
+        snapshot: Пост (фото уже скачаны)
+        message_id_waiter: Задача, возвращающая ID сообщения в чате обсуждения, если он
+            еще неизвестен (ранний старт по посту в канале); ожидается после генерации
+
+    Returns:
+        Comment: Созданная запись комментария или None
+    """
+    channel_name = snapshot.channel_name
+    channel_id = snapshot.channel_id
+    channel_info = get_channel_info(channel_id)
+    if not channel_info or not channel_info.get("chat_id"):
+        logger.warning(f"Chat ID не найден для канала {channel_id}")
+        return None
+
+    # Ищем почти такой же пост среди уже обработанных
+    near_duplicate_mode = channel_info.get("near_duplicate", NEAR_DUPLICATE_MODE)
+    photos = snapshot.photos_data
+    fingerprint = None
+    duplicate = None
+    if near_duplicate_mode != "off":
+        fingerprint = await near_duplicates.fingerprint_post(snapshot.text, photos)
+        # Готовый комментарий берется только из того же канала, пропускаются дубликаты из любых каналов
+        duplicate = near_duplicates.find_duplicate(
+            fingerprint, channel_id if near_duplicate_mode == "reuse" else None
+        )
+    if duplicate and near_duplicate_mode == "suppress":
+        logger.info(f"   ♻️  Пост почти совпадает с постом комментария {duplicate['comment_id']}, пропускаем")
+        # Дожидаемся копии поста в чате обсуждения, чтобы она не была обработана как новый пост
+        if message_id_waiter is not None:
+            try:
+                await message_id_waiter
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    # Генерируем комментарий (для почти одинакового поста берем уже готовый)
+    usage = {}
+    if duplicate:
+        generated_comment = duplicate["comment"]
+        logger.info(f"   ♻️  Пост почти совпадает с постом комментария {duplicate['comment_id']}, "
+                    f"комментарий взят повторно: {generated_comment[:50]}...")
+    else:
+        # Слот генерации выдается по ближайшему дедлайну; устаревший пост отбрасывается
+        try:
+            level = await scheduler.acquire(channel_name, channel_info, snapshot.date)
+        except PostExpired:
+            if message_id_waiter is not None:
+                message_id_waiter.cancel()
+            return None
+
+        if level >= LEVEL_NO_IMAGES and photos:
+            logger.info(f"   🪶 Перегрузка (уровень {level}): генерация без фото")
+        started = time.monotonic()
+        try:
+            generated_comment, usage = await generate_comment(
+                snapshot.text,
+                None if level >= LEVEL_NO_IMAGES else photos or None,
+                channel_info.get("description"),
+                channel_name,
+                model=DEGRADED_MODEL if level >= LEVEL_CHEAP_MODEL else None
+            )
+            logger.info(f"   🤖 AI сгенерировал комментарий: {generated_comment[:50]}...")
+        except Exception as e:
+            logger.error(f"   ❌ Ошибка при генерации комментария: {e}")
+            generated_comment = FALLBACK_COMMENT
+        finally:
+            scheduler.release(time.monotonic() - started)
+
+    # При раннем старте ждем, пока копия поста появится в чате обсуждения
+    if message_id_waiter is not None:
+        try:
+            snapshot.message_id = await message_id_waiter
+            logger.info(f"   🔗 Копия поста в чате обсуждения: message_id={snapshot.message_id}")
+        except asyncio.TimeoutError:
+            logger.warning(f"   ⌛ Копия поста канала {channel_id} не появилась в чате обсуждения, комментарий не сохранен")
+            return None
+
+    # Сохраняем в базу данных (сохраняем только первое фото для совместимости)
+    photo_paths = snapshot.photo_paths
+    comment_record = await Comment.create(
+        channel_id=channel_id,
+        message_id=snapshot.message_id,
+        generated_comment=generated_comment,
+        post_text=snapshot.text,
+        photo_path=photo_paths[0] if photo_paths else None,
+        photo_hashes=[hash_from_path(path) for path in photo_paths] if photo_paths else None,
+        status=CommentStatus.PENDING,
+        post_date=snapshot.date,
+        duplicate_of=duplicate["comment_id"] if duplicate else None,
+        model=usage.get("model"),
+        input_tokens=usage.get("input_tokens"),
+        output_tokens=usage.get("output_tokens"),
+        cached_tokens=usage.get("cached_tokens"),
+        image_tokens=usage.get("image_tokens"),
+        cost=usage.get("cost"),
+        generation_latency=usage.get("latency"),
+        download_duration=snapshot.download_duration,
+        cache_hits={"near_duplicate": bool(duplicate), "prompt_cache": bool(usage.get("cached_tokens"))}
+    )
+
+    logger.info(f"   💾 Создана запись комментария с ID {comment_record.id}, message_id={comment_record.message_id}")
+
+    if fingerprint and not duplicate and generated_comment != FALLBACK_COMMENT:
+        near_duplicates.remember(fingerprint, comment_record.id, generated_comment, channel_id)
+
+    # Комментарии, прошедшие правила канала, публикуем сразу, без ожидания администратора
+    if not await auto_publish_comment(comment_record, channel_name, channel_info):
+        # Отправляем превью в бот
+        logger.info(f"   📤 Отправляем уведомление в бот...")
+        started = time.monotonic()
+        preview_cache_hits = await send_comment_preview(snapshot, generated_comment, comment_record.id)
+        comment_record.preview_duration = time.monotonic() - started
+        comment_record.cache_hits = {**comment_record.cache_hits, **preview_cache_hits}
+        await comment_record.save(update_fields=["preview_duration", "cache_hits"])
+
+    await stats.record_comment(comment_record)
+    return comment_record
@@ -0,0 +1,82 @@
+import base64
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+
+
+@dataclass(slots=True)
+class PostPhoto:
+    """Фото поста: ссылка на фото Telegram до скачивания, затем содержимое и путь в хранилище медиа"""
+
+    # ID сообщения с фото в чате, откуда получен пост
+    message_id: int = None
+    # Фото Telegram (types.Photo) для скачивания; после скачивания не хранится
+    media: object = None
+    # Содержимое файла
+    data: bytes = None
+    # Путь в хранилище медиа (в режиме local)
+    path: str = None
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+
+@dataclass(slots=True)
+class PostSnapshot:
+    """
+    Пост в том виде, в котором он проходит все этапы: прием, очередь, генерация, сохранение и превью
+
+    Собирается один раз при приеме вместо хранения сообщений Telethon (с их ссылками на клиент
+    и сырыми TL данными) и списков base64 строк.
+    """
+
+    channel_name: str
+    channel_id: int
+    # ID сообщения в чате обсуждения, к которому пишется комментарий
+    # (при раннем старте становится известен после генерации)
+    message_id: int = None
+    text: str = ""
+    date: datetime = None
+    photos: list = field(default_factory=list)
+    # ID всех сообщений поста в чате, откуда он получен (для сопоставления копии при раннем старте)
+    source_ids: list = field(default_factory=list)
+    # Пост получен из самого канала (ранний старт)
+    early: bool = False
+    # Время скачивания фото, секунды
+    download_duration: float = None
+
+    def add_text(self, text: str):
+        """Добавляет текст очередного сообщения альбома"""
+        if text:
+            self.text = f"{self.text} {text}" if self.text else text
+
+    @property
+    def photos_data(self) -> list:
+        """Содержимое скачанных фото"""
+        return [photo.data for photo in self.photos if photo.data]
+
+    @property
+    def photo_paths(self) -> list:
+        """Пути к фото в хранилище медиа"""
+        return [photo.path for photo in self.photos if photo.path]
+
+    @property
+    def photos_base64(self) -> list:
+        """Фото в формате base64 (для задачи в очереди)"""
+        return [photo.to_base64() for photo in self.photos if photo.data]
+
+    @property
+    def media_message_ids(self) -> list:
+        """ID сообщений с фото в чате обсуждения (при раннем старте неизвестны)"""
+        if self.early:
+            return []
+        return [photo.message_id for photo in self.photos if photo.data and photo.message_id]
+
+    def memory_size(self) -> int:
+        """Примерный объем памяти поста в байтах (сам пост, текст, фото и их содержимое)"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.text) + sys.getsizeof(self.photos)
+        size += sys.getsizeof(self.source_ids) + sum(sys.getsizeof(source_id) for source_id in self.source_ids)
+        for photo in self.photos:
+            size += sys.getsizeof(photo) + (sys.getsizeof(photo.data) if photo.data else 0)
+            size += sys.getsizeof(photo.path) if photo.path else 0
+        return size
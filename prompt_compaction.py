@@ -0,0 +1,182 @@
+import asyncio
+import base64
+import io
+import logging
+import math
+import re
+from collections import Counter
+from PIL import Image
+from near_duplicates import image_dhash, IMAGE_DISTANCE
+from config import PROMPT_TOKEN_BUDGET, PROMPT_MAX_IMAGES, PROMPT_IMAGE_DETAIL
+
+logger = logging.getLogger(__name__)
+
+# Грубая оценка: в среднем столько символов русского текста приходится на один токен
+CHARS_PER_TOKEN = 3
+
+# Стоимость изображения в токенах: low - фиксированная, high - базовая часть плюс плитки 512x512
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+TILE_SIDE = 512
+# В режиме low модель все равно видит картинку не больше LOW_DETAIL_SIDE пикселей,
+# поэтому больший файл незачем отправлять
+LOW_DETAIL_SIDE = 512
+
+# Минимум токенов, который остается на текст поста, даже если фото много
+MIN_TEXT_TOKENS = 200
+# Сколько первых предложений поста сохраняется всегда (обычно в них суть)
+LEAD_SENTENCES = 2
+
+SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+WORD_RE = re.compile(r"\w{4,}")
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Оценивает количество токенов в тексте"""
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def estimate_image_tokens(width: int, height: int, detail: str) -> int:
+    """
+    Оценивает стоимость изображения в токенах по правилам OpenAI для моделей gpt-4o
+
+    Args:
+        width: Ширина изображения
+        height: Высота изображения
+        detail: Режим детализации (low, high или auto)
+
+    Returns:
+        int: Количество токенов
+    """
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+
+    # Картинка вписывается в 2048x2048, затем короткая сторона уменьшается до 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / TILE_SIDE) * math.ceil(height / TILE_SIDE)
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * tiles
+
+
+def extract_salient(text: str, max_tokens: int) -> str:
+    """
+    Сокращает текст до бюджета: первые предложения плюс самые содержательные из остальных
+
+    Содержательность предложения - средняя частота его слов во всем посте.
+
+    Args:
+        text: Текст поста
+        max_tokens: Бюджет в токенах
+
+    Returns:
+        str: Текст, укладывающийся в бюджет
+    """
+    if estimate_text_tokens(text) <= max_tokens:
+        return text
+
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    sentences = [sentence.strip() for sentence in SENTENCE_RE.split(text) if sentence.strip()]
+    frequencies = Counter(word.lower() for word in WORD_RE.findall(text))
+
+    def score(index):
+        words = [word.lower() for word in WORD_RE.findall(sentences[index])]
+        return sum(frequencies[word] for word in words) / len(words) if words else 0
+
+    chosen = []
+    length = 0
+    lead = list(range(min(LEAD_SENTENCES, len(sentences))))
+    rest = sorted(range(len(lead), len(sentences)), key=score, reverse=True)
+    for index in lead + rest:
+        if length + len(sentences[index]) + 1 > max_chars:
+            continue
+        chosen.append(index)
+        length += len(sentences[index]) + 1
+
+    if not chosen:
+        return text[:max_chars]
+
+    # Собираем в исходном порядке, пропуски отмечаем многоточием
+    parts = []
+    previous = -1
+    for index in sorted(chosen):
+        if index != previous + 1 and parts:
+            parts.append("…")
+        parts.append(sentences[index])
+        previous = index
+    return " ".join(parts)
+
+
+def _prepare_images(photos: list, detail: str) -> list:
+    """
+    Отбирает разные фото (не больше PROMPT_MAX_IMAGES) и уменьшает их для режима low
+
+    Returns:
+        list: [(содержимое фото, оценка токенов)]
+    """
+    selected = []
+    hashes = []
+    for data in photos:
+        if len(selected) >= PROMPT_MAX_IMAGES:
+            break
+        try:
+            photo_hash = image_dhash(data)
+            # Почти одинаковые фото альбома не добавляют модели информации
+            if any((photo_hash ^ other).bit_count() <= IMAGE_DISTANCE for other in hashes):
+                continue
+
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size
+                if detail == "low" and max(width, height) > LOW_DETAIL_SIDE:
+                    image.thumbnail((LOW_DETAIL_SIDE, LOW_DETAIL_SIDE))
+                    buffer = io.BytesIO()
+                    image.convert("RGB").save(buffer, "JPEG", quality=85)
+                    data = buffer.getvalue()
+        except Exception as e:
+            logger.warning(f"Не удалось подготовить фото для запроса, отправляем как есть: {e}")
+            width, height = TILE_SIDE, TILE_SIDE
+        else:
+            hashes.append(photo_hash)
+
+        selected.append((data, estimate_image_tokens(width, height, detail)))
+    return selected
+
+
+async def compact_prompt(system_prompt: str, text: str, photos: list = None) -> dict:
+    """
+    Укладывает запрос в бюджет PROMPT_TOKEN_BUDGET: отбирает и уменьшает фото, сокращает текст
+
+    Args:
+        system_prompt: Инструкция для модели
+        text: Текст поста
+        photos: Список фото (содержимое файлов, опционально)
+
+    Returns:
+        dict: {"text", "photos_base64" (отобранные фото в base64), "detail", "estimated_tokens",
+            "image_tokens" (оценка токенов отобранных фото)}
+    """
+    detail = PROMPT_IMAGE_DETAIL
+    images = await asyncio.to_thread(_prepare_images, photos, detail) if photos else []
+
+    budget = PROMPT_TOKEN_BUDGET - estimate_text_tokens(system_prompt)
+    # Фото сверх бюджета отбрасываются с конца, первое фото остается всегда
+    while len(images) > 1 and budget - sum(tokens for _, tokens in images) < MIN_TEXT_TOKENS:
+        images.pop()
+    image_tokens = sum(tokens for _, tokens in images)
+
+    compact_text = extract_salient(text or "", max(budget - image_tokens, MIN_TEXT_TOKENS))
+    estimated_tokens = estimate_text_tokens(system_prompt) + estimate_text_tokens(compact_text) + image_tokens
+
+    if len(compact_text) < len(text or "") or len(images) < len(photos or []):
+        logger.info(f"✂️  Запрос сокращен: текст {len(text or '')} → {len(compact_text)} символов, "
+                    f"фото {len(photos or [])} → {len(images)} (detail={detail}), "
+                    f"оценка {estimated_tokens} токенов")
+
+    return {
+        "text": compact_text,
+        "photos_base64": [base64.b64encode(data).decode("utf-8") for data, _ in images],
+        "detail": detail,
+        "estimated_tokens": estimated_tokens,
+        "image_tokens": image_tokens,
+    }
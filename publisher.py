@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from models import Comment, CommentStatus
+from channels_config import CHANNELS
+from config import BULK_PUBLISH_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Функция отправки комментария через Telethon (устанавливается из main.py,
+# чтобы избежать циклического импорта)
+_send_comment_func = None
+
+# ID записей, которые публикуются прямо сейчас в этом процессе (для ожидания при остановке).
+# От двойной отправки защищает перевод записи в статус PUBLISHING в базе
+_in_flight = set()
+# Установлено, когда ни один комментарий не публикуется (ожидание при остановке)
+_idle = asyncio.Event()
+_idle.set()
+
+# До какого момента (time.monotonic) Telegram просит не отправлять сообщения
+_flood_until = 0.0
+
+
+def set_send_comment_function(func):
+    """Устанавливает функцию для отправки комментариев"""
+    global _send_comment_func
+    _send_comment_func = func
+
+
+def can_publish() -> bool:
+    """Может ли текущий процесс публиковать комментарии (есть ли Telethon клиент)"""
+    return _send_comment_func is not None
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Приводит дату из БД к UTC (даты без часового пояса считаются UTC)"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def report_flood_wait(seconds: int):
+    """
+    Запоминает FloodWait, чтобы остальные отправки подождали, а не упирались в тот же лимит
+
+    Args:
+        seconds: Время ожидания из FloodWaitError
+    """
+    global _flood_until
+    _flood_until = max(_flood_until, time.monotonic() + seconds)
+
+
+async def wait_for_flood():
+    """Ждет окончания FloodWait, если он был получен"""
+    delay = _flood_until - time.monotonic()
+    if delay > 0:
+        logger.info(f"⏳ Ожидание FloodWait: {delay:.0f} секунд")
+        await asyncio.sleep(delay)
+
+
+def get_chat_link_id(channel_id: int) -> str:
+    """
+    Возвращает ID чата обсуждения в формате ссылок t.me/c/
+
+    Args:
+        channel_id: ID канала
+
+    Returns:
+        str: ID чата для ссылки или None, если канал не найден
+    """
+    chat_id = None
+    for channel_name, channel_info in CHANNELS.items():
+        if channel_info["channel_id"] == channel_id:
+            chat_id = channel_info["chat_id"]
+            break
+
+    if not chat_id:
+        return None
+
+    # Убираем знак минус и префикс -100 для каналов
+    if chat_id < 0:
+        return str(chat_id)[4:]
+    return str(chat_id)
+
+
+def get_comment_url(comment_record) -> str:
+    """
+    Возвращает ссылку на отправленный комментарий
+
+    Args:
+        comment_record: Запись комментария из БД
+
+    Returns:
+        str: Ссылка вида https://t.me/c/{chat_id}/{sent_message_id} или None
+    """
+    chat_id_str = get_chat_link_id(comment_record.channel_id)
+    if not chat_id_str or not comment_record.sent_message_id:
+        return None
+    return f"https://t.me/c/{chat_id_str}/{comment_record.sent_message_id}"
+
+
+async def publish_comment(comment_record) -> bool:
+    """
+    Публикует комментарий и обновляет его статус в БД
+
+    Перед отправкой запись атомарно переводится из PENDING в PUBLISHING: если ее уже взяла
+    другая публикация (кнопка превью, другая команда /approve_*, другой процесс), она пропускается.
+
+    Args:
+        comment_record: Запись комментария со статусом PENDING
+
+    Returns:
+        bool: True если комментарий отправлен успешно; False и при пропуске уже взятой записи
+    """
+    if not _send_comment_func:
+        raise RuntimeError("Функция отправки комментариев не инициализирована")
+
+    claimed = await Comment.filter(id=comment_record.id, status=CommentStatus.PENDING).update(
+        status=CommentStatus.PUBLISHING
+    )
+    if not claimed:
+        logger.info(f"Комментарий {comment_record.id} уже публикуется или опубликован, пропускаем")
+        return False
+
+    _in_flight.add(comment_record.id)
+    _idle.clear()
+    try:
+        await wait_for_flood()
+        try:
+            success = await _send_comment_func(comment_record)
+        except Exception:
+            # Отправка не состоялась: возвращаем запись на подтверждение
+            await Comment.filter(id=comment_record.id).update(status=CommentStatus.PENDING)
+            raise
+
+        if success:
+            comment_record.status = CommentStatus.SENT
+            comment_record.sent_at = datetime.now(timezone.utc)
+            if comment_record.post_date:
+                comment_record.publish_latency = (
+                    comment_record.sent_at - _as_utc(comment_record.post_date)
+                ).total_seconds()
+                logger.info(f"⏱️  Комментарий {comment_record.id} опубликован через "
+                            f"{comment_record.publish_latency:.1f} с после поста")
+        else:
+            comment_record.status = CommentStatus.FAILED
+        await comment_record.save()
+        return success
+    finally:
+        _in_flight.discard(comment_record.id)
+        if not _in_flight:
+            _idle.set()
+
+
+async def release_interrupted_publishing() -> int:
+    """
+    Возвращает на подтверждение комментарии, публикация которых прервалась остановкой процесса
+
+    Публикует только основной процесс (с Telethon клиентом), поэтому при его запуске
+    записи в статусе PUBLISHING не публикуются никем.
+
+    Returns:
+        int: Количество возвращенных записей
+    """
+    released = await Comment.filter(status=CommentStatus.PUBLISHING).update(status=CommentStatus.PENDING)
+    if released:
+        logger.warning(f"Возвращены на подтверждение прерванные публикации: {released}")
+    return released
+
+
+async def wait_publishing(timeout: float) -> bool:
+    """
+    Ждет завершения публикуемых сейчас комментариев
+
+    Args:
+        timeout: Сколько секунд ждать
+
+    Returns:
+        bool: True если все публикации завершились
+    """
+    if _in_flight:
+        logger.info(f"⏳ Ожидание публикации комментариев: {len(_in_flight)}")
+    try:
+        await asyncio.wait_for(_idle.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        logger.warning(f"Не дождались публикации комментариев: {len(_in_flight)}")
+        return False
+
+
+async def publish_batch(comment_records: list, progress_callback=None) -> dict:
+    """
+    Публикует пачку комментариев с ограничением параллельности
+
+    Args:
+        comment_records: Записи комментариев со статусом PENDING
+        progress_callback: Корутина, которая получает словарь счетчиков после каждой отправки
+
+    Returns:
+        dict: Счетчики {"total", "done", "sent", "failed"}
+    """
+    semaphore = asyncio.Semaphore(BULK_PUBLISH_CONCURRENCY)
+    counters = {"total": len(comment_records), "done": 0, "sent": 0, "failed": 0}
+
+    async def publish_one(comment_record):
+        async with semaphore:
+            try:
+                success = await publish_comment(comment_record)
+            except Exception as e:
+                logger.error(f"Ошибка при публикации комментария {comment_record.id}: {e}")
+                success = False
+
+        counters["done"] += 1
+        counters["sent" if success else "failed"] += 1
+        if progress_callback:
+            try:
+                await progress_callback(counters)
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении прогресса публикации: {e}")
+
+    await asyncio.gather(*(publish_one(comment_record) for comment_record in comment_records))
+    logger.info(f"📤 Пакетная публикация завершена: отправлено {counters['sent']}, ошибок {counters['failed']}")
+    return counters
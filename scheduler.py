@@ -0,0 +1,160 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+from config import GENERATION_CONCURRENCY, COMMENT_DEADLINE
+
+logger = logging.getLogger(__name__)
+
+# Уровни деградации при перегрузке
+LEVEL_NORMAL = 0
+# Генерация только по тексту, без фото
+LEVEL_NO_IMAGES = 1
+# Плюс более дешевая и быстрая модель
+LEVEL_CHEAP_MODEL = 2
+# Плюс посты каналов с приоритетом ниже 1 отбрасываются
+LEVEL_SKIP_LOW_PRIORITY = 3
+
+# Уровень по числу ожидающих генерации постов на один слот: [(порог, уровень)]
+LOAD_LEVELS = [(4, LEVEL_SKIP_LOW_PRIORITY), (2, LEVEL_CHEAP_MODEL), (1, LEVEL_NO_IMAGES)]
+# Если до дедлайна осталось меньше SLACK_FACTOR средних генераций, генерируем быстрее
+SLACK_FACTOR = 2
+# Вес нового замера в скользящем среднем времени генерации
+LATENCY_SMOOTHING = 0.2
+
+
+class PostExpired(Exception):
+    """Пост отброшен: дедлайн комментария прошел или он отброшен из-за перегрузки"""
+
+
+class GenerationScheduler:
+    """
+    Планировщик генерации: ограничивает параллельность и выдает слоты по ближайшему дедлайну (EDF)
+
+    Дедлайн поста - дата публикации плюс допустимая задержка канала. Для порядка очереди
+    задержка делится на приоритет канала, поэтому посты важных каналов обслуживаются раньше.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._active = 0
+        # Куча ожидающих: (ключ порядка, номер, запись)
+        self._heap = []
+        self._sequence = itertools.count()
+        # Скользящее среднее времени генерации, секунды
+        self.average_latency = 0.0
+        # Отброшенные посты: {(канал, причина): количество}
+        self.shed = Counter()
+        # Выданные слоты по уровням деградации
+        self.levels = Counter()
+
+    def _shed(self, entry: dict, reason: str):
+        self.shed[(entry["channel_name"], reason)] += 1
+        logger.warning(f"   🗑️  Пост канала '{entry['channel_name']}' отброшен: {reason}")
+
+    def _level(self, entry: dict) -> int:
+        """Уровень деградации для записи, получающей слот"""
+        load = len(self._heap) / self.concurrency
+        level = next((level for threshold, level in LOAD_LEVELS if load >= threshold), LEVEL_NORMAL)
+        slack = entry["deadline"] - time.time()
+        if self.average_latency and slack < self.average_latency * SLACK_FACTOR:
+            level = max(level, LEVEL_CHEAP_MODEL)
+        return level
+
+    def _grant(self, entry: dict) -> bool:
+        """Выдает слот записи или отбрасывает ее; возвращает True, если слот выдан"""
+        if time.time() > entry["deadline"]:
+            self._shed(entry, "дедлайн прошел")
+            entry["future"].set_exception(PostExpired("дедлайн прошел"))
+            return False
+
+        level = self._level(entry)
+        if level >= LEVEL_SKIP_LOW_PRIORITY and entry["priority"] < 1:
+            self._shed(entry, "перегрузка, низкий приоритет")
+            entry["future"].set_exception(PostExpired("перегрузка, низкий приоритет"))
+            return False
+
+        self._active += 1
+        self.levels[level] += 1
+        entry["future"].set_result(level)
+        return True
+
+    def _dispatch(self):
+        while self._active < self.concurrency and self._heap:
+            _, _, entry = heapq.heappop(self._heap)
+            if entry["future"].done():
+                # Ожидание было отменено
+                continue
+            self._grant(entry)
+
+    async def acquire(self, channel_name: str, channel_info: dict, post_date: datetime = None) -> int:
+        """
+        Ждет слот генерации в порядке дедлайнов
+
+        Args:
+            channel_name: Название канала
+            channel_info: Конфигурация канала (необязательные "priority" и "deadline")
+            post_date: Дата публикации поста
+
+        Returns:
+            int: Уровень деградации для этой генерации
+
+        Raises:
+            PostExpired: Пост отброшен
+        """
+        priority = channel_info.get("priority", 1)
+        allowed_delay = channel_info.get("deadline", COMMENT_DEADLINE)
+        published = post_date.timestamp() if post_date else time.time()
+        entry = {
+            "channel_name": channel_name,
+            "priority": priority,
+            "deadline": published + allowed_delay,
+            "future": asyncio.get_running_loop().create_future(),
+        }
+        order_key = published + allowed_delay / max(priority, 0.01)
+        heapq.heappush(self._heap, (order_key, next(self._sequence), entry))
+        self._dispatch()
+
+        try:
+            return await entry["future"]
+        except asyncio.CancelledError:
+            # Если слот уже был выдан, возвращаем его
+            if entry["future"].done() and not entry["future"].cancelled() and entry["future"].exception() is None:
+                self.release()
+            raise
+
+    def release(self, latency: float = None):
+        """
+        Освобождает слот генерации
+
+        Args:
+            latency: Время генерации в секундах (для оценки запаса до дедлайна)
+        """
+        self._active -= 1
+        if latency is not None:
+            if self.average_latency:
+                self.average_latency += LATENCY_SMOOTHING * (latency - self.average_latency)
+            else:
+                self.average_latency = latency
+        self._dispatch()
+
+    def get_stats(self) -> dict:
+        """
+        Возвращает состояние планировщика
+
+        Returns:
+            dict: {"active", "waiting", "average_latency", "levels", "shed"}
+        """
+        return {
+            "active": self._active,
+            "waiting": sum(1 for _, _, entry in self._heap if not entry["future"].done()),
+            "average_latency": round(self.average_latency, 2),
+            "levels": dict(self.levels),
+            "shed": {f"{channel_name}: {reason}": count for (channel_name, reason), count in self.shed.items()},
+        }
+
+
+scheduler = GenerationScheduler(GENERATION_CONCURRENCY)
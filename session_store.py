@@ -0,0 +1,387 @@
+import asyncio
+import datetime
+import logging
+import os
+import sqlite3
+import time
+from telethon.crypto import AuthKey
+from telethon import utils
+from telethon.sessions import MemorySession, SQLiteSession
+from telethon.sessions.memory import _SentFileType
+from telethon.tl import types
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+from config import SESSION_BACKEND, TELETHON_SESSION
+
+logger = logging.getLogger(__name__)
+
+# Запросы к файлу сессии в формате SQLiteSession. Колонки таблицы sessions зависят от версии Telethon
+# (tmp_auth_key появилась в схеме версии 8), поэтому запрос к ней строится по колонкам файла
+SESSION_COLUMNS = ("dc_id", "server_address", "port", "auth_key", "takeout_id")
+SQLITE_ENTITY_SQL = "insert or replace into entities values (?,?,?,?,?,?)"
+SQLITE_FILE_SQL = "insert or replace into sent_files values (?,?,?,?,?)"
+SQLITE_STATE_SQL = "insert or replace into update_state values (?,?,?,?,?)"
+
+PG_SESSION_SQL = """
+INSERT INTO telethon_sessions (name, dc_id, server_address, port, auth_key, takeout_id, updated_at)
+VALUES ($1, $2, $3, $4, $5, $6, NOW())
+ON CONFLICT (name) DO UPDATE SET dc_id = EXCLUDED.dc_id, server_address = EXCLUDED.server_address,
+    port = EXCLUDED.port, auth_key = EXCLUDED.auth_key, takeout_id = EXCLUDED.takeout_id, updated_at = NOW()
+"""
+PG_ENTITY_SQL = """
+INSERT INTO telethon_entities (session_name, entity_id, hash, username, phone, name, date)
+VALUES ($1, $2, $3, $4, $5, $6, $7)
+ON CONFLICT (session_name, entity_id) DO UPDATE SET hash = EXCLUDED.hash, username = EXCLUDED.username,
+    phone = EXCLUDED.phone, name = EXCLUDED.name, date = EXCLUDED.date
+"""
+PG_FILE_SQL = """
+INSERT INTO telethon_sent_files (session_name, md5_digest, file_size, type, file_id, hash)
+VALUES ($1, $2, $3, $4, $5, $6)
+ON CONFLICT (session_name, md5_digest, file_size, type) DO UPDATE SET file_id = EXCLUDED.file_id, hash = EXCLUDED.hash
+"""
+PG_STATE_SQL = """
+INSERT INTO telethon_update_state (session_name, entity_id, pts, qts, date, seq)
+VALUES ($1, $2, $3, $4, $5, $6)
+ON CONFLICT (session_name, entity_id) DO UPDATE SET pts = EXCLUDED.pts, qts = EXCLUDED.qts,
+    date = EXCLUDED.date, seq = EXCLUDED.seq
+"""
+PG_SESSION_TABLES = ("telethon_entities", "telethon_sent_files", "telethon_update_state")
+
+
+def _empty_changes() -> dict:
+    """
+    Пачка данных сессии для записи или загруженный снимок
+
+    session - (dc_id, server_address, port, auth_key, takeout_id) или None,
+    entities - {id: (id, hash, username, phone, name, date)}, files - {(md5, size, type): (id, hash)},
+    states - {id: (pts, qts, date, seq)}
+    """
+    return {"session": None, "entities": {}, "files": {}, "states": {}}
+
+
+class SQLiteBackend:
+    """Файл сессии в формате Telethon SQLiteSession; чтение и запись выполняются в отдельном потоке"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.filename = name if name.endswith(".session") else f"{name}.session"
+        self._conn = None
+        # Колонки таблицы sessions в файле, которые не заполняются из сессии (например, tmp_auth_key)
+        self._extra_columns = ()
+
+    def _connect(self):
+        if self._conn is None:
+            # SQLiteSession создает таблицы или обновляет схему старого файла до текущей версии
+            SQLiteSession(self.filename).close()
+            self._conn = sqlite3.connect(self.filename, check_same_thread=False)
+            columns = [row[1] for row in self._conn.execute("pragma table_info(sessions)")]
+            self._extra_columns = tuple(column for column in columns if column not in SESSION_COLUMNS)
+        return self._conn
+
+    def _load(self) -> dict:
+        conn = self._connect()
+        snapshot = _empty_changes()
+        row = conn.execute("select dc_id, server_address, port, auth_key, takeout_id from sessions").fetchone()
+        if row:
+            snapshot["session"] = row
+        for entity_id, entity_hash, username, phone, name, date in conn.execute(
+                "select id, hash, username, phone, name, date from entities"):
+            snapshot["entities"][entity_id] = (entity_id, entity_hash, username, phone, name, date)
+        for md5_digest, file_size, file_type, file_id, file_hash in conn.execute(
+                "select md5_digest, file_size, type, id, hash from sent_files"):
+            snapshot["files"][(md5_digest, file_size, file_type)] = (file_id, file_hash)
+        for entity_id, pts, qts, date, seq in conn.execute("select id, pts, qts, date, seq from update_state"):
+            snapshot["states"][entity_id] = (pts, qts, date, seq)
+        return snapshot
+
+    def _write(self, changes: dict):
+        conn = self._connect()
+        with conn:
+            if changes["session"] is not None:
+                # Значения остальных колонок (временный ключ Telethon) сохраняются
+                extra_values = ()
+                if self._extra_columns:
+                    extra_values = conn.execute(
+                        f"select {', '.join(self._extra_columns)} from sessions"
+                    ).fetchone() or (None,) * len(self._extra_columns)
+                columns = SESSION_COLUMNS + self._extra_columns
+                conn.execute("delete from sessions")
+                conn.execute(
+                    f"insert into sessions ({', '.join(columns)}) values ({', '.join('?' * len(columns))})",
+                    changes["session"] + tuple(extra_values)
+                )
+            conn.executemany(SQLITE_ENTITY_SQL, changes["entities"].values())
+            conn.executemany(SQLITE_FILE_SQL, [key + value for key, value in changes["files"].items()])
+            conn.executemany(SQLITE_STATE_SQL, [(key,) + value for key, value in changes["states"].items()])
+
+    async def load(self) -> dict:
+        return await asyncio.to_thread(self._load)
+
+    async def write(self, changes: dict):
+        await asyncio.to_thread(self._write, changes)
+
+    async def close(self):
+        if self._conn is not None:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+    async def delete(self):
+        await self.close()
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
+class PostgresBackend:
+    """Сессия в PostgreSQL через соединение Tortoise: одна сессия доступна с любого хоста"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    async def load(self) -> dict:
+        connection = Tortoise.get_connection("default")
+        snapshot = _empty_changes()
+        rows = await connection.execute_query_dict(
+            "SELECT dc_id, server_address, port, auth_key, takeout_id FROM telethon_sessions WHERE name = $1", [self.name]
+        )
+        if not rows:
+            return await self._import_file()
+
+        row = rows[0]
+        snapshot["session"] = (row["dc_id"], row["server_address"], row["port"], row["auth_key"], row["takeout_id"])
+        for row in await connection.execute_query_dict(
+                "SELECT entity_id, hash, username, phone, name, date FROM telethon_entities WHERE session_name = $1",
+                [self.name]):
+            snapshot["entities"][row["entity_id"]] = (
+                row["entity_id"], row["hash"], row["username"], row["phone"], row["name"], row["date"]
+            )
+        for row in await connection.execute_query_dict(
+                "SELECT md5_digest, file_size, type, file_id, hash FROM telethon_sent_files WHERE session_name = $1",
+                [self.name]):
+            snapshot["files"][(bytes(row["md5_digest"]), row["file_size"], row["type"])] = (row["file_id"], row["hash"])
+        for row in await connection.execute_query_dict(
+                "SELECT entity_id, pts, qts, date, seq FROM telethon_update_state WHERE session_name = $1",
+                [self.name]):
+            snapshot["states"][row["entity_id"]] = (row["pts"], row["qts"], row["date"], row["seq"])
+        return snapshot
+
+    async def _import_file(self) -> dict:
+        """Переносит в базу файл сессии, если он есть (переход с SESSION_BACKEND=sqlite/memory)"""
+        file_backend = SQLiteBackend(self.name)
+        if not os.path.exists(file_backend.filename):
+            return _empty_changes()
+
+        snapshot = await file_backend.load()
+        await file_backend.close()
+        if snapshot["session"] is not None:
+            await self.write(snapshot)
+            logger.info(f"🔑 Сессия Telethon перенесена из {file_backend.filename} в базу данных "
+                        f"({len(snapshot['entities'])} сущностей)")
+        return snapshot
+
+    async def write(self, changes: dict):
+        async with in_transaction() as conn:
+            if changes["session"] is not None:
+                await conn.execute_query(PG_SESSION_SQL, [self.name, *changes["session"]])
+            if changes["entities"]:
+                await conn.execute_many(PG_ENTITY_SQL, [
+                    [self.name, entity_id, entity_hash, username, str(phone) if phone is not None else None, name, date]
+                    for entity_id, entity_hash, username, phone, name, date in changes["entities"].values()
+                ])
+            if changes["files"]:
+                await conn.execute_many(PG_FILE_SQL, [
+                    [self.name, *key, *value] for key, value in changes["files"].items()
+                ])
+            if changes["states"]:
+                await conn.execute_many(PG_STATE_SQL, [
+                    [self.name, entity_id, *state] for entity_id, state in changes["states"].items()
+                ])
+
+    async def close(self):
+        pass
+
+    async def delete(self):
+        async with in_transaction() as conn:
+            for table in PG_SESSION_TABLES:
+                await conn.execute_query(f"DELETE FROM {table} WHERE session_name = $1", [self.name])
+            await conn.execute_query("DELETE FROM telethon_sessions WHERE name = $1", [self.name])
+
+
+class BufferedSession(MemorySession):
+    """
+    Сессия Telethon в памяти с записью изменений в хранилище пачками
+
+    Telethon меняет сессию синхронно (сущности из каждого обновления, состояние обновлений),
+    а сохраняет ее через save() - при подключении, смене ключа и раз в минуту. Здесь изменения
+    только отмечаются в памяти, а save() записывает накопленное одной пачкой, не блокируя цикл событий.
+    Неизменившиеся сущности повторно не записываются.
+    """
+
+    def __init__(self, backend):
+        super().__init__()
+        self.backend = backend
+        self.save_entities = True
+        # {id: (id, hash, username, phone, name)} и индексы для поиска
+        self._entities = {}
+        self._usernames = {}
+        self._phones = {}
+        self._names = {}
+        self._dirty = _empty_changes()
+        self._session_dirty = False
+        self._flush_lock = asyncio.Lock()
+
+    def _apply(self, snapshot: dict):
+        """Заполняет сессию загруженным из хранилища снимком"""
+        if snapshot["session"] is not None:
+            self._dc_id, self._server_address, self._port, key, self._takeout_id = snapshot["session"]
+            self._auth_key = AuthKey(data=bytes(key)) if key else None
+        for entity_id, entity_hash, username, phone, name, _ in snapshot["entities"].values():
+            self._store_entity((entity_id, entity_hash, username, phone, name))
+        for (md5_digest, file_size, file_type), value in snapshot["files"].items():
+            self._files[(md5_digest, file_size, _SentFileType(file_type))] = value
+        for entity_id, (pts, qts, date, seq) in snapshot["states"].items():
+            self._update_states[entity_id] = types.updates.State(
+                pts, qts, datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc), seq, unread_count=0
+            )
+
+    def _store_entity(self, row: tuple) -> bool:
+        """Сохраняет сущность в памяти; возвращает True, если она новая или изменилась"""
+        entity_id, _, username, phone, name = row
+        if phone is not None:
+            # В файле сессии телефон хранится числом, Telethon ищет его строкой
+            row = (entity_id, row[1], username, str(phone), name)
+        if self._entities.get(entity_id) == row:
+            return False
+        self._entities[entity_id] = row
+        if username:
+            self._usernames[username] = entity_id
+        if phone is not None:
+            self._phones[str(phone)] = entity_id
+        if name:
+            self._names[name] = entity_id
+        return True
+
+    def _mark_session_dirty(self):
+        self._session_dirty = True
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._mark_session_dirty()
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._mark_session_dirty()
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._mark_session_dirty()
+
+    def set_update_state(self, entity_id, state):
+        super().set_update_state(entity_id, state)
+        self._dirty["states"][entity_id] = (state.pts, state.qts, int(state.date.timestamp()), state.seq)
+
+    def process_entities(self, tlo):
+        if not self.save_entities:
+            return
+        now = int(time.time())
+        for row in self._entities_to_rows(tlo):
+            if self._store_entity(row):
+                self._dirty["entities"][row[0]] = self._entities[row[0]] + (now,)
+
+    def get_entity_rows_by_phone(self, phone):
+        return self._entity_hash(self._phones.get(str(phone)))
+
+    def get_entity_rows_by_username(self, username):
+        entity_id = self._usernames.get(username)
+        # Username мог перейти к другой сущности: действует только последняя запись
+        if entity_id is not None and self._entities[entity_id][2] != username:
+            return None
+        return self._entity_hash(entity_id)
+
+    def get_entity_rows_by_name(self, name):
+        return self._entity_hash(self._names.get(name))
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            return self._entity_hash(id)
+        for peer in (types.PeerUser(id), types.PeerChat(id), types.PeerChannel(id)):
+            row = self._entity_hash(utils.get_peer_id(peer))
+            if row:
+                return row
+        return None
+
+    def _entity_hash(self, entity_id):
+        row = self._entities.get(entity_id) if entity_id is not None else None
+        return (row[0], row[1]) if row else None
+
+    def cache_file(self, md5_digest, file_size, instance):
+        super().cache_file(md5_digest, file_size, instance)
+        key = (md5_digest, file_size, _SentFileType.from_type(type(instance)).value)
+        self._dirty["files"][key] = (instance.id, instance.access_hash)
+
+    def clone(self, to_instance=None):
+        # Временные сессии для CDN не сохраняются
+        return super().clone(to_instance or MemorySession())
+
+    def _take_changes(self) -> dict:
+        """Забирает накопленные изменения; новые копятся в свежем буфере"""
+        changes, self._dirty = self._dirty, _empty_changes()
+        if self._session_dirty:
+            changes["session"] = (
+                self._dc_id, self._server_address, self._port,
+                self._auth_key.key if self._auth_key else b"", self._takeout_id
+            )
+            self._session_dirty = False
+        return changes
+
+    def _restore_changes(self, changes: dict):
+        """Возвращает незаписанные изменения в буфер, не затирая более новые"""
+        if changes["session"] is not None:
+            self._session_dirty = True
+        for key in ("entities", "files", "states"):
+            for item_key, value in changes[key].items():
+                self._dirty[key].setdefault(item_key, value)
+
+    async def save(self):
+        async with self._flush_lock:
+            changes = self._take_changes()
+            if changes["session"] is None and not any(changes[key] for key in ("entities", "files", "states")):
+                return
+            try:
+                await self.backend.write(changes)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении сессии Telethon: {e}")
+                self._restore_changes(changes)
+
+    async def close(self):
+        await self.save()
+        await self.backend.close()
+
+    async def delete(self):
+        self._dirty = _empty_changes()
+        self._session_dirty = False
+        await self.backend.delete()
+
+
+async def open_session(name: str = TELETHON_SESSION):
+    """
+    Открывает сессию Telethon в хранилище SESSION_BACKEND
+
+    Args:
+        name: Название сессии (для файла - имя без расширения .session)
+
+    Returns:
+        Session | str: Загруженная сессия; для SESSION_BACKEND=sqlite - имя файла
+            (Telethon сам использует SQLiteSession с синхронной записью)
+    """
+    if SESSION_BACKEND == "sqlite":
+        return name
+
+    backend = PostgresBackend(name) if SESSION_BACKEND == "postgres" else SQLiteBackend(name)
+    session = BufferedSession(backend)
+    session._apply(await backend.load())
+    logger.info(f"🔑 Сессия Telethon '{name}' загружена ({SESSION_BACKEND}): {len(session._entities)} сущностей")
+    return session
@@ -0,0 +1,186 @@
+import bisect
+import html
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+from models import Comment
+from channels_config import CHANNELS
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы интервалов гистограммы длительностей (секунды); последний интервал - все, что дольше
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 1.5, 2, 3, 4, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120, 300]
+# Этапы обработки: {название этапа в гистограмме: поле Comment}
+STAGES = {
+    "generation": "generation_latency",
+    "download": "download_duration",
+    "preview": "preview_duration",
+}
+# Процентили в отчете /stats
+PERCENTILES = (50, 90, 99)
+
+# Суммы за день увеличиваются на значения нового комментария, таблица comments не сканируется
+ROLLUP_SQL = """
+INSERT INTO comment_stats (channel_id, day, comments, duplicates, input_tokens, output_tokens, cached_tokens,
+                           image_tokens, cost)
+VALUES ($1, $2, 1, $3, $4, $5, $6, $7, $8)
+ON CONFLICT (channel_id, day) DO UPDATE SET
+    comments = comment_stats.comments + 1,
+    duplicates = comment_stats.duplicates + EXCLUDED.duplicates,
+    input_tokens = comment_stats.input_tokens + EXCLUDED.input_tokens,
+    output_tokens = comment_stats.output_tokens + EXCLUDED.output_tokens,
+    cached_tokens = comment_stats.cached_tokens + EXCLUDED.cached_tokens,
+    image_tokens = comment_stats.image_tokens + EXCLUDED.image_tokens,
+    cost = comment_stats.cost + EXCLUDED.cost
+"""
+
+HISTOGRAM_SQL = """
+INSERT INTO comment_latency_histogram (channel_id, day, stage, bucket, count)
+VALUES ($1, $2, $3, $4, 1)
+ON CONFLICT (channel_id, day, stage, bucket) DO UPDATE SET count = comment_latency_histogram.count + 1
+"""
+
+SELECT_ROLLUPS_SQL = """
+SELECT channel_id, SUM(comments)::bigint AS comments, SUM(duplicates)::bigint AS duplicates,
+       SUM(input_tokens)::bigint AS input_tokens, SUM(output_tokens)::bigint AS output_tokens,
+       SUM(cached_tokens)::bigint AS cached_tokens, SUM(image_tokens)::bigint AS image_tokens, SUM(cost) AS cost
+FROM comment_stats
+WHERE day >= $1
+GROUP BY channel_id
+"""
+
+SELECT_HISTOGRAMS_SQL = """
+SELECT channel_id, stage, bucket, SUM(count)::bigint AS count
+FROM comment_latency_histogram
+WHERE day >= $1
+GROUP BY channel_id, stage, bucket
+"""
+
+
+def latency_bucket(seconds: float) -> int:
+    """Номер интервала гистограммы для длительности"""
+    return bisect.bisect_left(LATENCY_BUCKETS, seconds)
+
+
+def histogram_percentile(counts: dict, percentile: float) -> float:
+    """
+    Оценивает процентиль по гистограмме: верхняя граница интервала, в который он попадает
+
+    Args:
+        counts: {номер интервала: количество замеров}
+        percentile: Процентиль (0-100)
+
+    Returns:
+        float: Длительность в секундах (float("inf") для последнего интервала) или None, если замеров нет
+    """
+    total = sum(counts.values())
+    if not total:
+        return None
+    rank = total * percentile / 100
+    seen = 0
+    for bucket in sorted(counts):
+        seen += counts[bucket]
+        if seen >= rank:
+            return LATENCY_BUCKETS[bucket] if bucket < len(LATENCY_BUCKETS) else float("inf")
+    return float("inf")
+
+
+async def record_comment(comment_record: Comment):
+    """
+    Добавляет метаданные комментария в дневные суммы и гистограммы канала
+
+    Args:
+        comment_record: Запись комментария с заполненными метаданными генерации
+    """
+    created_at = comment_record.created_at or datetime.now(timezone.utc)
+    day = created_at.astimezone(timezone.utc).date()
+    channel_id = comment_record.channel_id
+    histogram_rows = [
+        [channel_id, day, stage, latency_bucket(getattr(comment_record, field))]
+        for stage, field in STAGES.items()
+        if getattr(comment_record, field) is not None
+    ]
+    try:
+        async with in_transaction() as conn:
+            await conn.execute_query(ROLLUP_SQL, [
+                channel_id, day, 1 if comment_record.duplicate_of else 0,
+                comment_record.input_tokens or 0, comment_record.output_tokens or 0,
+                comment_record.cached_tokens or 0, comment_record.image_tokens or 0, comment_record.cost or 0.0,
+            ])
+            if histogram_rows:
+                await conn.execute_many(HISTOGRAM_SQL, histogram_rows)
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении статистики комментария {comment_record.id}: {e}")
+
+
+async def get_channel_stats(days: int) -> dict:
+    """
+    Собирает статистику по каналам за последние дни из дневных сумм
+
+    Args:
+        days: За сколько дней (включая сегодняшний)
+
+    Returns:
+        dict: {channel_id: {"comments", "duplicates", "input_tokens", "output_tokens", "cached_tokens",
+            "image_tokens", "cost", "percentiles": {этап: {процентиль: секунды}}}}
+    """
+    since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    conn = Tortoise.get_connection("default")
+    stats = {}
+    for row in await conn.execute_query_dict(SELECT_ROLLUPS_SQL, [since]):
+        stats[row["channel_id"]] = {key: value for key, value in row.items() if key != "channel_id"}
+
+    histograms = defaultdict(lambda: defaultdict(dict))
+    for row in await conn.execute_query_dict(SELECT_HISTOGRAMS_SQL, [since]):
+        histograms[row["channel_id"]][row["stage"]][row["bucket"]] = row["count"]
+
+    for channel_id, channel_stats in stats.items():
+        channel_stats["percentiles"] = {
+            stage: {percentile: histogram_percentile(counts, percentile) for percentile in PERCENTILES}
+            for stage, counts in histograms[channel_id].items()
+        }
+    return stats
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return f">{LATENCY_BUCKETS[-1]:g}"
+    return f"{seconds:g}"
+
+
+async def format_stats(days: int) -> str:
+    """
+    Формирует отчет /stats: комментарии, токены, стоимость и процентили длительностей по каналам
+
+    Args:
+        days: За сколько дней
+
+    Returns:
+        str: Текст отчета (HTML)
+    """
+    stats = await get_channel_stats(days)
+    if not stats:
+        return f"📊 За {days} дн. комментариев нет"
+
+    channel_names = {info["channel_id"]: name for name, info in CHANNELS.items()}
+    total_cost = sum(channel_stats["cost"] or 0 for channel_stats in stats.values())
+    text = f"📊 <b>Статистика за {days} дн.</b> Стоимость: ${total_cost:.4f}\n"
+    for channel_id, channel_stats in sorted(stats.items(), key=lambda item: -(item[1]["cost"] or 0)):
+        name = html.escape(channel_names.get(channel_id, str(channel_id)))
+        comments = channel_stats["comments"]
+        cost = channel_stats["cost"] or 0
+        text += f"\n<b>{name}</b>: {comments} комм. (повторно: {channel_stats['duplicates']}), "
+        text += f"${cost:.4f} (${cost / comments:.5f} за комм.)\n" if comments else f"${cost:.4f}\n"
+        input_tokens = channel_stats["input_tokens"]
+        image_tokens = channel_stats["image_tokens"]
+        text += f"Токены: {input_tokens} вход (из кэша {channel_stats['cached_tokens']}, фото {image_tokens}"
+        text += f" - {image_tokens / input_tokens:.0%}), " if input_tokens else "), "
+        text += f"{channel_stats['output_tokens']} выход\n"
+        for stage, percentiles in channel_stats["percentiles"].items():
+            values = " / ".join(_format_seconds(percentiles[percentile]) for percentile in PERCENTILES)
+            text += f"{stage} p{'/p'.join(map(str, PERCENTILES))}: ≤{values} с\n"
+    return text
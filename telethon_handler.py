@@ -1,53 +1,348 @@
 import asyncio
 import logging
-import os
-import tempfile
-from pathlib import Path
-from telethon import TelegramClient, events
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from telethon import TelegramClient, events, utils
 from telethon.errors import FloodWaitError
-from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
-from models import Comment, CommentStatus
-from openai_handler import generate_comment, image_to_base64
-from bot import send_comment_preview
+from telethon.tl.types import (
+    MessageMediaPhoto, MessageMediaDocument, PeerUser, PeerChat, PeerChannel,
+    Message, UpdateNewChannelMessage, PhotoSize, PhotoCachedSize, PhotoSizeProgressive
+)
+from pipeline import process_post
+from post_snapshot import PostSnapshot, PostPhoto
+from jobs import enqueue_post
 from channels_config import CHANNELS
+from config import (
+    PIPELINE_MODE, EARLY_MATCH_TIMEOUT, PHOTO_MIN_SIDE,
+    CATCH_UP_LIMIT, CATCH_UP_CONCURRENCY, CATCH_UP_MAX_AGE, CATCH_UP_INTERVAL, COMMENT_DEADLINE
+)
+from publisher import report_flood_wait
+from watermarks import get_watermark, advance_watermark, start_messages, finish_messages
+import media_store
 
 logger = logging.getLogger(__name__)
 
 # Глобальная переменная для хранения клиента
 client = None
 
-# Путь к папке temp
-TEMP_DIR = Path("temp")
+# Посты, генерация для которых начата по сообщению в самом канале:
+# {(channel_id, ID поста в канале): (Future с ID копии поста в чате обсуждения, время регистрации)}.
+# После того как копия найдена, ключи всех сообщений альбома остаются до очистки устаревших
+# (2 * EARLY_MATCH_TIMEOUT), чтобы остальные копии альбома не были приняты за новый пост
+early_posts = {}
+# Посты, копии которых пришли в чат обсуждения раньше, чем сам пост из канала
+# (для них ранний старт не нужен): {(channel_id, ID поста в канале): True}
+discussion_copies = OrderedDict()
+# Сколько таких постов помнить
+DISCUSSION_COPIES_LIMIT = 1000
 
+# Сообщения чатов обсуждения, уже взятые в обработку (живым обработчиком или догрузкой):
+# {(ID чата, ID сообщения): True}
+handled_messages = OrderedDict()
+# Сколько таких сообщений помнить
+HANDLED_MESSAGES_LIMIT = 5000
 
-def ensure_temp_dir():
-    """Создает папку temp если она не существует"""
-    TEMP_DIR.mkdir(exist_ok=True)
-    logger.info(f"Папка temp создана/проверена: {TEMP_DIR.absolute()}")
+# Принимаются ли новые посты (при остановке прием прекращается, а обработка текущих завершается)
+_accepting = True
+# Задачи, которые сейчас обрабатывают посты
+_in_flight_posts = set()
 
+# Догрузка не трогает сообщения моложе CATCH_UP_MIN_AGE секунд:
+# их (и остальные части альбома) доставит живой обработчик
+CATCH_UP_MIN_AGE = 30
 
-def get_temp_file_path(suffix: str = '.jpg') -> str:
-    """Возвращает путь к временному файлу в папке temp"""
-    ensure_temp_dir()
-    return str(TEMP_DIR / f"temp_{os.urandom(8).hex()}{suffix}")
 
-# Словарь для хранения обработчиков событий
-event_handlers = {}
+def pick_photo_size(photo, min_side: int) -> str:
+    """
+    Выбирает наименьший размер фото, у которого обе стороны не меньше min_side
+
+    Args:
+        photo: Фото Telegram
+        min_side: Минимальная длина короткой стороны в пикселях
+
+    Returns:
+        str: Тип размера для download_media(thumb=...) или None (оригинал)
+    """
+    sizes = [size for size in photo.sizes if isinstance(size, (PhotoSize, PhotoCachedSize, PhotoSizeProgressive))]
+    if not sizes:
+        return None
+
+    adequate = [size for size in sizes if min(size.w, size.h) >= min_side]
+    if not adequate:
+        return None
+    return min(adequate, key=lambda size: size.w * size.h).type
+
+
+def needs_full_photo(channel_config: dict, early: bool = False) -> bool:
+    """
+    Нужен ли оригинал фото для превью администратору
+
+    Превью каналов с preview_copy копируется из чата обсуждения, поэтому для них достаточно
+    уменьшенной версии для модели (при раннем старте копировать еще нечего).
+    """
+    return not channel_config.get("preview_copy") or early
+
+
+@contextmanager
+def _track_in_flight():
+    """Учитывает текущую задачу как обрабатывающую пост, чтобы остановка дождалась ее"""
+    task = asyncio.current_task()
+    _in_flight_posts.add(task)
+    try:
+        yield
+    finally:
+        _in_flight_posts.discard(task)
+
+
+def is_accepting() -> bool:
+    """Принимает ли мониторинг новые посты"""
+    return _accepting
+
+
+def stop_intake():
+    """
+    Прекращает прием новых постов
+
+    Непринятые сообщения не отмечаются обработанными, поэтому после перезапуска
+    их подберет догрузка пропущенных постов.
+    """
+    global _accepting
+    _accepting = False
+
+
+async def drain(timeout: float) -> int:
+    """
+    Прекращает прием постов и ждет завершения обработки уже принятых
+
+    Args:
+        timeout: Сколько секунд ждать
+
+    Returns:
+        int: Количество задач, не успевших завершиться (они отменяются)
+    """
+    stop_intake()
+    tasks = {task for task in _in_flight_posts if not task.done()}
+    if not tasks:
+        return 0
+
+    logger.info(f"⏳ Ожидание завершения обработки постов: {len(tasks)}")
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(f"Не дождались обработки постов: {len(pending)}, они будут догружены после перезапуска")
+    return len(pending)
+
+
+async def download_photo(photo: PostPhoto, full_size: bool = True) -> bool:
+    """
+    Скачивает фото поста
+
+    В режиме очереди фото не сохраняется на диск: воркеры получают его в задаче.
+    В локальном режиме фото сохраняется в хранилище медиа (одинаковые фото - один файл).
+    После скачивания ссылка на фото Telegram больше не хранится.
+
+    Args:
+        photo: Фото поста со ссылкой на фото Telegram
+        full_size: Скачать оригинал; иначе - наименьший размер не меньше PHOTO_MIN_SIDE
+
+    Returns:
+        bool: True если фото скачано
+    """
+    thumb = None if full_size else pick_photo_size(photo.media, PHOTO_MIN_SIDE)
+    photo_bytes = await client.download_media(photo.media, file=bytes, thumb=thumb)
+    photo.media = None
+    if not photo_bytes:
+        return False
+    logger.info(f"   📥 Скачано фото ({thumb or 'оригинал'}): {len(photo_bytes) / 1024:.0f} КБ")
+
+    photo.data = photo_bytes
+    if PIPELINE_MODE != "queue":
+        _, photo.path = await media_store.store_bytes(photo_bytes, '.jpg')
+    return True
+
+
+async def download_photos(snapshot: PostSnapshot, full_size: bool = True):
+    """
+    Скачивает фото поста; фото, которые не удалось скачать, убираются из поста
+
+    Args:
+        snapshot: Пост
+        full_size: Скачать оригиналы (см. download_photo)
+    """
+    started = time.monotonic()
+    downloaded = []
+    for photo in snapshot.photos:
+        try:
+            if await download_photo(photo, full_size):
+                downloaded.append(photo)
+            else:
+                logger.warning(f"   ❌ Не удалось скачать фото из сообщения {photo.message_id}")
+        except Exception as e:
+            logger.error(f"   ❌ Ошибка при скачивании фото из сообщения {photo.message_id}: {e}")
+    snapshot.photos = downloaded
+    snapshot.download_duration = time.monotonic() - started
+
+
+def is_audio_video_only(message) -> bool:
+    """Сообщение содержит только аудио или видео без текста"""
+    if not message.media or message.text or not isinstance(message.media, MessageMediaDocument):
+        return False
+    mime_type = getattr(message.media.document, 'mime_type', None) or ''
+    return mime_type.startswith('video/') or mime_type.startswith('audio/')
+
+
+def add_to_snapshot(snapshot: PostSnapshot, message) -> bool:
+    """
+    Добавляет в пост нужные данные сообщения: ID, текст, дату и ссылку на фото
+
+    Args:
+        snapshot: Пост
+        message: Сообщение Telegram (одиночный пост или часть альбома)
+
+    Returns:
+        bool: False, если сообщение пропущено (только аудио/видео без текста)
+    """
+    snapshot.source_ids.append(message.id)
+    if is_audio_video_only(message):
+        return False
+
+    if snapshot.message_id is None:
+        snapshot.message_id = message.id
+        snapshot.date = message.date
+    snapshot.add_text(message.text)
+    if isinstance(message.media, MessageMediaPhoto) and message.media.photo:
+        snapshot.photos.append(PostPhoto(message_id=message.id, media=message.media.photo))
+    return True
+
+
+async def submit_post(snapshot: PostSnapshot, message_id_waiter=None):
+    """
+    Передает отфильтрованный пост на генерацию комментария
+
+    В режиме local пост обрабатывается в текущем процессе,
+    в режиме queue - ставится в очередь для процессов worker.py.
+
+    Args:
+        snapshot: Пост
+        message_id_waiter: Задача, возвращающая ID сообщения в чате обсуждения (при раннем старте)
+    """
+    if PIPELINE_MODE == "queue":
+        await enqueue_post(snapshot)
+        return
+
+    await process_post(snapshot, message_id_waiter)
+
+
+def is_early_start(channel_config: dict) -> bool:
+    """Включен ли для канала ранний старт генерации по посту в самом канале"""
+    return bool(channel_config.get("early_start")) and PIPELINE_MODE != "queue"
+
+
+def get_channel_post_id(message) -> int:
+    """Возвращает ID исходного поста в канале для автоматической копии в чате обсуждения"""
+    fwd = message.fwd_from
+    if not fwd:
+        return None
+    return fwd.saved_from_msg_id or fwd.channel_post
+
+
+def expect_discussion_copy(channel_id: int, post_id: int):
+    """Регистрирует ожидание копии поста в чате обсуждения"""
+    loop = asyncio.get_running_loop()
+    # Забываем посты, которые были отфильтрованы и так и не дождались обработки
+    for stale_key, (_, registered_at) in list(early_posts.items()):
+        if loop.time() - registered_at > EARLY_MATCH_TIMEOUT * 2:
+            del early_posts[stale_key]
+
+    key = (channel_id, post_id)
+    if key not in early_posts:
+        early_posts[key] = (loop.create_future(), loop.time())
 
-# Словарь для группировки сообщений (альбомов)
-message_groups = {}  # {group_id: [messages]}
+
+def resolve_discussion_copy(channel_id: int, message) -> bool:
+    """
+    Сопоставляет копию поста в чате обсуждения с ранней обработкой
+
+    Args:
+        channel_id: ID канала
+        message: Сообщение в чате обсуждения
+
+    Returns:
+        bool: True если пост уже обрабатывается по раннему старту
+    """
+    post_id = get_channel_post_id(message)
+    if post_id is None:
+        return False
+
+    key = (channel_id, post_id)
+    if key not in early_posts:
+        # Копия пришла раньше самого поста: обрабатываем ее как обычно
+        discussion_copies[key] = True
+        while len(discussion_copies) > DISCUSSION_COPIES_LIMIT:
+            discussion_copies.popitem(last=False)
+        return False
+
+    future, _ = early_posts[key]
+    if not future.done():
+        future.set_result(message.id)
+    return True
+
+
+async def wait_discussion_copy(channel_id: int, post_ids: list) -> int:
+    """
+    Ждет первую копию поста (или любого сообщения альбома) в чате обсуждения
+
+    Args:
+        channel_id: ID канала
+        post_ids: ID сообщений поста в канале
+
+    Returns:
+        int: ID сообщения в чате обсуждения
+
+    Raises:
+        asyncio.TimeoutError: Копия не пришла за EARLY_MATCH_TIMEOUT секунд
+    """
+    futures = [early_posts[(channel_id, post_id)][0] for post_id in post_ids if (channel_id, post_id) in early_posts]
+    resolved = False
+    try:
+        if not futures:
+            raise asyncio.TimeoutError()
+        done, _ = await asyncio.wait(futures, timeout=EARLY_MATCH_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            raise asyncio.TimeoutError()
+        resolved = True
+        return min(future.result() for future in done)
+    finally:
+        # Если копия найдена, ключи остаются: по ним узнаются остальные копии альбома.
+        # Иначе (таймаут, пост отброшен) копии, пришедшие позже, обрабатываются как обычно
+        if not resolved:
+            for post_id in post_ids:
+                early_posts.pop((channel_id, post_id), None)
+
+
+# Маршруты сообщений: {ID чата (как event.chat_id): маршрут с каналом и счетчиками}
+routes = {}
+# Количество сообщений из чатов без маршрута
+unrouted_messages = 0
+
+# Собираемые альбомы: сообщения сразу складываются в компактный пост
+message_groups = {}  # {group_id: PostSnapshot}
 # Словарь для отслеживания обработанных групп
 processed_groups = set()  # {group_id}
 
 
-async def process_message_group(group_id, channel_name: str, channel_config: dict):
+async def process_message_group(group_id, channel_name: str, channel_config: dict, early: bool = False):
     """
     Обрабатывает группу сообщений (альбом) как один пост
     
     Args:
-        group_id: ID группы сообщений
+        group_id: Ключ группы сообщений (ID чата, grouped_id)
         channel_name: Название канала
         channel_config: Конфигурация канала
+        early: Группа получена из самого канала (ранний старт)
     """
     if group_id not in message_groups:
         return
@@ -60,116 +355,50 @@ async def process_message_group(group_id, channel_name: str, channel_config: dic
     # Помечаем группу как обрабатываемую
     processed_groups.add(group_id)
     
-    messages = message_groups[group_id]
-    logger.info(f"🖼️  Обрабатываем группу из {len(messages)} сообщений (Group ID: {group_id})")
-    
-    # Собираем все данные из группы, фильтруя аудио/видео
-    all_text = []
-    all_photos = []
-    all_photo_paths = []
-    main_message_id = None
-    valid_messages = []
-    
-    for message in messages:
-        # Проверяем, не является ли сообщение только аудио/видео без текста
-        is_audio_video_only = False
-        if message.media and not message.text:
-            if isinstance(message.media, MessageMediaDocument):
-                if hasattr(message.media.document, 'mime_type'):
-                    mime_type = message.media.document.mime_type
-                    if mime_type.startswith('video/') or mime_type.startswith('audio/'):
-                        is_audio_video_only = True
-        
-        if is_audio_video_only:
-            logger.info(f"   ⏭️  Пропускаем сообщение {message.id} - только аудио/видео без текста")
-            continue
-        
-        valid_messages.append(message)
-        
-        if message.text:
-            all_text.append(message.text)
-        if message.media and isinstance(message.media, MessageMediaPhoto):
-            try:
-                photo_path = await client.download_media(message.media, file=get_temp_file_path('.jpg'))
-                if photo_path:
-                    photo_base64 = image_to_base64(photo_path)
-                    all_photos.append(photo_base64)
-                    all_photo_paths.append(photo_path)
-                    if main_message_id is None:
-                        main_message_id = message.id
-            except Exception as e:
-                logger.error(f"Ошибка при скачивании фото из группы: {e}")
+    snapshot = message_groups[group_id]
+    logger.info(f"🖼️  Обрабатываем группу из {len(snapshot.source_ids)} сообщений (Group ID: {group_id})")
     
-    if not valid_messages:
+    # Сообщения только с аудио/видео в пост не попали
+    if snapshot.message_id is None:
         logger.warning(f"Группа {group_id} не содержит валидных сообщений (только аудио/видео)")
+        del message_groups[group_id]
         return
     
-    if not all_text and not all_photos:
+    await download_photos(snapshot, needs_full_photo(channel_config, early))
+    
+    if not snapshot.text and not snapshot.photos:
         logger.warning(f"Группа {group_id} не содержит текста или фото")
+        del message_groups[group_id]
         return
     
-    # Объединяем весь текст
-    post_text = " ".join(all_text) if all_text else ""
-    
-    # Передаем все фото для AI
-    photos_base64 = all_photos if all_photos else None
+    logger.info(f"   📝 Объединенный текст: {snapshot.text[:100]}...")
+    logger.info(f"   📸 Фото в группе: {len(snapshot.photos)}")
     
-    logger.info(f"   📝 Объединенный текст: {post_text[:100]}...")
-    logger.info(f"   📸 Фото в группе: {len(all_photos)}")
+    # Комментарий пишется к первому сообщению альбома с фото.
+    # При раннем старте ID копии альбома в чате обсуждения станет известен позже
+    message_id_waiter = None
+    if early:
+        snapshot.message_id = None
+        message_id_waiter = asyncio.ensure_future(
+            wait_discussion_copy(channel_config["channel_id"], snapshot.source_ids)
+        )
+    elif snapshot.photos:
+        snapshot.message_id = snapshot.photos[0].message_id
     
-    # Генерируем комментарий
+    # Генерируем комментарий и отправляем превью (или ставим пост в очередь)
     try:
-        # Получаем описание канала
-        channel_description = None
-        for channel_name_check, channel_info in CHANNELS.items():
-            if channel_info["channel_id"] == channel_config["channel_id"]:
-                channel_description = channel_info.get("description")
-                break
-        
-        generated_comment = await generate_comment(post_text, photos_base64, channel_description, channel_name)
-        logger.info(f"   🤖 AI сгенерировал комментарий: {generated_comment[:50]}...")
-    except Exception as e:
-        logger.error(f"   ❌ Ошибка при генерации комментария: {e}")
-        generated_comment = "Интересный пост! 👍"
-    
-    # Находим chat_id для данного канала
-    chat_id = None
-    for channel_name_check, channel_info in CHANNELS.items():
-        if channel_info["channel_id"] == channel_config["channel_id"]:
-            chat_id = channel_info["chat_id"]
-            break
-    
-    if not chat_id:
-        logger.warning(f"Chat ID не найден для канала {channel_config['channel_id']}")
-        return
-    
-    # Сохраняем в базу данных (сохраняем только первое фото для совместимости)
-    comment_record = await Comment.create(
-        channel_id=channel_config["channel_id"],
-        message_id=main_message_id or valid_messages[0].id,
-        generated_comment=generated_comment,
-        post_text=post_text,
-        photo_path=all_photo_paths[0] if all_photo_paths else None,
-        status=CommentStatus.PENDING
-    )
-    
-    logger.info(f"   💾 Создана запись комментария с ID {comment_record.id}, message_id={comment_record.message_id}")
-    
-    # Отправляем превью в бот
-    logger.info(f"   📤 Отправляем уведомление в бот...")
-    await send_comment_preview(
-        channel_name=channel_name,
-        channel_id=channel_config["channel_id"],
-        message_id=main_message_id or valid_messages[0].id,
-        post_text=post_text,
-        comment=generated_comment,
-        comment_record_id=comment_record.id,
-        photo_paths=all_photo_paths  # Передаем все фото
-    )
+        await submit_post(snapshot, message_id_waiter)
+    except Exception:
+        # Альбом не обработан: снимаем отметки, чтобы догрузка пропущенных постов взяла его целиком повторно
+        processed_groups.discard(group_id)
+        if not early:
+            release_messages(group_id[0], snapshot.source_ids)
+            start_messages(channel_config["channel_id"], snapshot.source_ids)
+        raise
+    finally:
+        # Очищаем группу
+        message_groups.pop(group_id, None)
     logger.info(f"   ✅ Обработка группы сообщений завершена")
-    
-    # Очищаем группу
-    del message_groups[group_id]
 
 
 async def send_message_with_retry(event, response, max_retries=10, retry_delay=60):
@@ -216,7 +445,7 @@ async def send_message_with_retry(event, response, max_retries=10, retry_delay=6
     return False
 
 
-async def handle_channel_message(event, channel_name: str, channel_config: dict):
+async def handle_channel_message(event, channel_name: str, channel_config: dict, early: bool = False):
     """
     Обрабатывает новое сообщение из канала
     
@@ -224,20 +453,50 @@ async def handle_channel_message(event, channel_name: str, channel_config: dict)
         event: Событие Telegram
         channel_name: Название канала
         channel_config: Конфигурация канала
+        early: Сообщение получено из самого канала, а не из чата обсуждения (ранний старт)
+
+    Returns:
+        bool: False если обработка не удалась и пост нужно взять повторно
+    """
+    return await handle_post_message(event.message, event.chat_id, channel_name, channel_config, early)
+
+
+async def handle_post_message(message, chat_id: int, channel_name: str, channel_config: dict, early: bool = False):
+    """
+    Обрабатывает сообщение из канала или чата обсуждения (общая часть для событий и догрузки)
+    
+    Args:
+        message: Сообщение Telegram
+        chat_id: ID чата сообщения (в формате event.chat_id)
+        channel_name: Название канала
+        channel_config: Конфигурация канала
+        early: Сообщение получено из самого канала, а не из чата обсуждения (ранний старт)
+
+    Returns:
+        bool: False если обработка не удалась и пост нужно взять повторно
     """
     try:
-        message = event.message
         sender_id = message.sender_id
-        chat_id = event.chat_id
         channel_id = channel_config["channel_id"]
         
         logger.info(f"🔍 Проверяем сообщение: sender_id={sender_id}, chat_id={chat_id}, channel_id={channel_id}")
         
         if sender_id != channel_id:
             logger.info(f"   ⏭️  Пропускаем - сообщение не от целевого канала (sender_id={sender_id}, chat_id={chat_id})")
-            return
+            return True
         logger.info(f"   ✅ Сообщение от канала (sender_id={sender_id}, chat_id={chat_id})")
         
+        if early:
+            # Пост в самом канале: начинаем генерацию, не дожидаясь копии в чате обсуждения
+            if (channel_id, message.id) in discussion_copies:
+                logger.info(f"   ⏭️  Копия поста {message.id} уже обработана в чате обсуждения")
+                return True
+            expect_discussion_copy(channel_id, message.id)
+            logger.info(f"   🚀 Ранний старт генерации по посту {message.id} в канале")
+        elif is_early_start(channel_config) and resolve_discussion_copy(channel_id, message):
+            logger.info(f"   🔗 Копия поста сопоставлена с ранней обработкой (message_id={message.id})")
+            return True
+        
         # Детальное логирование типа сообщения
         logger.info(f"📨 Получено сообщение от канала {channel_name} (ID: {channel_id})")
         logger.info(f"   Message ID: {message.id}")
@@ -248,21 +507,22 @@ async def handle_channel_message(event, channel_name: str, channel_config: dict)
         
         # Проверяем, является ли это частью группы сообщений (альбом)
         if hasattr(message, 'grouped_id') and message.grouped_id:
-            group_id = message.grouped_id
+            # Группы из канала и из чата обсуждения не должны смешиваться
+            group_id = (chat_id, message.grouped_id)
             
             # Проверяем, не обрабатывалась ли уже эта группа
             if group_id in processed_groups:
                 logger.info(f"   ⏭️  Группа {group_id} уже обработана, пропускаем")
-                return
+                return True
             
             logger.info(f"   🖼️  ГРУППА СООБЩЕНИЙ! Group ID: {group_id}")
             
             # Добавляем сообщение в группу
             if group_id not in message_groups:
-                message_groups[group_id] = []
+                message_groups[group_id] = PostSnapshot(channel_name, channel_id, early=early)
             
-            message_groups[group_id].append(message)
-            logger.info(f"   📥 Добавлено в группу. Всего в группе: {len(message_groups[group_id])}")
+            add_to_snapshot(message_groups[group_id], message)
+            logger.info(f"   📥 Добавлено в группу. Всего в группе: {len(message_groups[group_id].source_ids)}")
             
             # Ждем немного, чтобы собрать все сообщения группы
             await asyncio.sleep(3)  # Увеличиваем время ожидания
@@ -270,128 +530,61 @@ async def handle_channel_message(event, channel_name: str, channel_config: dict)
             # Проверяем, все ли сообщения группы собраны
             # Обрабатываем группу только если это последнее сообщение в группе
             # или если прошло достаточно времени
-            if len(message_groups[group_id]) >= 2:  # Ожидаем минимум 2 сообщения для альбома
+            if len(message_groups[group_id].source_ids) >= 2:  # Ожидаем минимум 2 сообщения для альбома
                 logger.info(f"   ✅ Группа собрана, обрабатываем...")
-                await process_message_group(group_id, channel_name, channel_config)
+                await process_message_group(group_id, channel_name, channel_config, early)
             else:
                 logger.info(f"   ⏳ Ждем остальные сообщения группы...")
             
-            return
+            return True
         
         # Обычное сообщение (не группа)
         logger.info(f"   📝 Обычное сообщение (не группа)")
         
-        # Извлекаем текст поста
-        post_text = message.text or ""
-        
         # Проверяем, является ли сообщение только аудио/видео без текста
-        if message.media and not post_text:
-            if isinstance(message.media, MessageMediaDocument):
-                if hasattr(message.media.document, 'mime_type'):
-                    mime_type = message.media.document.mime_type
-                    if mime_type.startswith('video/'):
-                        logger.info(f"   🎥 Пропускаем сообщение - только видео без текста")
-                        return
-                    elif mime_type.startswith('audio/'):
-                        logger.info(f"   🎵 Пропускаем сообщение - только аудио без текста")
-                        return
+        if is_audio_video_only(message):
+            logger.info(f"   🎥 Пропускаем сообщение - только аудио/видео без текста")
+            return True
         
-        # Обрабатываем медиа, если есть
-        photo_path = None
-        photo_base64 = None
+        snapshot = PostSnapshot(channel_name, channel_id, early=early)
+        add_to_snapshot(snapshot, message)
         
-        if message.media:
-            if isinstance(message.media, MessageMediaPhoto):
-                logger.info(f"   📸 Обрабатываем фото...")
-                try:
-                    # Скачиваем фото в папку temp
-                    photo_path = await client.download_media(message.media, file=get_temp_file_path('.jpg'))
-                    if photo_path:
-                        photo_base64 = image_to_base64(photo_path)
-                        logger.info(f"   ✅ Фото скачано и конвертировано в base64")
-                    else:
-                        logger.warning(f"   ❌ Не удалось скачать фото")
-                except Exception as e:
-                    logger.error(f"   ❌ Ошибка при скачивании фото: {e}")
-            elif isinstance(message.media, MessageMediaDocument):
-                # Проверяем, является ли документ видео или аудио
-                if hasattr(message.media.document, 'mime_type'):
-                    mime_type = message.media.document.mime_type
-                    if mime_type.startswith('video/'):
-                        logger.info(f"   🎥 Пропускаем видео (MIME: {mime_type})")
-                    elif mime_type.startswith('audio/'):
-                        logger.info(f"   🎵 Пропускаем аудио (MIME: {mime_type})")
-                    else:
-                        logger.info(f"   📄 Документ (MIME: {mime_type}) - пропускаем")
-                else:
-                    logger.info(f"   📄 Документ без MIME типа - пропускаем")
+        # Обрабатываем медиа, если есть
+        if snapshot.photos:
+            logger.info(f"   📸 Обрабатываем фото...")
+            await download_photos(snapshot, needs_full_photo(channel_config, early))
+            if snapshot.photos:
+                logger.info(f"   ✅ Фото скачано")
+        elif isinstance(message.media, MessageMediaDocument):
+            mime_type = getattr(message.media.document, 'mime_type', None)
+            if mime_type:
+                logger.info(f"   📄 Документ (MIME: {mime_type}) - пропускаем")
             else:
-                logger.info(f"   📎 Другой тип медиа: {type(message.media).__name__} - пропускаем")
+                logger.info(f"   📄 Документ без MIME типа - пропускаем")
+        elif message.media:
+            logger.info(f"   📎 Другой тип медиа: {type(message.media).__name__} - пропускаем")
         else:
             logger.info(f"   📝 Сообщение без медиа")
         
-        # Генерируем комментарий
-        try:
-            # Получаем описание канала
-            channel_description = None
-            for channel_name_check, channel_info in CHANNELS.items():
-                if channel_info["channel_id"] == channel_id:
-                    channel_description = channel_info.get("description")
-                    break
-            
-            # Передаем фото как список (даже если одно)
-            photos_base64 = [photo_base64] if photo_base64 else None
-            generated_comment = await generate_comment(post_text, photos_base64, channel_description, channel_name)
-            logger.info(f"   🤖 AI сгенерировал комментарий: {generated_comment[:50]}...")
-        except Exception as e:
-            logger.error(f"   ❌ Ошибка при генерации комментария: {e}")
-            generated_comment = "Интересный пост! 👍"
+        # При раннем старте ID копии поста в чате обсуждения станет известен позже
+        message_id_waiter = None
+        if early:
+            snapshot.message_id = None
+            message_id_waiter = asyncio.ensure_future(wait_discussion_copy(channel_id, snapshot.source_ids))
         
-        # Находим chat_id для данного канала
-        chat_id = None
-        for channel_name, channel_info in CHANNELS.items():
-            if channel_info["channel_id"] == channel_id:
-                chat_id = channel_info["chat_id"]
-                break
-        
-        if not chat_id:
-            logger.warning(f"Chat ID не найден для канала {channel_id}")
-            return
-        
-        # Сохраняем в базу данных
-        logger.info(f"Сохраняем запись: channel_id={channel_id}, message_id={message.id}")
-        
-        comment_record = await Comment.create(
-            channel_id=channel_id,
-            message_id=message.id,
-            generated_comment=generated_comment,
-            post_text=post_text,
-            photo_path=photo_path,
-            status=CommentStatus.PENDING
-        )
-        
-        logger.info(f"   💾 Создана запись комментария с ID {comment_record.id}, message_id={comment_record.message_id}")
-        
-        # Отправляем превью в бот
-        logger.info(f"   📤 Отправляем уведомление в бот...")
-        await send_comment_preview(
-            channel_name=channel_name,
-            channel_id=channel_id,
-            message_id=message.id,
-            post_text=post_text,
-            comment=generated_comment,
-            comment_record_id=comment_record.id,
-            photo_path=photo_path,
-            photo_paths=[photo_path] if photo_path else None
-        )
+        # Генерируем комментарий и отправляем превью (или ставим пост в очередь)
+        await submit_post(snapshot, message_id_waiter)
         logger.info(f"   ✅ Обработка сообщения завершена")
+        return True
         
     except FloodWaitError as e:
         wait_time = e.seconds
         logger.warning(f"FloodWaitError в обработчике: нужно подождать {wait_time} секунд")
         await asyncio.sleep(wait_time)
+        return False
     except Exception as e:
         logger.error(f"Ошибка при обработке сообщения: {e}")
+        return False
 
 
 
@@ -440,6 +633,8 @@ async def send_comment_to_post(comment_record) -> bool:
         except FloodWaitError as e:
             wait_time = e.seconds
             logger.warning(f"FloodWaitError при отправке комментария: нужно подождать {wait_time} секунд")
+            # Остальные отправки тоже подождут, а не упрутся в тот же лимит
+            report_flood_wait(wait_time)
             await asyncio.sleep(wait_time)
             try:
                 sent_message = await message.reply(comment)
@@ -464,9 +659,366 @@ async def send_comment_to_post(comment_record) -> bool:
         return False
 
 
+def _route_keys(chat_id: int) -> set:
+    """
+    Возвращает ID чата в том виде, в каком его отдает event.chat_id
+
+    Положительный ID из конфигурации может означать пользователя, группу или канал,
+    поэтому (как и фильтр chats в Telethon) учитываем все три варианта.
+    """
+    if chat_id < 0:
+        return {chat_id}
+    return {
+        utils.get_peer_id(PeerUser(chat_id)),
+        utils.get_peer_id(PeerChat(chat_id)),
+        utils.get_peer_id(PeerChannel(chat_id)),
+    }
+
+
+def add_route(chat_id: int, channel_name: str, channel_config: dict, early: bool = False):
+    """
+    Добавляет маршрут для чата; повторная регистрация обработчика Telethon не нужна
+
+    Args:
+        chat_id: ID чата обсуждения (или канала при раннем старте)
+        channel_name: Название канала
+        channel_config: Конфигурация канала
+        early: Маршрут для самого канала (ранний старт)
+    """
+    route = {
+        "channel_name": channel_name,
+        "channel_config": channel_config,
+        "early": early,
+        "messages": 0,
+        "errors": 0,
+        "dropped": 0,
+    }
+    for key in _route_keys(chat_id):
+        routes[key] = route
+
+
+def add_channel(channel_name: str, channel_config: dict):
+    """
+    Начинает отслеживать канал: добавляет маршрут для чата обсуждения
+    и, при раннем старте, для самого канала
+
+    Args:
+        channel_name: Название канала
+        channel_config: Конфигурация канала
+    """
+    chat_id = channel_config["chat_id"]
+    add_route(chat_id, channel_name, channel_config)
+    logger.info(f"Маршрут добавлен для канала '{channel_name}' (чат ID: {chat_id})")
+
+    # Ранний старт: слушаем и сам канал, чтобы начать генерацию до появления копии в чате
+    if is_early_start(channel_config):
+        channel_id = channel_config["channel_id"]
+        add_route(channel_id, channel_name, channel_config, early=True)
+        logger.info(f"Ранний старт включен для канала '{channel_name}' (канал ID: {channel_id})")
+
+
+def get_route_stats() -> dict:
+    """
+    Возвращает счетчики сообщений по маршрутам
+
+    Returns:
+        dict: {"routes": {название маршрута: {"messages", "errors", "dropped"}}, "unrouted": количество,
+            "prefiltered": сколько всего обновлений отброшено фильтром сырых обновлений,
+            "pending_albums": {"count", "bytes"} - собираемые альбомы и их объем в памяти}
+    """
+    stats = {}
+    # У одного маршрута может быть несколько ключей, считаем его один раз
+    for route in {id(route): route for route in routes.values()}.values():
+        name = f"{route['channel_name']} (канал)" if route["early"] else route["channel_name"]
+        stats[name] = {"messages": route["messages"], "errors": route["errors"], "dropped": route["dropped"]}
+    pending_albums = {
+        "count": len(message_groups),
+        "bytes": sum(snapshot.memory_size() for snapshot in message_groups.values()),
+    }
+    prefiltered = unrouted_messages + sum(route_stats["dropped"] for route_stats in stats.values())
+    return {"routes": stats, "unrouted": unrouted_messages, "prefiltered": prefiltered, "pending_albums": pending_albums}
+
+
+def is_channel_post(message, channel_id: int) -> bool:
+    """Отправлено ли сообщение в чате обсуждения от имени канала (копия поста)"""
+    from_id = message.from_id
+    return isinstance(from_id, PeerChannel) and utils.get_peer_id(from_id) == channel_id
+
+
+def claim_message(chat_id: int, message_id: int) -> bool:
+    """
+    Отмечает сообщение чата обсуждения как взятое в обработку
+
+    Returns:
+        bool: False если сообщение уже обрабатывается или обработано
+    """
+    key = (chat_id, message_id)
+    if key in handled_messages:
+        return False
+    handled_messages[key] = True
+    while len(handled_messages) > HANDLED_MESSAGES_LIMIT:
+        handled_messages.popitem(last=False)
+    return True
+
+
+def release_messages(chat_id: int, message_ids: list):
+    """Снимает отметку взятия в обработку, чтобы догрузка пропущенных постов могла взять сообщения повторно"""
+    for message_id in message_ids:
+        handled_messages.pop((chat_id, message_id), None)
+
+
+async def prefilter_update(update):
+    """
+    Дешевый фильтр на уровне сырых обновлений
+
+    Регистрируется раньше dispatch_message. Для сообщений из чужих чатов и обычных комментариев
+    в чатах обсуждения останавливает обработку, поэтому Telethon не строит для них
+    событие NewMessage и они не доходят до handle_channel_message.
+
+    Args:
+        update: Сырое обновление Telegram
+    """
+    global unrouted_messages
+    message = update.message
+    if not isinstance(message, Message):
+        return
+
+    route = routes.get(utils.get_peer_id(message.peer_id))
+    if route is None:
+        unrouted_messages += 1
+        raise events.StopPropagation
+
+    # В самом канале все сообщения - посты
+    if route["early"]:
+        return
+
+    # В чате обсуждения пропускаем только автоматические копии постов связанного канала
+    if is_channel_post(message, route["channel_config"]["channel_id"]):
+        return
+
+    route["dropped"] += 1
+    raise events.StopPropagation
+
+
+async def dispatch_message(event):
+    """
+    Единый обработчик новых сообщений: находит маршрут по ID чата за O(1)
+
+    Args:
+        event: Событие Telegram
+    """
+    global unrouted_messages
+    if not _accepting:
+        return
+
+    route = routes.get(event.chat_id)
+    if route is None:
+        unrouted_messages += 1
+        return
+
+    # Сообщение из чата обсуждения могла уже взять в обработку догрузка пропущенных постов
+    if not route["early"] and not claim_message(event.chat_id, event.message.id):
+        return
+
+    route["messages"] += 1
+    # Отметка канала не сдвинется дальше сообщения чата обсуждения, пока его обработка не завершится
+    channel_id = route["channel_config"]["channel_id"]
+    if not route["early"]:
+        start_messages(channel_id, [event.message.id])
+    try:
+        with _track_in_flight():
+            handled = await handle_channel_message(event, route["channel_name"], route["channel_config"],
+                                                   route["early"])
+    except Exception:
+        route["errors"] += 1
+        raise
+
+    if not route["early"]:
+        if handled:
+            finish_messages(channel_id, [event.message.id])
+        else:
+            # Пост не обработан: его возьмет следующая догрузка пропущенных постов
+            release_messages(event.chat_id, [event.message.id])
+        try:
+            await advance_watermark(channel_id, route["channel_config"]["chat_id"], event.message.id)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении отметки канала '{route['channel_name']}': {e}")
+
+
+async def catch_up_post(messages: list, chat_id: int, channel_name: str, channel_config: dict):
+    """
+    Обрабатывает пропущенный пост (одиночное сообщение или альбом) через обычный конвейер
+
+    Args:
+        messages: Сообщения поста в чате обсуждения
+        chat_id: ID чата обсуждения (в формате event.chat_id)
+        channel_name: Название канала
+        channel_config: Конфигурация канала
+
+    Returns:
+        bool: False если обработка не удалась и пост нужно взять повторно
+    """
+    if len(messages) == 1:
+        return await handle_post_message(messages[0], chat_id, channel_name, channel_config)
+
+    group_id = (chat_id, messages[0].grouped_id)
+    if group_id in processed_groups or group_id in message_groups:
+        return True
+    snapshot = PostSnapshot(channel_name, channel_config["channel_id"])
+    for message in messages:
+        add_to_snapshot(snapshot, message)
+    message_groups[group_id] = snapshot
+    try:
+        await process_message_group(group_id, channel_name, channel_config)
+    finally:
+        message_groups.pop(group_id, None)
+    return True
+
+
+async def catch_up_channel(channel_name: str, channel_config: dict, semaphore: asyncio.Semaphore) -> int:
+    """
+    Догружает посты, появившиеся в чате обсуждения после последней отметки канала
+
+    При первом запуске отметка ставится на последнее сообщение чата, история не догружается.
+
+    Args:
+        channel_name: Название канала
+        channel_config: Конфигурация канала
+        semaphore: Общее ограничение параллельной обработки пропущенных постов
+
+    Returns:
+        int: Количество отправленных в обработку постов
+    """
+    channel_id = channel_config["channel_id"]
+    chat_id = channel_config["chat_id"]
+
+    watermark = await get_watermark(channel_id)
+    if watermark is None:
+        latest = await client.get_messages(chat_id, limit=1)
+        if latest:
+            await advance_watermark(channel_id, chat_id, latest[0].id)
+            logger.info(f"📍 Отметка канала '{channel_name}' установлена на сообщение {latest[0].id}")
+        return 0
+
+    now = datetime.now(timezone.utc)
+    newest_allowed = now - timedelta(seconds=CATCH_UP_MIN_AGE)
+    # Посты старше дедлайна канала планировщик все равно отбросит: не скачиваем для них медиа
+    max_age = min(CATCH_UP_MAX_AGE, channel_config.get("deadline", COMMENT_DEADLINE))
+    oldest_allowed = now - timedelta(seconds=max_age)
+
+    # Берем только копии постов канала, от отметки к новым: сообщения участников не занимают лимит,
+    # а при достижении лимита более новые посты остаются за отметкой до следующей догрузки
+    messages = []
+    next_message = None
+    async for message in client.iter_messages(chat_id, min_id=watermark, from_user=channel_id, reverse=True):
+        if message.date > newest_allowed:
+            break
+        if len(messages) >= CATCH_UP_LIMIT:
+            next_message = message
+            break
+        messages.append(message)
+    if not messages:
+        return 0
+    # Альбом, не поместившийся в лимит, догружается целиком в следующий раз
+    grouped_id = messages[-1].grouped_id
+    if next_message is not None and grouped_id and next_message.grouped_id == grouped_id:
+        album_start = next(index for index, message in enumerate(messages) if message.grouped_id == grouped_id)
+        if album_start:
+            messages = messages[:album_start]
+    last_message_id = messages[-1].id
+
+    # Собираем посты: альбомы - по grouped_id, остальные сообщения - по одному
+    posts = OrderedDict()
+    skipped_old = []
+    for message in messages:
+        if not isinstance(message, Message) or not is_channel_post(message, channel_id):
+            continue
+        if message.date < oldest_allowed:
+            skipped_old.append(message.id)
+            continue
+        key = ("group", message.grouped_id) if message.grouped_id else ("message", message.id)
+        posts.setdefault(key, []).append(message)
+
+    marked_chat_id = utils.get_peer_id(messages[0].peer_id)
+    claimed = []
+    for post_messages in posts.values():
+        # Пост целиком берем в обработку, только если его еще не взял живой обработчик
+        if all(claim_message(marked_chat_id, message.id) for message in post_messages):
+            claimed.append(post_messages)
+
+    if claimed or skipped_old:
+        logger.info(f"🔄 Догрузка канала '{channel_name}': пропущенных постов {len(claimed)}, "
+                    f"слишком старых {len(skipped_old)} (после сообщения {watermark})")
+    # Слишком старые посты (в том числе не обработанные ранее из-за ошибки) больше не ждем
+    finish_messages(channel_id, skipped_old)
+
+    # Посты, ожидающие своей очереди, тоже держат отметку
+    for post_messages in claimed:
+        start_messages(channel_id, [message.id for message in post_messages])
+
+    async def process_one(post_messages):
+        message_ids = [message.id for message in post_messages]
+        async with semaphore:
+            if not _accepting:
+                return
+            handled = False
+            try:
+                with _track_in_flight():
+                    handled = await catch_up_post(post_messages, marked_chat_id, channel_name, channel_config)
+            except Exception as e:
+                logger.error(f"Ошибка при догрузке поста {post_messages[0].id} канала '{channel_name}': {e}")
+            if handled:
+                finish_messages(channel_id, message_ids)
+            else:
+                # Отметка остается перед постом, следующая догрузка возьмет его повторно
+                release_messages(marked_chat_id, message_ids)
+
+    await asyncio.gather(*(process_one(post_messages) for post_messages in claimed))
+    # При остановке часть постов могла остаться необработанной: отметку не сдвигаем
+    if _accepting:
+        await advance_watermark(channel_id, chat_id, last_message_id)
+    return len(claimed)
+
+
+async def catch_up_channels() -> int:
+    """
+    Догружает пропущенные посты всех каналов
+
+    Returns:
+        int: Количество отправленных в обработку постов
+    """
+    semaphore = asyncio.Semaphore(CATCH_UP_CONCURRENCY)
+
+    async def catch_up_one(channel_name, channel_config):
+        try:
+            return await catch_up_channel(channel_name, channel_config, semaphore)
+        except Exception as e:
+            logger.error(f"Ошибка при догрузке канала '{channel_name}': {e}")
+            return 0
+
+    results = await asyncio.gather(
+        *(catch_up_one(channel_name, channel_config) for channel_name, channel_config in CHANNELS.items())
+    )
+    return sum(results)
+
+
+async def catch_up_loop():
+    """
+    Догружает пропущенные посты при запуске и затем периодически
+
+    Telethon переподключается сам и не сообщает об обрывах связи, поэтому посты,
+    пропущенные во время переподключения, находит периодическая проверка отметок.
+    """
+    while _accepting:
+        await catch_up_channels()
+        if CATCH_UP_INTERVAL <= 0:
+            return
+        await asyncio.sleep(CATCH_UP_INTERVAL)
+
+
 async def setup_channel_handlers(telethon_client: TelegramClient):
     """
-    Настраивает обработчики для всех каналов из конфигурации
+    Настраивает единый обработчик и маршруты для всех каналов из конфигурации
     
     Args:
         telethon_client: Клиент Telethon
@@ -474,51 +1026,16 @@ async def setup_channel_handlers(telethon_client: TelegramClient):
     global client
     client = telethon_client
     
+    # Сначала дешевый фильтр сырых обновлений: комментарии пользователей отбрасываются
+    # до построения полноценного события
+    telethon_client.add_event_handler(prefilter_update, events.Raw(types=[UpdateNewChannelMessage]))
+    
+    # Один обработчик на все чаты: Telethon не проверяет фильтр каждого канала
+    # для каждого обновления, а маршрут ищется по словарю
+    telethon_client.add_event_handler(dispatch_message, events.NewMessage())
+    
     for channel_name, channel_config in CHANNELS.items():
         try:
-            chat_id = channel_config["chat_id"]
-            
-            # Создаем обработчик для конкретного канала
-            handler = lambda event, name=channel_name, config=channel_config: handle_channel_message(event, name, config)
-            
-            # Добавляем обработчик событий
-            telethon_client.add_event_handler(handler, events.NewMessage(chats=chat_id))
-            event_handlers[channel_name] = handler
-            
-            logger.info(f"Обработчик добавлен для канала '{channel_name}' (чат ID: {chat_id})")
-            
+            add_channel(channel_name, channel_config)
         except Exception as e:
             logger.error(f"Ошибка при настройке обработчика для канала '{channel_name}': {e}")
-
-
-async def cleanup_temp_files():
-    """Очищает временные файлы с фотографиями"""
-    try:
-        # Очищаем все файлы из папки temp
-        if TEMP_DIR.exists():
-            for file_path in TEMP_DIR.iterdir():
-                if file_path.is_file():
-                    try:
-                        file_path.unlink()
-                        logger.info(f"Удален временный файл: {file_path}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при удалении файла {file_path}: {e}")
-        
-        # Также очищаем файлы из базы данных (для совместимости)
-        for channel_name, channel_config in CHANNELS.items():
-            # Получаем все записи с фото
-            comments_with_photos = await Comment.filter(
-                channel_id=channel_config["channel_id"],
-                photo_path__isnull=False
-            ).all()
-            
-            for comment in comments_with_photos:
-                if comment.photo_path and os.path.exists(comment.photo_path):
-                    try:
-                        os.remove(comment.photo_path)
-                        logger.info(f"Удален файл из БД: {comment.photo_path}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при удалении файла {comment.photo_path}: {e}")
-                        
-    except Exception as e:
-        logger.error(f"Ошибка при очистке временных файлов: {e}")
@@ -0,0 +1,102 @@
+import logging
+import time
+from tortoise import Tortoise
+from models import ChannelWatermark
+from config import CATCH_UP_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+# Отметка только растет: посты могут обрабатываться параллельно и завершаться не по порядку
+ADVANCE_WATERMARK_SQL = """
+INSERT INTO channel_watermarks (channel_id, chat_id, last_message_id, updated_at)
+VALUES ($1, $2, $3, NOW())
+ON CONFLICT (channel_id) DO UPDATE
+SET last_message_id = GREATEST(channel_watermarks.last_message_id, EXCLUDED.last_message_id),
+    chat_id = EXCLUDED.chat_id,
+    updated_at = NOW()
+"""
+
+# Последние сохраненные отметки, чтобы не писать в БД, если отметка не выросла: {channel_id: message_id}
+_cache = {}
+# Сообщения, обработка которых еще идет или не удалась: {channel_id: {message_id: time.monotonic() начала}}.
+# Отметка не сдвигается дальше них, чтобы догрузка пропущенных постов могла взять их повторно
+_unfinished = {}
+# До какого сообщения отметку просили сдвинуть: {channel_id: message_id}
+_requested = {}
+
+
+async def get_watermark(channel_id: int) -> int:
+    """
+    Возвращает ID последнего обработанного сообщения в чате обсуждения канала
+
+    Args:
+        channel_id: ID канала
+
+    Returns:
+        int: ID сообщения или None, если канал еще не обрабатывался
+    """
+    watermark = await ChannelWatermark.get_or_none(channel_id=channel_id)
+    if watermark is None:
+        return None
+    _cache[channel_id] = max(_cache.get(channel_id, 0), watermark.last_message_id)
+    return _cache[channel_id]
+
+
+def start_messages(channel_id: int, message_ids: list):
+    """
+    Отмечает сообщения чата обсуждения как обрабатываемые: отметка канала не сдвинется дальше них,
+    пока не будет вызван finish_messages (или не пройдет CATCH_UP_MAX_AGE секунд)
+
+    Args:
+        channel_id: ID канала
+        message_ids: ID сообщений поста в чате обсуждения
+    """
+    started = time.monotonic()
+    unfinished = _unfinished.setdefault(channel_id, {})
+    for message_id in message_ids:
+        unfinished[message_id] = started
+
+
+def finish_messages(channel_id: int, message_ids: list):
+    """
+    Отмечает сообщения обработанными (или больше не нуждающимися в обработке)
+
+    Args:
+        channel_id: ID канала
+        message_ids: ID сообщений поста в чате обсуждения
+    """
+    unfinished = _unfinished.get(channel_id, {})
+    for message_id in message_ids:
+        unfinished.pop(message_id, None)
+
+
+async def advance_watermark(channel_id: int, chat_id: int, message_id: int):
+    """
+    Сдвигает отметку канала вперед, если сообщение новее уже обработанных
+
+    Отметка останавливается перед самым старым сообщением, обработка которого еще идет или не удалась;
+    когда оно будет обработано, следующий вызов сдвинет отметку до запрошенной.
+
+    Args:
+        channel_id: ID канала
+        chat_id: ID чата обсуждения
+        message_id: ID обработанного сообщения в чате обсуждения
+    """
+    message_id = max(message_id, _requested.get(channel_id, 0))
+    _requested[channel_id] = message_id
+
+    unfinished = _unfinished.get(channel_id)
+    if unfinished:
+        # Посты старше CATCH_UP_MAX_AGE догрузка уже не возьмет: больше их не ждем
+        expired_before = time.monotonic() - CATCH_UP_MAX_AGE
+        for unfinished_id, started in list(unfinished.items()):
+            if started < expired_before:
+                del unfinished[unfinished_id]
+        if unfinished:
+            message_id = min(message_id, min(unfinished) - 1)
+
+    if message_id <= _cache.get(channel_id, 0):
+        return
+    _cache[channel_id] = message_id
+    conn = Tortoise.get_connection("default")
+    await conn.execute_query(ADVANCE_WATERMARK_SQL, [channel_id, chat_id, message_id])
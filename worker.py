@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+from config import WORKER_CONCURRENCY, JOB_LOCK_TIMEOUT, SHUTDOWN_TIMEOUT
+from database import init_database, close_database
+from jobs import JobListener, claim_job, complete_job, fail_job, requeue_stale_jobs, snapshot_from_job
+from pipeline import process_post
+from post_snapshot import PostSnapshot
+import media_store
+import diagnostics
+from bot import bot, flush_digest
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Событие остановки: устанавливается по сигналу
+_stop = asyncio.Event()
+
+# Как часто проверять очередь, если уведомление потерялось (секунды)
+POLL_INTERVAL = 5
+
+# Имя воркера для диагностики зависших задач
+WORKER_NAME = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def signal_handler(signum):
+    """Обработчик сигналов остановки"""
+    logger.info(f"Получен сигнал {signal.Signals(signum).name}, завершение работы воркера...")
+    _stop.set()
+
+
+async def materialize_photos(snapshot: PostSnapshot):
+    """
+    Сохраняет фото поста из задачи в локальное хранилище медиа для превью
+
+    Args:
+        snapshot: Пост, восстановленный из задачи
+    """
+    for photo in snapshot.photos:
+        _, photo.path = await media_store.store_bytes(photo.data, '.jpg')
+
+
+async def handle_job(job):
+    """Выполняет одну задачу: генерация комментария и отправка превью"""
+    logger.info(f"⚙️  Воркер {WORKER_NAME} взял задачу {job.id} (message_id={job.message_id})")
+    try:
+        snapshot = snapshot_from_job(job)
+        await materialize_photos(snapshot)
+        await process_post(snapshot)
+        await complete_job(job)
+        logger.info(f"   ✅ Задача {job.id} выполнена")
+    except Exception as e:
+        logger.error(f"   ❌ Ошибка при выполнении задачи {job.id}: {e}")
+        await fail_job(job, str(e))
+
+
+async def consume(listener: JobListener):
+    """Разбирает очередь, пока воркер не остановлен (начатая задача доделывается)"""
+    while not _stop.is_set():
+        listener.clear()
+        try:
+            job = await claim_job(WORKER_NAME)
+        except Exception as e:
+            logger.error(f"Ошибка при получении задачи из очереди: {e}")
+            job = None
+
+        if job is None:
+            await listener.wait(POLL_INTERVAL)
+            continue
+
+        await handle_job(job)
+
+
+async def requeue_loop():
+    """Периодически возвращает в очередь зависшие задачи"""
+    while not _stop.is_set():
+        try:
+            await requeue_stale_jobs()
+        except Exception as e:
+            logger.error(f"Ошибка при возврате зависших задач: {e}")
+        await asyncio.sleep(max(JOB_LOCK_TIMEOUT // 2, POLL_INTERVAL))
+
+
+async def main():
+    """Основная функция воркера"""
+    logger.info(f"Запуск воркера генерации {WORKER_NAME} (параллельность: {WORKER_CONCURRENCY})...")
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, signal_handler, signum)
+
+    listener = JobListener()
+    consumers = []
+    tasks = []
+    # Блокировки цикла событий логируются со стеком (команды /profile и /slow есть только в main.py)
+    diagnostics.start_loop_monitor()
+    try:
+        await init_database()
+        media_store.start_store()
+        await listener.start()
+
+        consumers = [asyncio.create_task(consume(listener)) for _ in range(WORKER_CONCURRENCY)]
+        tasks = consumers + [asyncio.create_task(requeue_loop())]
+        logger.info("Воркер запущен. Нажмите Ctrl+C для остановки.")
+
+        await _stop.wait()
+    except Exception as e:
+        logger.error(f"Критическая ошибка в воркере: {e}")
+    finally:
+        logger.info("Остановка воркера...")
+        _stop.set()
+        # Будим ожидающих и даем доделать начатые задачи; неуспевшие вернутся в очередь
+        # после JOB_LOCK_TIMEOUT
+        listener.wake()
+        if consumers:
+            _, pending = await asyncio.wait(consumers, timeout=SHUTDOWN_TIMEOUT)
+            if pending:
+                logger.warning(f"Не дождались завершения задач: {len(pending)}")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await listener.stop()
+        await media_store.stop_store()
+        diagnostics.stop_loop_monitor()
+        try:
+            # Отправляем накопленный дайджест, чтобы не потерять превью
+            await flush_digest()
+            await bot.session.close()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии сессии бота: {e}")
+        await close_database()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Воркер остановлен пользователем")
+    finally:
+        logger.info("Воркер завершен")